@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+
+import eHive
+
+from ..loader.db import dal
+from . import param_defaults, loaded_db_url
+
+logger = logging.getLogger(__name__)
+
+
+class OLSBuildIndexes(eHive.BaseRunnable):
+    """ Build secondary indexes dropped for a full load ('full_load' param), once all ontologies are loaded
+
+    Runs once, after every terms loader and report: indexes are then built in a single pass per table, while no
+    other job writes to the tables.
+    """
+
+    def run(self):
+        self.input_job.transient_error = False
+        dal.db_init(loaded_db_url(self), **param_defaults())
+        try:
+            built = dal.create_secondary_indexes()
+        finally:
+            dal.connection.close()
+            dal.engine.dispose()
+        self.dataflow({'nb_indexes': len(built)})
+
+    def write_output(self):
+        logger.info('Secondary indexes built')
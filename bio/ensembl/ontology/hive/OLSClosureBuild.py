@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+
+import eHive
+from eHive import JobFailedException
+
+from ..loader.closure import compute_closures, ontologies_ids, closure_relation_types
+from ..loader.db import dal
+from . import param_defaults, loaded_db_url
+
+logger = logging.getLogger(__name__)
+
+
+class OLSClosureBuild(eHive.BaseRunnable):
+    """ Compute closures of all loaded ontologies at once, in parallel over a pool of processes """
+
+    def run(self):
+        self.input_job.transient_error = False
+        dal.db_init(loaded_db_url(self), **param_defaults())
+        ontologies = self.param('ontologies') if self.param_is_defined('ontologies') else None
+        with dal.engine.connect() as connection:
+            ontologies = ontologies_ids(connection, ontologies)
+        if not ontologies:
+            raise JobFailedException("No ontology loaded")
+        relation_types = self.param('closure_relation_types') if self.param_is_defined('closure_relation_types') \
+            else closure_relation_types
+        workers = self.param('closure_workers') if self.param_is_defined('closure_workers') else None
+        counts = compute_closures(dal.engine, ontologies, relation_types, workers, self.param('output_dir'))
+        self.dataflow({'nb_closures': sum(counts.values())})
+
+    def write_output(self):
+        logger.info('Ontologies closures computed')
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+
+import eHive
+from eHive import JobFailedException
+
+from . import param_defaults, loaded_db_url
+from ..loader.ols import OlsLoader
+
+logger = logging.getLogger(__name__)
+
+
+class OLSClosureUpdate(eHive.BaseRunnable):
+    """ Apply ontology relations changes to its closure, instead of computing it again from scratch """
+
+    def run(self):
+        options = param_defaults()
+        options['ols_api_url'] = self.param('ols_api_url')
+        options['output_dir'] = self.param('output_dir')
+        if self.param_is_defined('closure_relation_types'):
+            options['closure_relation_types'] = self.param('closure_relation_types')
+        self.input_job.transient_error = False
+        ontology_name = self.param_required('ontology_name')
+        ols_loader = OlsLoader(loaded_db_url(self), **options)
+        if not ols_loader.ontology_ids(ontology_name):
+            raise JobFailedException("Ontology %s not loaded" % ontology_name)
+        changes = ols_loader.update_closure(ontology_name)
+        self.dataflow({'ontology_name': ontology_name,
+                       'nb_inserted': changes['inserted'],
+                       'nb_deleted': changes['deleted']})
+
+    def write_output(self):
+        logger.info('Ontology %s closure updated', self.param_required('ontology_name'))
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+
+import eHive
+
+from ..loader.ols import drop_staging
+from . import param_defaults, loaded_db_url
+
+logger = logging.getLogger(__name__)
+
+
+class OLSDropStaging(eHive.BaseRunnable):
+    """ Drop staging tables created by OLSHiveLoader ('staging' param), once every ontology report merged its rows
+
+    Runs once, after every report: no terms loader appends rows anymore.
+    """
+
+    def run(self):
+        self.input_job.transient_error = False
+        drop_staging(loaded_db_url(self), **param_defaults())
+
+    def write_output(self):
+        logger.info('Staging tables dropped')
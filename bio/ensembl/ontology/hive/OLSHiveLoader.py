@@ -17,6 +17,7 @@ from urllib import parse
 import eHive
 
 from bio.ensembl.ontology.loader.ols import init_schema
+from bio.ensembl.ontology.loader.shadow import create_shadow
 from . import param_defaults
 
 
@@ -26,6 +27,12 @@ class OLSHiveLoader(eHive.BaseRunnable):
     def run(self):
         options = param_defaults()
         options['ens_version'] = self.param_required('ens_version')
+        if self.param_is_defined('full_load'):
+            # create tables without secondary indexes, built once all ontologies are loaded (see OLSBuildIndexes)
+            options['full_load'] = self.param('full_load')
+        if self.param_is_defined('staging'):
+            # staging tables shared by terms loaders, dropped once merged (see OLSDropStaging)
+            options['staging'] = self.param('staging')
         # add loader option such as page_size, base_site for testing
         db_url_parts = parse.urlparse(self.param_required('db_url'))
         assert db_url_parts.scheme in ('mysql', 'mysql+pymysql')
@@ -36,4 +43,9 @@ class OLSHiveLoader(eHive.BaseRunnable):
             assert db_url_parts.password != ''
         os.makedirs(self.param_required('output_dir'), exist_ok=True)
 
-        init_schema(self.param_required('db_url'), **options)
+        db_url = self.param_required('db_url')
+        if self.param_is_defined('shadow') and self.param('shadow'):
+            # build release in a shadow db, swapped in place of release db once loaded (see OLSShadowSwap)
+            db_url = create_shadow(db_url)
+            options['full_load'] = True
+        init_schema(db_url, **options)
@@ -18,7 +18,7 @@ import logging
 import eHive
 from eHive import JobFailedException
 
-from . import param_defaults
+from . import param_defaults, loaded_db_url
 from ..loader.ols import OlsLoader
 
 logger = logging.getLogger(__name__)
@@ -34,11 +34,26 @@ class OLSImportReport(eHive.BaseRunnable):
         options['ols_api_url'] = self.param('ols_api_url')
         options['page_size'] = self.param('page_size')
         options['output_dir'] = self.param('output_dir')
+        staging = self.param_is_defined('staging') and self.param('staging')
+        if self.param_is_defined('ontology_file'):
+            options['ontology_files'] = {self.param_required('ontology_name').upper(): self.param('ontology_file')}
         self.input_job.transient_error = False
         logger.info('Creating loading report for %s', self.param_required('ontology_name'))
-        ols_loader = OlsLoader(self.param_required('db_url'), **options)
+        ols_loader = OlsLoader(loaded_db_url(self), **options)
         if not self.param_required('ontology_name').upper() in ols_loader.allowed_ontologies:
             raise JobFailedException("Ontology %s not implemented" % self.param_required('ontology_name'))
+        if staging:
+            # terms loaders only appended rows to staging tables
+            ols_loader.merge_staging(self.param_required('ontology_name'))
+        if self.param_is_defined('incremental') and self.param('incremental'):
+            # changed ontology is only marked as loaded once all its terms are, terms it no longer has removed
+            ols_loader.remove_absent_terms(self.param_required('ontology_name'))
+            ols_loader.update_version(self.param_required('ontology_name'))
+        full_load = self.param_is_defined('full_load') and self.param('full_load') or \
+            self.param_is_defined('shadow') and self.param('shadow')
+        if self.param_is_defined('closure') and self.param('closure') and not full_load:
+            # in place of former Perl closure script, full loads compute it in OLSClosureBuild after OLSBuildIndexes
+            ols_loader.load_closure(self.param_required('ontology_name'))
         ols_loader.final_report(self.param_required('ontology_name'))
         self.dataflow({
             'ontology_name': self.param_required('ontology_name'),
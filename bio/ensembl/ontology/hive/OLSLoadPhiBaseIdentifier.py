@@ -19,7 +19,7 @@ import eHive
 
 from bio.ensembl.ontology.loader.db import dal
 from bio.ensembl.ontology.loader.models import Ontology, Term, Relation, RelationType, get_one_or_create
-from bio.ensembl.ontology.hive import param_defaults
+from bio.ensembl.ontology.hive import param_defaults, loaded_db_url
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +31,7 @@ class OLSLoadPhiBaseIdentifier(eHive.BaseRunnable):
         options = param_defaults()
 
         logger.info('Loading PHIBASe Identifier terms')
-        dal.db_init(self.param_required('db_url'), **options)
+        dal.db_init(loaded_db_url(self), **options)
         with dal.session_scope() as session:
             # delete phi-base-identifier namespaces ontology
             if self.param_required('_start_term_index') == 0:
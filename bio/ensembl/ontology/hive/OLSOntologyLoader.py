@@ -19,7 +19,7 @@ from eHive import JobFailedException
 
 from bio.ensembl.ontology.loader.db import dal
 from bio.ensembl.ontology.loader.ols import OlsLoader
-from . import param_defaults, log_levels
+from . import param_defaults, log_levels, loaded_db_url
 
 
 class OLSOntologyLoader(eHive.BaseRunnable):
@@ -28,23 +28,37 @@ class OLSOntologyLoader(eHive.BaseRunnable):
     def run(self):
         options = param_defaults()
         options['wipe'] = self.param('wipe_one')
+        incremental = self.param_is_defined('incremental') and self.param('incremental')
+        options['incremental'] = incremental
         self.input_job.transient_error = False
         options['ols_api_url'] = self.param('ols_api_url')
         options['page_size'] = self.param('page_size')
         options['output_dir'] = self.param('output_dir')
-        ols_loader = OlsLoader(self.param_required('db_url'), **options)
+        for option in ('cache_dir', 'cache_ttl', 'cache_max_size', 'offline', 'max_retry', 'timeout'):
+            if self.param_is_defined(option):
+                options[option] = self.param(option)
+        if self.param_is_defined('ontology_file'):
+            # load ontology from a local OBO / obographs file instead of OLS
+            options['ontology_files'] = {self.param_required('ontology_name').upper(): self.param('ontology_file')}
+        ols_loader = OlsLoader(loaded_db_url(self), **options)
         # TODO update options with loader params
         logging.basicConfig(level=log_levels.get(self.param('verbosity'), logging.ERROR),
                             datefmt='%m-%d %H:%M:%S')
         logger = ols_loader.get_ontology_logger(self.param_required('ontology_name'))
         logger.info('Loading ontology info %s', self.param_required('ontology_name'))
-        if self.param_required('wipe_one') == 1:
+        if self.param_required('wipe_one') == 1 and not incremental:
             logger.info("Wiping existing ontology data %s", self.param_required('ontology_name'))
             ols_loader.wipe_ontology(self.param_required('ontology_name'))
         if not self.param_required('ontology_name').upper() in ols_loader.allowed_ontologies:
             raise JobFailedException("Ontology %s not implemented" % self.param_required('ontology_name'))
+        if incremental and not ols_loader.ontology_changed(self.param_required('ontology_name')):
+            # same update and version as already loaded, no terms to load
+            logger.info('Ontology %s unchanged, skipped', self.param_required('ontology_name'))
+            self.dataflow({"ontology_name": self.param_required('ontology_name'), "nb_terms": 0})
+            return
 
         with dal.session_scope() as session:
             m_ontology = ols_loader.load_ontology(self.param_required('ontology_name'), session=session)
             session.add(m_ontology)
+            ols_loader.load_subsets(self.param_required('ontology_name'), session)
             self.dataflow({"ontology_name": self.param_required('ontology_name'), "nb_terms": m_ontology.number_of_terms})
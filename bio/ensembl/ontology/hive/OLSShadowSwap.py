@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import logging
+
+import eHive
+from eHive import JobFailedException
+
+from ..loader.db import dal
+from ..loader.shadow import shadow_url, validate_shadow, swap_shadow
+from . import param_defaults
+
+logger = logging.getLogger(__name__)
+
+
+class OLSShadowSwap(eHive.BaseRunnable):
+    """ Swap shadow db built by pipeline ('shadow' param) in place of release db, once validated """
+
+    def run(self):
+        self.input_job.transient_error = False
+        db_url = self.param_required('db_url')
+        shadow = shadow_url(db_url)
+        dal.db_init(shadow, **param_defaults())
+        # secondary indexes are built by OLSBuildIndexes, a shadow db without them is not complete
+        missing = [index.name for index in dal.secondary_indexes()
+                   if index.name not in dal.existing_indexes(index.table)]
+        dal.connection.close()
+        dal.engine.dispose()
+        if missing:
+            raise JobFailedException('Shadow db misses indexes {}'.format(missing))
+        ontologies = self.param('ontologies') if self.param_is_defined('ontologies') else None
+        min_ratio = self.param('min_ratio') if self.param_is_defined('min_ratio') else 0.9
+        try:
+            terms = validate_shadow(shadow, db_url, ontologies, min_ratio)
+        except RuntimeError as e:
+            raise JobFailedException(str(e))
+        swap_shadow(db_url, shadow)
+        self.dataflow({'db_url': db_url, 'nb_terms': sum(terms.values())})
+
+    def write_output(self):
+        logger.info('Release db %s swapped', self.param_required('db_url'))
@@ -18,7 +18,7 @@ import eHive
 from eHive import JobFailedException
 
 from ebi.ols.api import exceptions
-from . import param_defaults, log_levels
+from . import param_defaults, log_levels, loaded_db_url
 from ..loader.ols import OlsLoader
 
 
@@ -32,11 +32,27 @@ class OLSTermsLoader(eHive.BaseRunnable):
         options['page_size'] = self.param('page_size')
         options['output_dir'] = self.param('output_dir')
         options['page_size'] = 200
+        for option in ('prefetch_pages', 'extraction', 'max_in_flight', 'cache_dir', 'cache_ttl', 'cache_max_size',
+                       'offline', 'lookup_cache_size', 'max_retry', 'timeout', 'initial_in_flight', 'backoff_factor',
+                       'backoff_max', 'batch_size', 'upsert', 'identity_cache_size', 'fast_load', 'staging',
+                       'fresh_load', 'incremental'):
+            if self.param_is_defined(option):
+                options[option] = self.param(option)
+        if self.param_is_defined('shadow') and self.param('shadow'):
+            # nothing to look up in a shadow db being built, rows are written by batches
+            options.setdefault('fresh_load', True)
+            options.setdefault('batch_size', 1000)
+        if self.param_is_defined('ontology_file'):
+            # load ontology from a local OBO / obographs file instead of OLS
+            options['ontology_files'] = {self.param_required('ontology_name').upper(): self.param('ontology_file')}
+        if self.param_is_defined('edges_file'):
+            # relations read from an OBO / obographs dump with 'bulk' extraction
+            options['edges_files'] = {self.param_required('ontology_name').upper(): self.param('edges_file')}
         log_level = log_levels.get(self.param('verbosity'), logging.ERROR)
         log_level = logging.DEBUG
         options['verbosity'] = log_level
         logging.basicConfig(level=log_level, datefmt='%m-%d %H:%M:%S')
-        ols_loader = OlsLoader(self.param_required('db_url'), **options)
+        ols_loader = OlsLoader(loaded_db_url(self), **options)
         logger = ols_loader.get_ontology_logger(self.param_required('ontology_name'))
         self.input_job.transient_error = False
         logger.info('HiveTermsLoader: Loading %s ontology terms [%s..%s]',
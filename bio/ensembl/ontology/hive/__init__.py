@@ -14,6 +14,8 @@
 """
 import logging
 
+from ..loader.shadow import shadow_url
+
 db_base_name = 'ensembl_ontology'
 log_levels = {
     '1': logging.FATAL,
@@ -27,6 +29,14 @@ log_file = '%s_ontology.log'
 err_file = '%s_ontology.err'
 
 
+def loaded_db_url(runnable):
+    """ Url of db loaded by pipeline runnables: release db, or its shadow when building it with 'shadow' param """
+    db_url = runnable.param_required('db_url')
+    if runnable.param_is_defined('shadow') and runnable.param('shadow'):
+        return shadow_url(db_url)
+    return db_url
+
+
 def param_defaults():
     return {
         'drop_before': True,
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+from array import array
+
+from sqlalchemy import select, func
+from sqlalchemy.engine.url import make_url
+
+from .closure import closure_relation_types
+from .models import Ontology, Term, Relation
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['AncestorIndex', 'index_path', 'db_signature']
+
+
+def index_path(db_url, output_dir):
+    """
+    :param db_url: db url
+    :param output_dir: directory of index files
+    :return: path of db ancestors index file, named after db
+    """
+    if not output_dir:
+        raise ValueError('Ancestors index requires an output directory')
+    database = make_url(db_url).database
+    name = os.path.basename(database) if database and database != ':memory:' else 'ontology'
+    return os.path.join(output_dir, '{}.ancestors'.format(name))
+
+
+def db_signature(connection):
+    """
+    :param connection: db connection
+    :return: digest of loaded ontologies versions, and of number and last ids of terms and relations: reloaded
+    relations are inserted again with new ids
+    """
+    ontology = Ontology.__table__
+    term = Term.__table__
+    relation = Relation.__table__
+    digest = hashlib.sha1()
+    for row in connection.execute(select([ontology.c.name, ontology.c.namespace, ontology.c.data_version])
+                                  .order_by(ontology.c.name, ontology.c.namespace)):
+        digest.update(repr(tuple(row)).encode('utf-8'))
+    for column in (term.c.term_id, relation.c.relation_id):
+        row = connection.execute(select([func.count(column), func.max(column)])).first()
+        digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class AncestorIndex(object):
+    """ Precomputed ancestors of every term, for fast subsumption and common ancestors queries
+
+    Transitive closure held in memory: ancestors of each term are a sorted slice of a single array of node ids (see
+    graph.OntologyGraph), ancestors of node i being ancestors[offsets[i]:offsets[i + 1]], so that membership is a
+    binary search. Size grows as the closure does, i.e terms times their average number of ancestors.
+    Terms depths (shortest distance from a root) rank common ancestors.
+    Index is saved to a file, arrays as raw machine values after a JSON header holding accessions, arrays layout and
+    signature of the db index was built from.
+    """
+
+    arrays = ('offsets', 'ancestors', 'depths')
+
+    def __init__(self, accessions, offsets, ancestors, depths, relation_types=closure_relation_types, signature=None):
+        """
+        :param accessions: terms accessions, in node ids order
+        :param offsets: array of offsets of each node ancestors in ancestors array
+        :param ancestors: array of ancestors node ids, sorted per node
+        :param depths: array of nodes depths
+        :param relation_types: relation types names ancestors are reached through
+        :param signature: signature of db index is built from, see db_signature
+        """
+        self.accessions = accessions
+        self.index = {accession: node for node, accession in enumerate(accessions)}
+        self.offsets = offsets
+        self.ancestors = ancestors
+        self.depths = depths
+        self.relation_types = tuple(relation_types)
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __contains__(self, accession):
+        return accession in self.index
+
+    @classmethod
+    def from_graph(cls, graph, relation_types=closure_relation_types, signature=None):
+        """
+        Compute terms ancestors
+        :param graph: graph.OntologyGraph
+        :param relation_types: relation types names ancestors are reached through
+        :param signature: signature of db graph is read from
+        :return: AncestorIndex
+        """
+        size = len(graph)
+        offsets = array('L', [0]) * (size + 1)
+        ancestors = array('L')
+        for node, accession in enumerate(graph.accessions):
+            ancestors.extend(sorted(ancestor for ancestor, _ in graph.walk(accession, relation_types)))
+            offsets[node + 1] = len(ancestors)
+        # shortest distance from roots, walking down from all of them at once
+        depths = array('l', [-1]) * size
+        adjacencies = graph.adjacencies(relation_types, reverse=True)
+        level = [graph.node(accession) for accession in graph.roots(relation_types)]
+        depth = 0
+        while level:
+            next_level = []
+            for node in level:
+                depths[node] = depth
+            for node in level:
+                for child_offsets, children in adjacencies:
+                    for k in range(child_offsets[node], child_offsets[node + 1]):
+                        if depths[children[k]] < 0:
+                            depths[children[k]] = depth + 1
+                            next_level.append(children[k])
+            level = next_level
+            depth += 1
+        logger.info('Indexed %s ancestors of %s terms', len(ancestors), size)
+        return cls(list(graph.accessions), offsets, ancestors, depths, relation_types, signature)
+
+    @classmethod
+    def load(cls, path, signature=None):
+        """
+        :param path: index file path
+        :param signature: expected db signature, any if None
+        :return: AncestorIndex, None if file is missing or index was built from another db state
+        """
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if signature is not None and header['signature'] != signature:
+                    logger.info('Outdated ancestors index %s', path)
+                    return None
+                arrays = {}
+                for name in cls.arrays:
+                    typecode, itemsize, length = header['arrays'][name]
+                    arrays[name] = array(typecode)
+                    if arrays[name].itemsize != itemsize:
+                        logger.info('Ancestors index %s built on another platform', path)
+                        return None
+                    arrays[name].fromfile(f, length)
+                    if header['byteorder'] != sys.byteorder:
+                        arrays[name].byteswap()
+        except (OSError, EOFError, ValueError, KeyError, TypeError):
+            return None
+        return cls(header['accessions'], relation_types=header['relation_types'], signature=header['signature'],
+                   **arrays)
+
+    def save(self, path):
+        """
+        :param path: index file path, replaced at once
+        """
+        header = dict(accessions=self.accessions, relation_types=self.relation_types, signature=self.signature,
+                      byteorder=sys.byteorder, arrays={})
+        for name in self.arrays:
+            values = getattr(self, name)
+            header['arrays'][name] = (values.typecode, values.itemsize, len(values))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            for name in self.arrays:
+                getattr(self, name).tofile(f)
+        os.replace(tmp_path, path)
+        logger.info('Saved ancestors index %s', path)
+
+    def node_ancestors(self, node):
+        """
+        :param node: term node id
+        :return: array of ancestors node ids, sorted
+        """
+        return self.ancestors[self.offsets[node]:self.offsets[node + 1]]
+
+    def is_a(self, accession, ancestor):
+        """
+        :param accession: term accession
+        :param ancestor: candidate ancestor term accession
+        :return: whether term is ancestor term itself, or one of its descendants
+        """
+        node = self.index[accession]
+        target = self.index[ancestor]
+        if node == target:
+            return True
+        start = self.offsets[node]
+        end = self.offsets[node + 1]
+        k = bisect.bisect_left(self.ancestors, target, start, end)
+        return k < end and self.ancestors[k] == target
+
+    def common_nodes(self, accession, other):
+        """
+        Merge both terms sorted ancestors slices, each term counting as one of its own ancestors
+        :param accession: term accession
+        :param other: other term accession
+        :return: list of common node ids, sorted
+        """
+        node = self.index[accession]
+        other_node = self.index[other]
+        ancestors = self.ancestors
+        i, end = self.offsets[node], self.offsets[node + 1]
+        j, other_end = self.offsets[other_node], self.offsets[other_node + 1]
+        common = []
+        while i < end and j < other_end:
+            if ancestors[i] < ancestors[j]:
+                i += 1
+            elif ancestors[i] > ancestors[j]:
+                j += 1
+            else:
+                common.append(ancestors[i])
+                i += 1
+                j += 1
+        if node == other_node or self.is_a(other, accession):
+            bisect.insort(common, node)
+        elif self.is_a(accession, other):
+            bisect.insort(common, other_node)
+        return common
+
+    def common_ancestors(self, accession, other):
+        """
+        :param accession: term accession
+        :param other: other term accession
+        :return: set of accessions of terms both terms are (see is_a)
+        """
+        return {self.accessions[node] for node in self.common_nodes(accession, other)}
+
+    def lowest_common_ancestors(self, accession, other):
+        """
+        :param accession: term accession
+        :param other: other term accession
+        :return: list of accessions of common ancestors which are not ancestors of another common one, deepest first
+        """
+        common = self.common_nodes(accession, other)
+        # ancestors of a common node are common as well, flagged at their position in sorted common nodes
+        covered = bytearray(len(common))
+        for node in common:
+            for ancestor in self.node_ancestors(node):
+                covered[bisect.bisect_left(common, ancestor)] = 1
+        lowest = [node for node, is_covered in zip(common, covered) if not is_covered]
+        return [self.accessions[node] for node in sorted(lowest, key=lambda node: (-self.depths[node], node))]
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib import parse
+
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ResponseCache', 'CachingAdapter', 'CacheMissError', 'LRUCache']
+
+
+class CacheMissError(RequestException):
+    """ Request not available from cache while running offline """
+    pass
+
+
+class ResponseCache(object):
+    """ Content addressed on disk cache for OLS api responses
+
+    Entries are stored under a file named after the sha256 of the request method, normalized url (sorted query
+    parameters) and accepted content types: a JSON header line (url, status, reason, headers) followed by the raw
+    response body. Entries older than ttl seconds are ignored, least recently used ones are evicted when the cache
+    grows over max_size bytes.
+    """
+
+    def __init__(self, cache_dir, ttl=None, max_size=None):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, _, size in self._entries()) if max_size else 0
+
+    @staticmethod
+    def key(method, url, accept=''):
+        parts = parse.urlsplit(url)
+        query = parse.urlencode(sorted(parse.parse_qsl(parts.query, keep_blank_values=True)))
+        normalized = parse.urlunsplit((parts.scheme, parts.netloc, parts.path, query, ''))
+        return hashlib.sha256(' '.join([method.upper(), normalized, accept or '']).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def get(self, key, expired=False):
+        """
+        Retrieve a cached entry
+        :param key: entry key
+        :param expired: whether to return entries older than ttl
+        :return: dict entry or None
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = json.loads(f.readline().decode('utf-8'))
+                entry['content'] = f.read()
+            stored_at = entry['stored_at']
+        except (OSError, ValueError, TypeError, KeyError):
+            self.count(hit=False)
+            return None
+        if not expired and self.ttl is not None and time.time() - stored_at > self.ttl:
+            logger.debug('Expired cache entry %s', entry.get('url'))
+            self.count(hit=False)
+            return None
+        try:
+            # keep track of last access for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self.count(hit=True)
+        return entry
+
+    def count(self, hit):
+        # entries are looked up from concurrent requests threads
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def set(self, key, entry):
+        header = {name: value for name, value in entry.items() if name != 'content'}
+        header['stored_at'] = time.time()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            f.write(entry['content'])
+        size = os.path.getsize(tmp_path)
+        try:
+            # overwritten entry no longer takes any space
+            size -= os.path.getsize(path)
+        except OSError:
+            pass
+        # atomic, concurrent workers may share the same cache directory
+        os.replace(tmp_path, path)
+        if self.max_size:
+            with self._lock:
+                self._size += size
+                if self._size > self.max_size:
+                    self.evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield stat.st_mtime, path, stat.st_size
+
+    def evict(self):
+        """ Remove least recently used entries until cache is back to 90% of its max size """
+        entries = sorted(self._entries())
+        self._size = sum(size for _, _, size in entries)
+        target = self.max_size * 0.9
+        removed = 0
+        for _, path, size in entries:
+            if self._size <= target:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+                removed += 1
+            except OSError:
+                pass
+        logger.info('Evicted %s cache entries', removed)
+
+
+class CachingAdapter(HTTPAdapter):
+    """ Requests transport adapter serving GET requests from a ResponseCache
+
+    In offline mode, no request is sent to the network, any cache miss raises CacheMissError. Cache misses are sent
+    through transport adapter when set.
+    """
+
+    def __init__(self, cache, offline=False, transport=None, **kwargs):
+        self.cache = cache
+        self.offline = offline
+        self.transport = transport
+        super().__init__(**kwargs)
+
+    def send_request(self, request, **kwargs):
+        if self.transport is not None:
+            return self.transport.send(request, **kwargs)
+        return super().send(request, **kwargs)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+        super().close()
+
+    def send(self, request, **kwargs):
+        if request.method.upper() != 'GET':
+            return self.send_request(request, **kwargs)
+        key = self.cache.key(request.method, request.url, request.headers.get('Accept'))
+        entry = self.cache.get(key, expired=self.offline)
+        if entry is not None:
+            logger.debug('Cached response %s', request.url)
+            return self.build_cached_response(request, entry)
+        if self.offline:
+            raise CacheMissError('%s not in cache (offline mode)' % request.url, request=request)
+        response = self.send_request(request, **kwargs)
+        if response.status_code == 200:
+            self.cache.set(key, dict(url=response.url,
+                                     status_code=response.status_code,
+                                     reason=response.reason,
+                                     headers=dict(response.headers),
+                                     content=response.content))
+        return response
+
+    def build_cached_response(self, request, entry):
+        response = Response()
+        response.status_code = entry['status_code']
+        response.reason = entry['reason']
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.url = entry['url']
+        response.request = request
+        response.connection = self
+        response._content = entry['content']
+        return response
+
+
+class LRUCache(object):
+    """ Bounded in memory memoization of OLS api lookups, counting hits and misses """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, fetch):
+        """
+        Return memoized value for key, calling fetch and storing its result on miss
+        :param key: hashable lookup key
+        :param fetch: callable returning the value, errors are not memoized
+        :return: value
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+        value = fetch()
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,451 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import logging
+import os
+import tempfile
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import sqlalchemy
+from sqlalchemy import select, and_, text
+
+from .models import Ontology, Term, Relation, RelationType, Closure
+from .writer import sqlite_max_variables
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['ClosureGraph', 'compute_closure', 'compute_closures', 'update_closure', 'ontologies_ids',
+           'closure_relation_types']
+
+# transitive relation types closure is computed over
+closure_relation_types = ('is_a', 'part_of')
+
+# closure table columns, in closure files written by workers processes
+closure_columns = ['child_term_id', 'parent_term_id', 'subparent_term_id', 'distance', 'ontology_id',
+                   'confident_relationship']
+
+
+class ClosureGraph(object):
+    """ Terms parents adjacency of a set of ontologies, held in compact integer arrays (CSR layout)
+
+    Terms are indexed by consecutive integers, parents of term i are parents[offsets[i]:offsets[i + 1]].
+    Closure rows are those the former Perl script produced: a row (term, term, NULL, 0) for each term, then a row
+    (child, parent, subparent, distance) for each ancestor parent of child reached through its immediate child
+    subparent, distance being the shortest path length from child to subparent plus one. Cycles are walked once.
+    """
+
+    def __init__(self, term_ids, ontology_ids, edges):
+        """
+        :param term_ids: ontologies terms ids, self rows are generated for them
+        :param ontology_ids: their ontology ids
+        :param edges: iterable of (child_term_id, parent_term_id, ontology_id), relations of the ontologies
+        """
+        index = {}
+        self.term_ids = array('L')
+        # ontology of each term, 0 for terms of other ontologies only referenced as parents
+        self.ontologies = array('L')
+        for term_id, ontology_id in zip(term_ids, ontology_ids):
+            if term_id not in index:
+                index[term_id] = len(self.term_ids)
+                self.term_ids.append(term_id)
+                self.ontologies.append(ontology_id)
+        # terms indexed after own ones are only reached through relations
+        self.own = len(self.term_ids)
+        children = array('L')
+        parents = array('L')
+        for child_term_id, parent_term_id, ontology_id in edges:
+            for term_id in (child_term_id, parent_term_id):
+                if term_id not in index:
+                    index[term_id] = len(self.term_ids)
+                    self.term_ids.append(term_id)
+                    self.ontologies.append(0)
+            child = index[child_term_id]
+            if self.ontologies[child] == 0:
+                # child term belongs to another ontology, its relation does not
+                self.ontologies[child] = ontology_id
+            children.append(child)
+            parents.append(index[parent_term_id])
+        self.index = index
+        self.offsets, self.parents = self.csr(len(self.term_ids), children, parents)
+        # children adjacency, only built to look for descendants
+        self.child_offsets = None
+        self.children = None
+
+    def __len__(self):
+        return len(self.term_ids)
+
+    @staticmethod
+    def csr(size, sources, targets):
+        """
+        Build compressed sparse rows adjacency with a counting sort, duplicated edges are dropped
+        :param size: number of nodes
+        :param sources: edges sources nodes
+        :param targets: edges targets nodes
+        :return: tuple offsets, targets arrays
+        """
+        counts = array('L', [0]) * (size + 1)
+        for source in sources:
+            counts[source + 1] += 1
+        for i in range(size):
+            counts[i + 1] += counts[i]
+        offsets = array('L', counts)
+        adjacency = array('L', [0]) * len(targets)
+        for source, target in zip(sources, targets):
+            adjacency[counts[source]] = target
+            counts[source] += 1
+        # drop duplicated edges, i.e same parent with several relation types
+        compact = array('L')
+        starts = array('L', [0]) * (size + 1)
+        for i in range(size):
+            starts[i] = len(compact)
+            compact.extend(sorted(set(adjacency[offsets[i]:offsets[i + 1]])))
+        starts[size] = len(compact)
+        return starts, compact
+
+    @classmethod
+    def from_db(cls, connection, ontology_ids, relation_types=closure_relation_types):
+        """
+        Load ontologies terms and relations
+        :param connection: db connection
+        :param ontology_ids: ids of ontologies rows, i.e namespaces of an ontology
+        :param relation_types: names of relation types closure is computed over
+        :return: ClosureGraph
+        """
+        term = Term.__table__
+        relation = Relation.__table__
+        relation_type = RelationType.__table__
+        terms = connection.execute(select([term.c.term_id, term.c.ontology_id])
+                                   .where(and_(term.c.ontology_id.in_(ontology_ids), term.c.is_obsolete == 0))
+                                   .order_by(term.c.term_id)).fetchall()
+        # obsolete terms are left out of closure, as children of relations as well
+        child = term.alias('child')
+        edges = connection.execute(
+            select([relation.c.child_term_id, relation.c.parent_term_id, relation.c.ontology_id])
+            .select_from(relation.join(relation_type).join(child, child.c.term_id == relation.c.child_term_id))
+            .where(and_(relation.c.ontology_id.in_(ontology_ids), relation_type.c.name.in_(relation_types),
+                        child.c.is_obsolete == 0))
+            .order_by(relation.c.child_term_id, relation.c.parent_term_id))
+        return cls([term_id for term_id, _ in terms], [ontology_id for _, ontology_id in terms], edges)
+
+    def edges(self):
+        """
+        :return: generator of (child_term_id, parent_term_id), without duplicates
+        """
+        for child in range(len(self.term_ids)):
+            for k in range(self.offsets[child], self.offsets[child + 1]):
+                yield self.term_ids[child], self.term_ids[self.parents[k]]
+
+    def descendants(self, term_ids, extra_edges=()):
+        """
+        Terms reaching any of term_ids through relations, term_ids included
+        :param term_ids: terms ids
+        :param extra_edges: (child_term_id, parent_term_id) walked as well, e.g relations removed since
+        :return: set of terms ids
+        """
+        if self.children is None:
+            sources = array('L')
+            for child in range(len(self.term_ids)):
+                sources.extend([child] * (self.offsets[child + 1] - self.offsets[child]))
+            self.child_offsets, self.children = self.csr(len(self.term_ids), self.parents, sources)
+        extra = collections.defaultdict(list)
+        for child_term_id, parent_term_id in extra_edges:
+            extra[parent_term_id].append(child_term_id)
+        found = set(term_ids)
+        pending = list(found)
+        while pending:
+            term_id = pending.pop()
+            node = self.index.get(term_id)
+            children = [] if node is None else \
+                [self.term_ids[self.children[k]] for k in range(self.child_offsets[node], self.child_offsets[node + 1])]
+            for child_term_id in children + extra.get(term_id, []):
+                if child_term_id not in found:
+                    found.add(child_term_id)
+                    pending.append(child_term_id)
+        return found
+
+    def rows(self, child_term_ids=None):
+        """
+        Closure rows, breadth first from each term along its parents
+        :param child_term_ids: only rows of these child terms, all if None
+        :return: generator of tuples child_term_id, parent_term_id, subparent_term_id, distance, ontology_id
+        """
+        term_ids = self.term_ids
+        offsets = self.offsets
+        parents = self.parents
+        distances = array('l', [-1]) * len(term_ids)
+        if child_term_ids is None:
+            nodes = range(len(term_ids))
+        else:
+            nodes = sorted(self.index[term_id] for term_id in child_term_ids if term_id in self.index)
+        for child in nodes:
+            ontology_id = self.ontologies[child]
+            if ontology_id == 0:
+                continue
+            child_term_id = term_ids[child]
+            if child < self.own:
+                yield child_term_id, child_term_id, None, 0, ontology_id
+            if offsets[child] == offsets[child + 1]:
+                continue
+            distances[child] = 0
+            visited = [child]
+            for subparent in visited:
+                distance = distances[subparent] + 1
+                for k in range(offsets[subparent], offsets[subparent + 1]):
+                    parent = parents[k]
+                    yield child_term_id, term_ids[parent], term_ids[subparent], distance, ontology_id
+                    if distances[parent] < 0:
+                        distances[parent] = distance
+                        visited.append(parent)
+            for node in visited:
+                distances[node] = -1
+
+
+def compute_closure(engine, ontology_ids, relation_types=closure_relation_types, batch_size=10000):
+    """
+    Replace ontologies closure rows with rows computed from their relations
+    :param engine: db engine
+    :param ontology_ids: ids of ontologies rows
+    :param relation_types: names of relation types closure is computed over
+    :param batch_size: number of rows inserted at once
+    :return: number of closure rows
+    """
+    table = Closure.__table__
+    with engine.connect() as connection:
+        graph = ClosureGraph.from_db(connection, ontology_ids, relation_types)
+    logger.info('Computing closure of %s terms over %s relations', len(graph), len(graph.parents))
+    n_rows = 0
+    with engine.begin() as connection:
+        connection.execute(table.delete().where(table.c.ontology_id.in_(ontology_ids)))
+        batch = []
+        for child_term_id, parent_term_id, subparent_term_id, distance, ontology_id in graph.rows():
+            batch.append(dict(child_term_id=child_term_id, parent_term_id=parent_term_id,
+                              subparent_term_id=subparent_term_id, distance=distance, ontology_id=ontology_id,
+                              confident_relationship=0))
+            if len(batch) >= batch_size:
+                connection.execute(table.insert(), batch)
+                n_rows += len(batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+            n_rows += len(batch)
+    logger.info('Written %s closure rows', n_rows)
+    return n_rows
+
+
+def ontologies_ids(connection, ontology_names=None):
+    """
+    :param connection: db connection
+    :param ontology_names: ontologies short names, all loaded ones if None
+    :return: dict ontology name: ids of its ontology rows, one per namespace
+    """
+    table = Ontology.__table__
+    statement = select([table.c.name, table.c.ontology_id]).order_by(table.c.name, table.c.ontology_id)
+    if ontology_names is not None:
+        statement = statement.where(table.c.name.in_([name.upper() for name in ontology_names]))
+    ontologies = collections.OrderedDict()
+    for name, ontology_id in connection.execute(statement):
+        ontologies.setdefault(name, []).append(ontology_id)
+    return ontologies
+
+
+def closure_file(db_url, ontology_ids, relation_types=closure_relation_types, output_dir=None):
+    """
+    Compute ontologies closure rows into a TSV file, as expected by LOAD DATA default format. Run in pool worker
+    processes: db is only read, through an engine of their own.
+    :param db_url: db url
+    :param ontology_ids: ids of ontologies rows
+    :param relation_types: names of relation types closure is computed over
+    :param output_dir: directory of file, system temporary directory if None
+    :return: tuple file path, number of rows
+    """
+    engine = sqlalchemy.create_engine(db_url)
+    try:
+        with engine.connect() as connection:
+            graph = ClosureGraph.from_db(connection, ontology_ids, relation_types)
+    finally:
+        engine.dispose()
+    n_rows = 0
+    with tempfile.NamedTemporaryFile('w', dir=output_dir, prefix='closure.', suffix='.tsv', delete=False) as f:
+        for child_term_id, parent_term_id, subparent_term_id, distance, ontology_id in graph.rows():
+            f.write('%s\t%s\t%s\t%s\t%s\t0\n' % (child_term_id, parent_term_id,
+                                                 '\\N' if subparent_term_id is None else subparent_term_id,
+                                                 distance, ontology_id))
+            n_rows += 1
+    return f.name, n_rows
+
+
+def load_closure_file(connection, ontology_ids, path, batch_size=10000, infile=False):
+    """
+    Replace ontologies closure rows with rows of a closure file
+    :param connection: db connection, within a transaction
+    :param ontology_ids: ids of ontologies rows
+    :param path: closure file path, see closure_file
+    :param batch_size: number of rows inserted at once
+    :param infile: load file with MySQL LOAD DATA LOCAL INFILE, connection must allow local infile
+    """
+    table = Closure.__table__
+    connection.execute(table.delete().where(table.c.ontology_id.in_(ontology_ids)))
+    if infile and connection.dialect.name == 'mysql':
+        connection.execute(text("LOAD DATA LOCAL INFILE :path INTO TABLE {} "
+                                "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({})"
+                                .format(table.name, ', '.join(closure_columns))), path=path)
+        return
+    with open(path) as f:
+        batch = []
+        for line in f:
+            values = [None if value == '\\N' else int(value) for value in line.rstrip('\n').split('\t')]
+            batch.append(dict(zip(closure_columns, values)))
+            if len(batch) >= batch_size:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+
+
+def compute_closures(engine, ontologies, relation_types=closure_relation_types, workers=None, output_dir=None,
+                     batch_size=10000, infile=False):
+    """
+    Replace closure rows of several ontologies, computed in parallel over a pool of processes. Closures are
+    independent per ontology: relations to terms of other ontologies are only walked up to these terms, as with
+    compute_closure. Each worker computes an ontology closure into a file of its own, files are loaded by this
+    process only, as soon as they are written, one transaction per ontology.
+    :param engine: db engine, on a db other processes can read, i.e not in memory
+    :param ontologies: dict ontology name: ids of its ontology rows, see ontologies_ids
+    :param relation_types: names of relation types closure is computed over
+    :param workers: number of worker processes, number of cpus if None
+    :param output_dir: directory of closure files, system temporary directory if None
+    :param batch_size: number of rows inserted at once
+    :param infile: load files with MySQL LOAD DATA LOCAL INFILE
+    :return: dict ontology name: number of closure rows
+    """
+    workers = min(workers or os.cpu_count() or 1, max(len(ontologies), 1))
+    logger.info('Computing closure of %s ontologies over %s processes', len(ontologies), workers)
+    counts = collections.OrderedDict()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(closure_file, engine.url, ontology_ids, relation_types, output_dir): name
+                   for name, ontology_ids in ontologies.items()}
+        try:
+            for future in as_completed(futures):
+                name = futures[future]
+                path, n_rows = future.result()
+                try:
+                    with engine.begin() as connection:
+                        load_closure_file(connection, ontologies[name], path, batch_size, infile)
+                finally:
+                    os.remove(path)
+                logger.info('Written %s closure rows of %s', n_rows, name)
+                counts[name] = n_rows
+        except Exception:
+            # files of pending workers are left behind otherwise
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if not future.cancelled() and future.exception() is None and os.path.exists(future.result()[0]):
+                    os.remove(future.result()[0])
+            raise
+    return counts
+
+
+def closure_edges(connection, ontology_ids):
+    """
+    Relations ontologies closure was last computed over, i.e its rows at distance 1
+    :param connection: db connection
+    :param ontology_ids: ids of ontologies rows
+    :return: set of (child_term_id, parent_term_id)
+    """
+    table = Closure.__table__
+    statement = select([table.c.child_term_id, table.c.parent_term_id]) \
+        .where(and_(table.c.ontology_id.in_(ontology_ids), table.c.distance == 1,
+                    table.c.subparent_term_id == table.c.child_term_id))
+    return {(child_term_id, parent_term_id) for child_term_id, parent_term_id in connection.execute(statement)}
+
+
+def closure_terms(connection, ontology_ids):
+    """
+    Terms ontologies closure was last computed for, i.e its self rows
+    :param connection: db connection
+    :param ontology_ids: ids of ontologies rows
+    :return: set of terms ids
+    """
+    table = Closure.__table__
+    statement = select([table.c.child_term_id]) \
+        .where(and_(table.c.ontology_id.in_(ontology_ids), table.c.distance == 0))
+    return {term_id for term_id, in connection.execute(statement)}
+
+
+def update_closure(engine, ontology_ids, inserted=None, deleted=None, relation_types=closure_relation_types):
+    """
+    Apply relations changes to ontologies closure: only rows of terms whose ancestors may have changed, i.e
+    descendants of changed relations children, and of terms added or removed since closure was computed, are
+    computed again. Only rows differing from existing ones are written.
+    :param engine: db engine
+    :param ontology_ids: ids of ontologies rows
+    :param inserted: (child_term_id, parent_term_id) relations added, found from closure rows if None
+    :param deleted: (child_term_id, parent_term_id) relations removed, found from closure rows if None
+    :param relation_types: names of relation types closure is computed over
+    :return: dict number of inserted and deleted closure rows, and of terms they were computed for
+    """
+    table = Closure.__table__
+    with engine.connect() as connection:
+        graph = ClosureGraph.from_db(connection, ontology_ids, relation_types)
+        if inserted is None or deleted is None:
+            edges = set(graph.edges())
+            previous = closure_edges(connection, ontology_ids)
+            inserted = edges - previous
+            deleted = previous - edges
+        # terms loaded or removed since
+        changed_terms = closure_terms(connection, ontology_ids) ^ set(graph.term_ids[:graph.own])
+    inserted = set(inserted)
+    deleted = set(deleted)
+    affected = graph.descendants({child for child, _ in inserted | deleted}, deleted) | changed_terms
+    affected = sorted(affected)
+    changes = collections.Counter(inserted=0, deleted=0, terms=len(affected))
+    logger.info('Updating closure of %s terms, %s relations added, %s removed', len(affected), len(inserted),
+                len(deleted))
+    # rows are matched on child, parent and subparent terms, as in closure unique index
+    with engine.begin() as connection:
+        for i in range(0, len(affected), sqlite_max_variables // 2):
+            chunk = affected[i:i + sqlite_max_variables // 2]
+            existing = {}
+            statement = select([table.c.closure_id, table.c.child_term_id, table.c.parent_term_id,
+                                table.c.subparent_term_id, table.c.distance, table.c.ontology_id]) \
+                .where(and_(table.c.child_term_id.in_(chunk), table.c.ontology_id.in_(ontology_ids)))
+            stale = []
+            for closure_id, child, parent, subparent, distance, ontology_id in connection.execute(statement):
+                key = (child, parent, subparent)
+                if key in existing:
+                    stale.append(closure_id)
+                else:
+                    existing[key] = (closure_id, distance, ontology_id)
+            rows = []
+            for child, parent, subparent, distance, ontology_id in graph.rows(chunk):
+                closure_id, former_distance, former_ontology_id = existing.pop((child, parent, subparent),
+                                                                               (None, None, None))
+                if closure_id is not None and (former_distance, former_ontology_id) == (distance, ontology_id):
+                    continue
+                if closure_id is not None:
+                    stale.append(closure_id)
+                rows.append(dict(child_term_id=child, parent_term_id=parent, subparent_term_id=subparent,
+                                 distance=distance, ontology_id=ontology_id, confident_relationship=0))
+            stale.extend(closure_id for closure_id, _, _ in existing.values())
+            for j in range(0, len(stale), sqlite_max_variables):
+                connection.execute(table.delete().where(table.c.closure_id.in_(stale[j:j + sqlite_max_variables])))
+            if rows:
+                connection.execute(table.insert(), rows)
+            changes['deleted'] += len(stale)
+            changes['inserted'] += len(rows)
+    logger.info('Updated closure: %s', dict(changes))
+    return changes
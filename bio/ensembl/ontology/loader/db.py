@@ -16,9 +16,10 @@ import contextlib
 import logging
 
 import sqlalchemy
+import sqlalchemy.exc
 from sqlalchemy.orm import sessionmaker
 
-from .models import Base
+from .models import Base, hash_metadata
 
 logger = logging.getLogger(__name__)
 
@@ -30,6 +31,8 @@ class DataAccessLayer:
     engine = None
     conn_string = None
     metadata = Base.metadata
+    # relation and closure indexes are used by wipe_terms deletes and closure computation while loading
+    load_tables = ('relation', 'closure')
     options = {}
     session = None
 
@@ -40,6 +43,9 @@ class DataAccessLayer:
                 pool_recycle=options.get('pool_recycle', 280),
                 pool_size=options.get('pool_size', 100)
             )
+            if options.get('fast_load'):
+                # rows are ingested with LOAD DATA LOCAL INFILE
+                extra_params['connect_args'] = dict(local_infile=True)
 
         self.engine = sqlalchemy.create_engine(conn_string,
                                                echo=options.get('echo', False),
@@ -53,11 +59,77 @@ class DataAccessLayer:
             raise RuntimeError('Please call db_init first')
         self.metadata.create_all(self.engine)
 
+    def secondary_indexes(self, table=None):
+        """
+        Non unique indexes only needed to query loaded data. Unique ones are needed to load it correctly, load_tables
+        ones to wipe terms and compute closures.
+        :param table: only this table indexes, all tables if None
+        :return: list of sqlalchemy Index
+        """
+        tables = [table] if table is not None else self.metadata.sorted_tables
+        return [index for table in tables if table.name not in self.load_tables
+                for index in sorted(table.indexes, key=lambda index: index.name) if not index.unique]
+
+    def existing_indexes(self, table):
+        return {index['name'] for index in sqlalchemy.inspect(self.engine).get_indexes(table.name)}
+
+    def drop_secondary_indexes(self):
+        """ Drop secondary indexes before a full load, see create_secondary_indexes """
+        if not self.engine:
+            raise RuntimeError('Please call db_init first')
+        for table in self.metadata.sorted_tables:
+            existing = self.existing_indexes(table)
+            for index in self.secondary_indexes(table):
+                if index.name in existing:
+                    logger.debug('Drop index %s', index.name)
+                    index.drop(self.engine)
+
+    @staticmethod
+    def index_columns(index):
+        length = index.dialect_options['mysql']['length']
+        columns = []
+        for column in index.columns:
+            size = length.get(column.name) if isinstance(length, dict) else length
+            columns.append('{}({})'.format(column.name, size) if size else column.name)
+        return ', '.join(columns)
+
+    def create_secondary_indexes(self):
+        """
+        Build missing secondary indexes. MySQL builds all indexes of a table in a single ALTER TABLE, i.e one pass
+        over table rows.
+        :return: list of built indexes names
+        """
+        if not self.engine:
+            raise RuntimeError('Please call db_init first')
+        built = []
+        for table in self.metadata.sorted_tables:
+            existing = self.existing_indexes(table)
+            indexes = [index for index in self.secondary_indexes(table) if index.name not in existing]
+            if not indexes:
+                continue
+            logger.info('Build %s indexes %s', table.name, [index.name for index in indexes])
+            try:
+                if self.engine.dialect.name == 'mysql':
+                    self.engine.execute('ALTER TABLE {} {}'.format(
+                        table.name,
+                        ', '.join('ADD INDEX {} ({})'.format(index.name, self.index_columns(index))
+                                  for index in indexes)))
+                else:
+                    for index in indexes:
+                        index.create(self.engine)
+            except sqlalchemy.exc.DatabaseError:
+                # may have been built meanwhile by another loader
+                if any(index.name not in self.existing_indexes(table) for index in indexes):
+                    raise
+            built.extend(index.name for index in indexes)
+        return built
+
     def wipe_schema(self, conn_string):
         engine = sqlalchemy.create_engine(conn_string, echo=False)
         if not engine:
             raise RuntimeError("Can't wipe schema prior to init db")
         Base.metadata.drop_all(engine)
+        hash_metadata.drop_all(engine)
 
     def get_session(self):
         Session = sessionmaker()
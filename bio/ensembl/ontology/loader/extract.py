@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import asyncio
+import functools
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .transport import current_session, scoped, load_relation, relations_types
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['Extracted', 'AsyncTermsExtractor']
+
+_done = object()
+
+
+class Extracted(object):
+    """ OLS api responses fetched ahead for a single term """
+
+    def __init__(self, o_term):
+        self.term = o_term
+        self.responses = {}
+
+    def get(self, key, fetch):
+        """
+        Return the extracted response for key, or call OLS api if it has not been fetched ahead.
+        Errors raised while fetching ahead are raised again, as if the call was made now.
+        :param key: tuple identifying the api call
+        :param fetch: callable doing the actual api call
+        :return: api response
+        """
+        if key in self.responses:
+            response = self.responses.pop(key)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return fetch()
+
+
+class AsyncTermsExtractor(object):
+    """ Fetch terms pages and their related data (relations, cross ontology terms) concurrently
+
+    Blocking OlsClient calls run in an executor driven by an asyncio loop in a background thread, the number of
+    calls in flight being limited by max_in_flight. Extracted terms are handed over to the caller, in the slice
+    order, through a bounded queue so that transform/load code stays synchronous.
+    """
+
+    def __init__(self, client, allowed_ontologies, ignored_relations=(), max_in_flight=100, prefetch=2,
+                 process_relations=True, process_parents=True, lookups=None):
+        self.client = client
+        self.allowed_ontologies = allowed_ontologies
+        self.ignored_relations = ignored_relations
+        self.max_in_flight = max(int(max_in_flight or 1), 1)
+        self.prefetch = max(int(prefetch or 0), 0)
+        self.process_relations = process_relations
+        self.process_parents = process_parents
+        self.lookups = lookups
+        self._executor = None
+        self._loop = None
+        self._semaphore = None
+        self._slots = None
+        self._session = None
+
+    def __call__(self, terms):
+        """
+        Iterate over extracted terms
+        :param terms: a TermsPrefetcher slice
+        :return: generator of Extracted
+        """
+        handover = queue.Queue()
+        # api calls run in executor threads, with the session of the consumer
+        self._session = current_session()
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        thread.start()
+        producer = asyncio.run_coroutine_threadsafe(self._produce(terms, handover), self._loop)
+        try:
+            while True:
+                item = handover.get()
+                if item is _done:
+                    break
+                elif isinstance(item, Exception):
+                    raise item
+                # a new term can be extracted ahead
+                self._loop.call_soon_threadsafe(self._slots.release)
+                yield item.result()
+        finally:
+            producer.cancel()
+            asyncio.run_coroutine_threadsafe(self._cancel_all(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            thread.join()
+            self._executor.shutdown(wait=False)
+            self._loop.close()
+
+    async def _cancel_all(self):
+        # module functions since Python 3.7, Task class methods before (removed in 3.9)
+        all_tasks = getattr(asyncio, 'all_tasks', None) or asyncio.Task.all_tasks
+        current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+        tasks = [task for task in all_tasks(self._loop) if task is not current_task(self._loop)]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self._semaphore:
+            call = functools.partial(scoped(fn, self._session), *args, **kwargs)
+            return await self._loop.run_in_executor(self._executor, call)
+
+    async def _fetch(self, fn, *args, **kwargs):
+        """ Call api, returning raised error instead of raising it, to be re-raised when consumed """
+        try:
+            return await self._call(fn, *args, **kwargs)
+        except Exception as e:
+            return e
+
+    async def _produce(self, terms, handover):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        try:
+            chunks = terms.chunks()
+            pages = [asyncio.ensure_future(self._call(terms.fetch, chunk))
+                     for _, chunk in zip(range(self.prefetch + 1), chunks)]
+            while pages:
+                page = await pages.pop(0)
+                next_chunk = next(chunks, None)
+                if next_chunk is not None:
+                    pages.append(asyncio.ensure_future(self._call(terms.fetch, next_chunk)))
+                for o_term in page:
+                    # bound the number of terms extracted ahead of the consumer
+                    await self._slots.acquire()
+                    handover.put(asyncio.run_coroutine_threadsafe(self._extract(o_term), self._loop))
+            handover.put(_done)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error('Extraction failed %s', e)
+            handover.put(e)
+
+    @staticmethod
+    def _relatives(o_term, relation):
+        return list(load_relation(o_term, relation))
+
+    def _term_details(self, iri):
+        fetch = functools.partial(self.client.term, identifier=iri, silent=True, unique=True)
+        if self.lookups is not None:
+            # shared with loader, memoized details are not fetched twice
+            return self.lookups.get(('term', iri), fetch)
+        return fetch()
+
+    def _cross_ontology(self, o_related):
+        return not o_related.is_defining_ontology and o_related.accession is not None \
+               and o_related.accession.split(':')[0] in self.allowed_ontologies
+
+    async def _extract(self, o_term):
+        extracted = Extracted(o_term)
+        if not o_term.is_defining_ontology or o_term.accession is None:
+            return extracted
+        relations = []
+        if self.process_relations and o_term.ontology_name.upper() in self.allowed_ontologies:
+            # relations_types is cached on o_term once loaded
+            rel_names = await self._fetch(relations_types, o_term)
+            if not isinstance(rel_names, Exception):
+                relations = [rel for rel in rel_names if rel not in self.ignored_relations]
+        if self.process_parents and not o_term.is_root:
+            relations.append('parents')
+        relatives = await asyncio.gather(*[self._fetch(self._relatives, o_term, rel) for rel in relations])
+        for rel_name, o_relatives in zip(relations, relatives):
+            extracted.responses[('relation', o_term.iri, rel_name)] = o_relatives
+        iris = list({o_related.iri for o_relatives in relatives if not isinstance(o_relatives, Exception)
+                     for o_related in o_relatives if self._cross_ontology(o_related)})
+        details = await asyncio.gather(*[self._fetch(self._term_details, iri) for iri in iris])
+        for iri, o_details in zip(iris, details):
+            extracted.responses[('term', iri)] = o_details
+        return extracted
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import datetime
+import gzip
+import json
+import logging
+import os
+import re
+
+import itypes
+
+import ebi.ols.api.helpers as helpers
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['OboReader', 'ObographsReader', 'ontology_reader']
+
+obo_purl = 'http://purl.obolibrary.org/obo/'
+
+_obo_scopes = {
+    'EXACT': 'hasExactSynonym',
+    'BROAD': 'hasBroadSynonym',
+    'NARROW': 'hasNarrowSynonym',
+    'RELATED': 'hasRelatedSynonym'
+}
+
+
+def ontology_reader(path, ontology_name):
+    """
+    Get the streaming reader matching an ontology file format, from its extension
+    :param path: local OBO (.obo) or obographs (.json) file, optionally gzipped
+    :param ontology_name: ontology short name
+    :return: OboReader or ObographsReader
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.json'):
+        return ObographsReader(path, ontology_name)
+    elif name.endswith('.obo'):
+        return OboReader(path, ontology_name)
+    raise RuntimeError('Unsupported ontology file format %s' % path)
+
+
+def _open(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8')
+    return open(path, 'r', encoding='utf-8')
+
+
+def _xref(value):
+    database, _, identifier = value.partition(':')
+    return itypes.Dict({'database': database, 'id': identifier})
+
+
+def _underscore(label):
+    return re.sub(r'\s+', '_', label.strip())
+
+
+class OntologyReader(object):
+    """ Base streaming ontology file reader, building ebi.ols.api helpers as OLS api would return them
+
+    Files are read sequentially, once for terms and once for edges, memory use does not depend on file size. Header
+    and number of terms are only read once per reader.
+    """
+
+    def __init__(self, path, ontology_name):
+        self.path = path
+        self.ontology_name = ontology_name.lower()
+        self.prefix = ontology_name.upper()
+        self._header = None
+        self._length = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            self._header = self.read_header()
+        return self._header
+
+    def read_header(self):
+        raise NotImplementedError()
+
+    def terms(self, start=0, end=None):
+        """
+        Iterate over file terms, in file order
+        :param start: first term index (included)
+        :param end: last term index (excluded), default to all terms
+        :return: generator of helpers.Term
+        """
+        raise NotImplementedError()
+
+    def edges(self, accessions=None):
+        """
+        Iterate over file relations
+        :param accessions: only yield relations whose child term accession is in this set, default to all
+        :return: generator of (child accession, OLS relation name, related helpers.Term)
+        """
+        raise NotImplementedError()
+
+    def subsets(self):
+        """
+        Declared subsets
+        :return: list of helpers.Property
+        """
+        return [helpers.Property(label=name, short_form=name,
+                                 annotation={'comment': [description] if description else []})
+                for name, description in self.header.get('subsets', [])]
+
+    def __len__(self):
+        if self._length is None:
+            self._length = self.count_terms()
+        return self._length
+
+    def count_terms(self):
+        """
+        :return: number of terms in file
+        """
+        return sum(1 for _ in self.terms())
+
+    def ontology(self):
+        """
+        Ontology descriptor from file header
+        :return: helpers.Ontology
+        """
+        header = self.header
+        updated = datetime.datetime.fromtimestamp(os.path.getmtime(self.path), datetime.timezone.utc)
+        return helpers.Ontology(ontology_id=self.ontology_name,
+                                updated=updated.strftime('%Y-%m-%dT%H:%M:%S.%f%z'),
+                                number_of_terms=len(self),
+                                number_of_properties=0,
+                                number_of_individuals=0,
+                                config=dict(id=self.ontology_name,
+                                            title=header.get('title', self.prefix),
+                                            namespace=header.get('namespace', self.ontology_name),
+                                            version=header.get('version')))
+
+    def term(self, accession, label=None, **kwargs):
+        """
+        Build a term helper
+        :param accession: obo id
+        :param label: term label
+        :param kwargs: other helpers.Term attributes
+        :return: helpers.Term
+        """
+        short_form = accession.replace(':', '_')
+        o_term = helpers.Term(iri=kwargs.pop('iri', obo_purl + short_form),
+                              obo_id=accession,
+                              short_form=short_form,
+                              label=label,
+                              ontology_name=self.ontology_name,
+                              ontology_prefix=self.prefix,
+                              is_defining_ontology=accession.split(':')[0].upper() == self.prefix,
+                              **kwargs)
+        o_term._relations_types = []
+        return o_term
+
+
+class OboReader(OntologyReader):
+    """ OBO 1.4 flat file reader """
+
+    def read_header(self):
+        header = {'subsets': []}
+        with _open(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    break
+                tag, value = self.tag_value(line)
+                if tag == 'data-version':
+                    header['version'] = value
+                elif tag == 'default-namespace':
+                    header['namespace'] = value
+                elif tag == 'subsetdef':
+                    name, _, rest = value.partition(' ')
+                    header['subsets'].append((name, self.quoted(rest)[0]))
+                elif tag == 'property_value' and value.split(' ')[0] in ('http://purl.org/dc/elements/1.1/title',
+                                                                         'dc:title', 'title'):
+                    header['title'] = self.quoted(value.partition(' ')[2])[0]
+        return header
+
+    @staticmethod
+    def tag_value(line):
+        tag, _, value = line.partition(':')
+        value = value.strip()
+        if value.startswith('"'):
+            return tag, value
+        # trailing comments and qualifiers
+        return tag, re.sub(r'\s*\{[^}]*\}$', '', value.split(' !', 1)[0].strip())
+
+    @staticmethod
+    def comment(line):
+        return line.split(' ! ', 1)[1].strip() if ' ! ' in line else None
+
+    @staticmethod
+    def quoted(value):
+        """
+        Read an OBO quoted string
+        :param value: tag value starting with a quoted string
+        :return: (unescaped string, remaining value)
+        """
+        value = value.strip()
+        if not value.startswith('"'):
+            return value, ''
+        chars = []
+        i = 1
+        while i < len(value):
+            char = value[i]
+            if char == '\\' and i + 1 < len(value):
+                i += 1
+                chars.append(value[i])
+            elif char == '"':
+                break
+            else:
+                chars.append(char)
+            i += 1
+        return ''.join(chars), value[i + 1:].strip()
+
+    def stanzas(self):
+        """
+        Iterate over [Term] stanzas
+        :return: generator of tag/value lines list
+        """
+        with _open(self.path) as f:
+            stanza = None
+            for line in f:
+                line = line.strip()
+                if line.startswith('['):
+                    if stanza is not None:
+                        yield stanza
+                    stanza = [] if line == '[Term]' else None
+                elif stanza is not None and line and not line.startswith('!'):
+                    stanza.append(line)
+            if stanza is not None:
+                yield stanza
+
+    def terms(self, start=0, end=None):
+        for index, stanza in enumerate(self.stanzas()):
+            if end is not None and index >= end:
+                break
+            if index >= (start or 0):
+                yield self.stanza_term(stanza)
+
+    def count_terms(self):
+        # terms helpers are not needed to count them
+        return sum(1 for _ in self.stanzas())
+
+    def stanza_term(self, stanza):
+        values = {'alt_id': [], 'subset': [], 'synonym': []}
+        for line in stanza:
+            tag, value = self.tag_value(line)
+            if tag in values and isinstance(values[tag], list):
+                values[tag].append(value)
+            else:
+                values.setdefault(tag, value)
+        synonyms = []
+        for value in values['synonym']:
+            name, rest = self.quoted(value)
+            scope = rest.split(' ', 1)[0] if rest else 'RELATED'
+            xrefs = rest[rest.find('[') + 1:rest.rfind(']')] if '[' in rest else ''
+            synonyms.append(itypes.Dict({
+                'name': name,
+                'scope': _obo_scopes.get(scope, 'hasRelatedSynonym'),
+                'xrefs': [_xref(xref.strip()) for xref in xrefs.split(',') if xref.strip()]}))
+        annotation = {'has_alternative_id': values['alt_id']}
+        if 'namespace' in values:
+            annotation['has_obo_namespace'] = [values['namespace']]
+        elif 'namespace' in self.header:
+            annotation['has_obo_namespace'] = [self.header['namespace']]
+        description = self.quoted(values['def'])[0] if 'def' in values else None
+        return self.term(values['id'],
+                         label=values.get('name'),
+                         description=[description] if description else [],
+                         is_obsolete=values.get('is_obsolete') == 'true',
+                         in_subset=values['subset'] or None,
+                         obo_synonym=synonyms,
+                         annotation=annotation)
+
+    def edges(self, accessions=None):
+        for stanza in self.stanzas():
+            accession = next((self.tag_value(line)[1] for line in stanza if line.startswith('id:')), None)
+            if accession is None or (accessions is not None and accession not in accessions):
+                continue
+            for line in stanza:
+                tag, value = self.tag_value(line)
+                if tag == 'is_a':
+                    yield accession, 'parents', self.term(value, label=self.comment(line))
+                elif tag == 'relationship':
+                    rel_name, _, related = value.partition(' ')
+                    yield accession, rel_name, self.term(related.strip(), label=self.comment(line))
+
+
+class ObographsReader(OntologyReader):
+    """ obographs JSON file reader, nodes and edges arrays are decoded item by item """
+
+    chunk_size = 1 << 16
+
+    def items(self, key):
+        """
+        Iterate over items of every array named key in file
+        :param key: array property name (nodes, edges)
+        :return: generator of decoded items
+        """
+        decoder = json.JSONDecoder()
+        pattern = re.compile(r'"%s"\s*:\s*\[' % re.escape(key))
+        with _open(self.path) as f:
+            buffer = ''
+            eof = False
+            while not eof:
+                # look for next array start
+                match = pattern.search(buffer)
+                while match is None:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        return
+                    # key may be split over two chunks
+                    buffer = buffer[-len(key) - 64:] + chunk
+                    match = pattern.search(buffer)
+                buffer = buffer[match.end():]
+                while True:
+                    buffer = buffer.lstrip(' \t\r\n,')
+                    if buffer.startswith(']'):
+                        buffer = buffer[1:]
+                        break
+                    try:
+                        item, end = decoder.raw_decode(buffer)
+                    except ValueError:
+                        chunk = f.read(self.chunk_size)
+                        if not chunk:
+                            eof = True
+                            break
+                        buffer += chunk
+                        continue
+                    yield item
+                    buffer = buffer[end:]
+
+    def read_header(self):
+        header = {'subsets': []}
+        with _open(self.path) as f:
+            # graph meta precedes nodes in obographs serialisation
+            head = f.read(self.chunk_size)
+        head = head.split('"nodes"', 1)[0]
+        version = re.search(r'"version"\s*:\s*"([^"]*)"', head)
+        if version:
+            header['version'] = version.group(1).rsplit('/', 2)[-2] if '/releases/' in version.group(1) \
+                else version.group(1)
+        title = re.search(r'"pred"\s*:\s*"http://purl.org/dc/elements/1.1/title"\s*,\s*"val"\s*:\s*"([^"]*)"', head)
+        if title:
+            header['title'] = title.group(1)
+        # subsets are only declared on nodes: terms are counted along the same single pass over nodes
+        subsets = set()
+        header['terms'] = 0
+        for node in self.items('nodes'):
+            for subset in node.get('meta', {}).get('subsets', []):
+                subsets.add(subset.rsplit('#', 1)[-1].rsplit('/', 1)[-1])
+            if self.is_class(node):
+                header['terms'] += 1
+        header['subsets'] = [(name, None) for name in sorted(subsets)]
+        return header
+
+    def count_terms(self):
+        return self.header['terms']
+
+    @staticmethod
+    def accession(iri):
+        short_form = iri.rsplit('/', 1)[-1].rsplit('#', 1)[-1]
+        if ':' in short_form:
+            return short_form
+        left, _, right = short_form.rpartition('_')
+        return ':'.join([left, right]) if left else None
+
+    def is_class(self, node):
+        return node.get('type') == 'CLASS' and bool(self.accession(node['id']))
+
+    def classes(self):
+        for node in self.items('nodes'):
+            if self.is_class(node):
+                yield node
+
+    def terms(self, start=0, end=None):
+        for index, node in enumerate(self.classes()):
+            if end is not None and index >= end:
+                break
+            if index >= (start or 0):
+                yield self.node_term(node)
+
+    def node_term(self, node):
+        meta = node.get('meta', {})
+        values = {}
+        for value in meta.get('basicPropertyValues', []):
+            values.setdefault(value['pred'].rsplit('#', 1)[-1], []).append(value['val'])
+        synonyms = [itypes.Dict({'name': synonym['val'],
+                                 'scope': synonym.get('pred', 'hasRelatedSynonym'),
+                                 'xrefs': [_xref(xref) for xref in synonym.get('xrefs', [])]})
+                    for synonym in meta.get('synonyms', [])]
+        annotation = {'has_alternative_id': values.get('hasAlternativeId', [])}
+        if values.get('hasOBONamespace'):
+            annotation['has_obo_namespace'] = values['hasOBONamespace']
+        description = meta.get('definition', {}).get('val')
+        subsets = [subset.rsplit('#', 1)[-1].rsplit('/', 1)[-1] for subset in meta.get('subsets', [])]
+        return self.term(self.accession(node['id']),
+                         label=node.get('lbl'),
+                         iri=node['id'],
+                         description=[description] if description else [],
+                         is_obsolete=meta.get('deprecated', False),
+                         in_subset=subsets or None,
+                         obo_synonym=synonyms,
+                         annotation=annotation)
+
+    def edges(self, accessions=None):
+        # properties labels are needed to name relations as OLS does
+        properties = {node['id']: node['lbl'] for node in self.items('nodes')
+                      if node.get('type') == 'PROPERTY' and node.get('lbl')}
+        for edge in self.items('edges'):
+            child, related = self.accession(edge['sub']), self.accession(edge['obj'])
+            if child is None or related is None or (accessions is not None and child not in accessions):
+                continue
+            if edge['pred'] == 'is_a':
+                rel_name = 'parents'
+            else:
+                rel_name = _underscore(properties.get(edge['pred'], self.accession(edge['pred']) or edge['pred']))
+            yield child, rel_name, self.term(related, iri=edge['obj'])
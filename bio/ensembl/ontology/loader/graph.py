@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import logging
+from array import array
+
+from sqlalchemy import select
+
+from .closure import ClosureGraph
+from .models import Ontology, Term, Relation, RelationType
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['OntologyGraph', 'OntologyGraphBuilder']
+
+
+class OntologyGraphBuilder(object):
+    """ Collect terms and relations by accession, e.g while loading them, into integer arrays
+
+    Accessions are mapped to consecutive node ids as they are added, relations are kept as pairs of arrays of child
+    and parent nodes per relation type.
+    """
+
+    def __init__(self):
+        self.index = {}
+        self.accessions = []
+        # relation type name: (children nodes, parents nodes)
+        self.edges = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def add_term(self, accession):
+        """
+        :param accession: term accession
+        :return: term node id
+        """
+        node = self.index.get(accession)
+        if node is None:
+            node = self.index[accession] = len(self.accessions)
+            self.accessions.append(accession)
+        return node
+
+    def add_relation(self, child_accession, parent_accession, relation_type):
+        """
+        :param child_accession: child term accession
+        :param parent_accession: parent term accession
+        :param relation_type: relation type name
+        """
+        if relation_type not in self.edges:
+            self.edges[relation_type] = (array('L'), array('L'))
+        children, parents = self.edges[relation_type]
+        children.append(self.add_term(child_accession))
+        parents.append(self.add_term(parent_accession))
+
+    def build(self):
+        """
+        :return: OntologyGraph of terms and relations added so far
+        """
+        return OntologyGraph(list(self.accessions), self.edges)
+
+
+class OntologyGraph(object):
+    """ Terms and relations of ontologies, held in compact integer arrays for fast traversals
+
+    Terms are nodes numbered by consecutive integers, mapped to and from their accessions. Relations are stored per
+    relation type as compressed sparse rows adjacencies (see closure.ClosureGraph): parents of node i for a relation
+    type are parents[offsets[i]:offsets[i + 1]]. Children adjacencies are built on first use. Traversals follow all
+    relation types unless some are given, cycles are walked once.
+    """
+
+    def __init__(self, accessions, edges):
+        """
+        :param accessions: terms accessions, in node ids order
+        :param edges: dict relation type name: (children nodes array, parents nodes array)
+        """
+        self.accessions = accessions
+        self.index = {accession: node for node, accession in enumerate(accessions)}
+        self.parent_adjacencies = collections.OrderedDict(
+            (relation_type, ClosureGraph.csr(len(accessions), children, parents))
+            for relation_type, (children, parents) in edges.items())
+        self.child_adjacencies = {}
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __contains__(self, accession):
+        return accession in self.index
+
+    @property
+    def relation_types(self):
+        return list(self.parent_adjacencies.keys())
+
+    @classmethod
+    def from_db(cls, connection, ontology_names=None, relation_types=None):
+        """
+        Load ontologies terms, with relations of these terms to any other term
+        :param connection: db connection
+        :param ontology_names: ontologies short names, all ontologies if None
+        :param relation_types: names of relation types loaded, all if None
+        :return: OntologyGraph
+        """
+        term = Term.__table__
+        ontology = Ontology.__table__
+        relation = Relation.__table__
+        relation_type = RelationType.__table__
+        child = term.alias('child')
+        parent = term.alias('parent')
+        ontology_ids = select([ontology.c.ontology_id])
+        if ontology_names is not None:
+            ontology_ids = ontology_ids.where(ontology.c.name.in_([name.upper() for name in ontology_names]))
+        builder = OntologyGraphBuilder()
+        statement = select([term.c.accession]).where(term.c.ontology_id.in_(ontology_ids)).order_by(term.c.term_id)
+        for accession, in connection.execute(statement):
+            builder.add_term(accession)
+        statement = select([child.c.accession, parent.c.accession, relation_type.c.name]) \
+            .select_from(relation.join(relation_type)
+                         .join(child, child.c.term_id == relation.c.child_term_id)
+                         .join(parent, parent.c.term_id == relation.c.parent_term_id)) \
+            .where(relation.c.ontology_id.in_(ontology_ids))
+        if relation_types is not None:
+            statement = statement.where(relation_type.c.name.in_(relation_types))
+        for child_accession, parent_accession, name in connection.execute(statement):
+            builder.add_relation(child_accession, parent_accession, name)
+        return builder.build()
+
+    def node(self, accession):
+        """
+        :param accession: term accession
+        :return: term node id, KeyError if unknown
+        """
+        return self.index[accession]
+
+    def accession(self, node):
+        """
+        :param node: term node id
+        :return: term accession
+        """
+        return self.accessions[node]
+
+    def adjacencies(self, relation_types=None, reverse=False):
+        """
+        :param relation_types: relation types names, all if None
+        :param reverse: children adjacencies instead of parents ones
+        :return: list of (offsets, targets) arrays tuples
+        """
+        names = self.relation_types if relation_types is None else [name for name in relation_types
+                                                                    if name in self.parent_adjacencies]
+        if not reverse:
+            return [self.parent_adjacencies[name] for name in names]
+        for name in names:
+            if name not in self.child_adjacencies:
+                offsets, parents = self.parent_adjacencies[name]
+                sources = array('L')
+                for node in range(len(self.accessions)):
+                    sources.extend([node] * (offsets[node + 1] - offsets[node]))
+                self.child_adjacencies[name] = ClosureGraph.csr(len(self.accessions), parents, sources)
+        return [self.child_adjacencies[name] for name in names]
+
+    def neighbours(self, accession, relation_types=None, reverse=False):
+        """
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :param reverse: children instead of parents
+        :return: list of accessions of term direct parents, or children
+        """
+        node = self.index[accession]
+        found = set()
+        for offsets, targets in self.adjacencies(relation_types, reverse):
+            found.update(targets[offsets[node]:offsets[node + 1]])
+        return [self.accessions[target] for target in sorted(found)]
+
+    def walk(self, accession, relation_types=None, reverse=False):
+        """
+        Breadth first walk from a term
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :param reverse: along children instead of parents
+        :return: generator of (node, distance) of reached terms, term itself excluded
+        """
+        adjacencies = self.adjacencies(relation_types, reverse)
+        start = self.index[accession]
+        seen = {start}
+        level = [start]
+        distance = 0
+        while level:
+            distance += 1
+            next_level = []
+            for node in level:
+                for offsets, targets in adjacencies:
+                    for k in range(offsets[node], offsets[node + 1]):
+                        target = targets[k]
+                        if target not in seen:
+                            seen.add(target)
+                            next_level.append(target)
+                            yield target, distance
+            level = next_level
+
+    def parents(self, accession, relation_types=None):
+        """
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :return: list of accessions of term direct parents
+        """
+        return self.neighbours(accession, relation_types)
+
+    def children(self, accession, relation_types=None):
+        """
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :return: list of accessions of term direct children
+        """
+        return self.neighbours(accession, relation_types, reverse=True)
+
+    def ancestors(self, accession, relation_types=None):
+        """
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :return: set of accessions of terms reached through parents
+        """
+        return {self.accessions[node] for node, _ in self.walk(accession, relation_types)}
+
+    def descendants(self, accession, relation_types=None):
+        """
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :return: set of accessions of terms reached through children
+        """
+        return {self.accessions[node] for node, _ in self.walk(accession, relation_types, reverse=True)}
+
+    def roots(self, relation_types=None):
+        """
+        :param relation_types: relation types names, all if None
+        :return: list of accessions of terms without parents
+        """
+        adjacencies = self.adjacencies(relation_types)
+        return [self.accessions[node] for node in range(len(self.accessions))
+                if all(offsets[node] == offsets[node + 1] for offsets, _ in adjacencies)]
+
+    def leaves(self, relation_types=None):
+        """
+        :param relation_types: relation types names, all if None
+        :return: list of accessions of terms without children
+        """
+        adjacencies = self.adjacencies(relation_types, reverse=True)
+        return [self.accessions[node] for node in range(len(self.accessions))
+                if all(offsets[node] == offsets[node + 1] for offsets, _ in adjacencies)]
+
+    def depth(self, accession, relation_types=None):
+        """
+        :param accession: term accession
+        :param relation_types: relation types names, all if None
+        :return: length of shortest path from term to a root, 0 for roots, None if term is only below cycles
+        """
+        adjacencies = self.adjacencies(relation_types)
+        node = self.index[accession]
+        if all(offsets[node] == offsets[node + 1] for offsets, _ in adjacencies):
+            return 0
+        for node, distance in self.walk(accession, relation_types):
+            if all(offsets[node] == offsets[node + 1] for offsets, _ in adjacencies):
+                return distance
+        return None
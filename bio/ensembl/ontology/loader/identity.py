@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import logging
+import threading
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from .models import Ontology, RelationType, Subset, Term, get_one_or_create
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['IdentityCache']
+
+
+class IdentityCache(object):
+    """ In process cache of rows identities: ontologies, relation types and subsets rows, terms ids by accession
+
+    Cached rows are handed out without querying db again, rows updated by the loader must therefore be cached again
+    (see add) or evicted (see evict). Misses always fall back to db, so that rows created meanwhile by another loader
+    (e.g a parallel slice) are found. Terms ids map is bounded, least recently used accessions are evicted first.
+    """
+    # cached models, with the columns a row is looked up with
+    dimensions = {
+        Ontology: ('name', 'namespace'),
+        RelationType: ('name',),
+        Subset: ('name',)
+    }
+
+    def __init__(self, max_terms=100000):
+        self.max_terms = max_terms
+        self.hits = 0
+        self.misses = 0
+        self._rows = {model: {} for model in self.dimensions}
+        self.terms = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.terms) + sum(len(rows) for rows in self._rows.values())
+
+    def __repr__(self):
+        return '{} hits / {} misses ({} terms)'.format(self.hits, self.misses, len(self.terms))
+
+    def warm(self, session, prefix=None):
+        """
+        Load all cached dimensions rows, and terms ids up to max_terms
+        :param session: db session
+        :param prefix: only load terms with this accession prefix, i.e from the same ontology
+        """
+        for model in self.dimensions:
+            for obj in session.query(model):
+                self.add(obj)
+        query = session.query(Term.accession, Term.term_id, Term.ontology_id)
+        if prefix:
+            query = query.filter(Term.accession.like(prefix + ':%'))
+        for accession, term_id, ontology_id in query.limit(self.max_terms):
+            self.add_term(accession, term_id, ontology_id)
+        logger.debug('Warmed identities %s', self)
+
+    @staticmethod
+    def values(obj):
+        return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+    def key(self, model, **kwargs):
+        columns = self.dimensions.get(model)
+        if columns is None or set(kwargs.keys()) != set(columns):
+            return None
+        return tuple(str(kwargs[column]) for column in columns)
+
+    def add(self, obj, key=None):
+        """
+        Cache a row
+        :param obj: model object
+        :param key: additional lookup key, e.g when db collation matches the row case insensitively
+        """
+        model = type(obj)
+        values = self.values(obj)
+        own_key = self.key(model, **{column: getattr(obj, column) for column in self.dimensions[model]})
+        with self._lock:
+            cached = self._rows[model].get(own_key)
+            if cached is not None:
+                # updated row, refreshed under each of its keys
+                cached.update(values)
+                values = cached
+            self._rows[model][own_key] = values
+            if key is not None:
+                self._rows[model][key] = values
+
+    def evict(self, model, **kwargs):
+        """
+        Remove cached rows updated in db, they are looked up again on next request
+        :param model: cached model
+        :param kwargs: table columns values of evicted rows
+        """
+        mapper = inspect(model)
+        # cached values are keyed by mapped attributes, which may differ from columns names
+        attrs = {mapper.get_property_by_column(model.__table__.c[column]).key: value
+                 for column, value in kwargs.items()}
+        with self._lock:
+            rows = self._rows[model]
+            for key in [key for key, values in rows.items()
+                        if all(values.get(attr) == value for attr, value in attrs.items())]:
+                del rows[key]
+
+    def get_one_or_create(self, model, session, create_method_kwargs=None, **kwargs):
+        """
+        models.get_one_or_create counterpart, answered from cache for rows already seen.
+        Cached rows are merged into session without being loaded again.
+        """
+        key = self.key(model, **kwargs)
+        if key is None:
+            return get_one_or_create(model, session, create_method_kwargs=create_method_kwargs, **kwargs)
+        values = self._rows[model].get(key)
+        if values is not None:
+            self.hits += 1
+            obj = model(**values)
+            make_transient_to_detached(obj)
+            return session.merge(obj, load=False), False
+        self.misses += 1
+        obj, created = get_one_or_create(model, session, create_method_kwargs=create_method_kwargs, **kwargs)
+        self.add(obj, key)
+        return obj, created
+
+    def term(self, accession):
+        """
+        Get a term identity
+        :param accession: term accession
+        :return: tuple term_id, ontology_id or None when unknown
+        """
+        with self._lock:
+            ids = self.terms.get(accession)
+            if ids is None:
+                self.misses += 1
+                return None
+            self.terms.move_to_end(accession)
+            self.hits += 1
+            return ids
+
+    def get_term(self, accession, session):
+        """
+        Get a known term, merged into session without being loaded: its columns are only read from db when accessed
+        :param accession: term accession
+        :param session: db session
+        :return: Term or None when unknown
+        """
+        ids = self.term(accession)
+        if ids is None:
+            return None
+        term_id, ontology_id = ids
+        m_term = Term(term_id=term_id, accession=accession, ontology_id=ontology_id)
+        make_transient_to_detached(m_term)
+        return session.merge(m_term, load=False)
+
+    def add_term(self, accession, term_id, ontology_id):
+        with self._lock:
+            self.terms[accession] = (term_id, ontology_id)
+            self.terms.move_to_end(accession)
+            while len(self.terms) > self.max_terms:
+                self.terms.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            for rows in self._rows.values():
+                rows.clear()
+            self.terms.clear()
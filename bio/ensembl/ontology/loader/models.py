@@ -31,7 +31,7 @@ SQLAlchemy database models for OLS ontologies loading
 
 """
 __all__ = ['Base', 'Ontology', 'Meta', 'Term', 'Subset', 'RelationType', 'Closure', 'Relation', 'AltId', 'Synonym',
-           'SynonymTypeEnum', 'get_one_or_create']
+           'SynonymTypeEnum', 'hash_metadata', 'term_hash_table', 'get_one_or_create', 'create_or_get']
 
 StringUtf8 = String(255)
 StringUtf8 = StringUtf8.with_variant(String(255, collation='utf8_general_ci'), 'mysql')
@@ -70,6 +70,25 @@ def get_one_or_create(model, session=None, create_method='', create_method_kwarg
             return session.query(model).filter_by(**kwargs).one(), False
 
 
+def create_or_get(model, session=None, create_method='', create_method_kwargs=None, **kwargs):
+    """
+    get_one_or_create counterpart for rows expected not to exist yet: row is created without being looked up first,
+    existing one is only retrieved when creation violates a unique constraint.
+    """
+    create_kwargs = create_method_kwargs or {}
+    create_kwargs.update(kwargs)
+    try:
+        logger.debug('Create %s', create_kwargs)
+        new_obj = getattr(model, create_method, model)(**create_kwargs)
+        session.add(new_obj)
+        session.commit()
+        return new_obj, True
+    except IntegrityError as e:
+        logger.info('Exists %s: %s', kwargs, str(e))
+        session.rollback()
+        return session.query(model).filter_by(**kwargs).one(), False
+
+
 Base = declarative_base()
 
 
@@ -261,7 +280,11 @@ class Term(LoadAble, Base):
             self.child_terms.append(relation)
         return relation
 
-    def add_parent_relation(self, parent_term, rel_type, session):
+    def add_parent_relation(self, parent_term, rel_type, session, writer=None):
+        if writer is not None:
+            # written along with next batch, terms are matched on their accession
+            writer.add_relation(self.accession, parent_term.accession, rel_type.relation_type_id, self.ontology_id)
+            return None
         relation, created = get_one_or_create(Relation, session,
                                               parent_term=parent_term,
                                               child_term=self,
@@ -363,7 +386,7 @@ class Relation(LoadAble, Base):
 
 
 class Closure(LoadAble, Base):
-    # NOT USE for now, closure is computed by perl standard script
+    # computed from relations once ontology is loaded, see closure.compute_closure
     __tablename__ = 'closure'
     __table_args__ = (
         Index('closure_child_parent_idx', 'child_term_id', 'parent_term_id', 'subparent_term_id', 'ontology_id',
@@ -390,3 +413,17 @@ class Closure(LoadAble, Base):
                                back_populates='parent_closures')
     subparent_term = relationship('Term', primaryjoin='Closure.subparent_term_id == Term.term_id',
                                   back_populates='subparent_closures')
+
+
+# Terms content hashes, not part of ontology schema: only created when loading with 'incremental' option, see
+# OlsLoader.load_ontology_terms. Release is the last ontology release terms were found in, see
+# OlsLoader.remove_absent_terms.
+hash_metadata = MetaData()
+
+term_hash_table = Table('term_hash', hash_metadata,
+                        Column('accession', String(64), primary_key=True),
+                        Column('ontology', String(64), nullable=False),
+                        Column('hash', String(40), nullable=False),
+                        Column('release', String(255), nullable=False),
+                        Index('term_hash_ontology_idx', 'ontology', 'release'),
+                        mysql_engine='MyISAM')
@@ -12,19 +12,41 @@
    limitations under the License.
 """
 import datetime
+import collections
+import collections.abc
+import functools
+import hashlib
+import json
 import logging
 from os import getenv
 from os.path import join
 
 import inflection
 import itypes
+from coreapi import Link
 from coreapi.exceptions import CoreAPIException
+from requests.exceptions import RequestException
+from sqlalchemy import select, and_
 from sqlalchemy.orm.exc import NoResultFound
 
 import ebi.ols.api.exceptions
 import ebi.ols.api.helpers as helpers
+from bio.ensembl.ontology.loader.ancestors import AncestorIndex, index_path, db_signature
+from bio.ensembl.ontology.loader.cache import LRUCache
+from bio.ensembl.ontology.loader.closure import compute_closure, compute_closures, update_closure, ontologies_ids, \
+    closure_relation_types
 from bio.ensembl.ontology.loader.db import dal
+from bio.ensembl.ontology.loader.extract import AsyncTermsExtractor
+from bio.ensembl.ontology.loader.files import ontology_reader
+from bio.ensembl.ontology.loader.graph import OntologyGraph, OntologyGraphBuilder
+from bio.ensembl.ontology.loader.identity import IdentityCache
 from bio.ensembl.ontology.loader.models import *
+from bio.ensembl.ontology.loader.prefetch import TermsPrefetcher, ontology_terms
+from bio.ensembl.ontology.loader.relations import RelationsExtractor
+from bio.ensembl.ontology.loader.staging import StagingWriter, staging_metadata
+from bio.ensembl.ontology.loader.transport import ols_session, session_scope, ScopedOlsClient, ScopedListClient, \
+    load_relation, relations_types
+from bio.ensembl.ontology.loader.writer import BatchWriter, InfileWriter, sqlite_max_variables
 from ebi.ols.api.client import OlsClient
 
 
@@ -40,9 +62,26 @@ def term_logger_name(ontology_name, start=0, end=0):
     return '.'.join([ontology_name.lower(), 'terms', str(start), str(end)])
 
 
+def ols_scoped(method):
+    """ Send OLS api requests made by a loader method through the loader own session """
+
+    @functools.wraps(method)
+    def scoped_method(loader, *args, **kwargs):
+        with session_scope(loader.session):
+            return method(loader, *args, **kwargs)
+
+    return scoped_method
+
+
 def init_schema(db_url, **options):
     dal.db_init(db_url, **options)
     dal.create_schema()
+    if options.get('full_load'):
+        # secondary indexes are built in one pass once all ontologies are loaded
+        dal.drop_secondary_indexes()
+    if options.get('staging'):
+        # shared by all terms loaders, which only append rows to them
+        staging_metadata.create_all(dal.engine)
     db_version = options.get('ens_version', 99)
     with dal.session_scope() as session:
         metas = {
@@ -54,6 +93,16 @@ def init_schema(db_url, **options):
             get_one_or_create(Meta, session, meta_key=meta_key, create_method_kwargs=dict(meta_value=meta_value))
 
 
+def drop_staging(db_url, **options):
+    """ Drop staging tables, once rows staged for every ontology are merged ('staging' option) """
+    dal.db_init(db_url, **options)
+    try:
+        staging_metadata.drop_all(dal.engine)
+    finally:
+        dal.connection.close()
+        dal.engine.dispose()
+
+
 log_format = '%(asctime)s %(levelname)s %(name)s.%(funcName)s: %(message)s'
 formatter = logging.Formatter(log_format)
 
@@ -78,6 +127,8 @@ class OlsLoader:
         'hasRelatedSynonym': 'RELATED'
     }
 
+    __subset_property = 'http://www.geneontology.org/formats/oboInOwl#SubsetProperty'
+
     _default_options = {
         'echo': False,
         'wipe': False,
@@ -87,6 +138,30 @@ class OlsLoader:
         'process_relations': True,
         'process_parents': True,
         'page_size': 500,
+        'prefetch_pages': 2,
+        'extraction': 'sync',
+        'max_in_flight': 100,
+        'initial_in_flight': 8,
+        'backoff_factor': 0.5,
+        'backoff_max': 60,
+        'cache_dir': None,
+        'cache_ttl': None,
+        'cache_max_size': None,
+        'offline': False,
+        'lookup_cache_size': 1024,
+        'identity_cache_size': 100000,
+        'ontology_files': None,
+        'edges_files': None,
+        'batch_size': 0,
+        'upsert': 'ignore',
+        'fast_load': False,
+        'staging': False,
+        'fresh_load': None,
+        'incremental': False,
+        'wipe_batch_size': 10000,
+        'closure_relation_types': closure_relation_types,
+        'closure_workers': None,
+        'graph': False,
         'output_dir': getenv("HOME"),
         'verbosity': logging.WARNING,
         'ols_api_url': None
@@ -97,21 +172,53 @@ class OlsLoader:
 
     def __init__(self, url, **options):
         self.db_url = url
-        self.options = self._default_options
-        self.options.update(options)
-        self.client = OlsClient(
-            page_size=self.options.get('page_size'),
-            base_site=self.options.get('ols_api_url'))
+        self.options = dict(self._default_options, **options)
+        self.session = ols_session(**self.options)
+        self.controller = self.session.controller
+        with session_scope(self.session):
+            self.client = ScopedOlsClient(
+                page_size=self.options.get('page_size'),
+                base_site=self.options.get('ols_api_url'))
         self.retry = 0
         if self.options.get('allowed_ontologies', None):
             self.allowed_ontologies = self.options.get('allowed_ontologies')
+        if self.options.get('incremental') and self.options.get('staging'):
+            raise RuntimeError('Incremental load is not supported with staging tables')
         self.db_init = False
         dal.db_init(self.db_url, **self.options)
         dal.create_schema()
+        if self.options.get('incremental'):
+            hash_metadata.create_all(dal.engine)
         logging.basicConfig(level=self.options['verbosity'])
         self.current_ontology = None
         self.report_log = None
         self.terms_log = None
+        self.extracted = None
+        self.edges = None
+        self.identities = IdentityCache(self.options.get('identity_cache_size'))
+        self.writer = None
+        if self.options.get('staging'):
+            self.writer = StagingWriter(dal.engine, self.options.get('batch_size') or 10000)
+        elif self.options.get('fast_load'):
+            self.writer = InfileWriter(dal.engine, self.options.get('output_dir'),
+                                       self.options.get('batch_size') or 100000, self.options.get('upsert', 'ignore'),
+                                       identities=self.identities)
+        elif self.options.get('batch_size'):
+            self.writer = BatchWriter(dal.engine, self.options['batch_size'], self.options.get('upsert', 'ignore'),
+                                      identities=self.identities)
+        self.lookups = LRUCache(self.options.get('lookup_cache_size'))
+        # ontology files readers, per ontology name and path
+        self.readers = {}
+        # edges read from ontologies dumps ('bulk' extraction option), per ontology name and path
+        self.edge_lists = {}
+        self.fresh = False
+        # terms content hashes, of loaded terms and accessions of unchanged ones ('incremental' option)
+        self.hashes = {}
+        self.unchanged = set()
+        self.subsets = None
+        self.subsets_ontologies = set()
+        # loaded terms and relations, kept in memory with 'graph' option
+        self.graph = OntologyGraphBuilder() if self.options.get('graph') else None
 
     def get_ontology_logger(self, ontology_name):
         if not self.report_log:
@@ -141,6 +248,7 @@ class OlsLoader:
 
         return self.terms_log
 
+    @ols_scoped
     def load_ontology(self, ontology, session, namespace=''):
         """
         Load single ontology data from OLS API.
@@ -151,18 +259,19 @@ class OlsLoader:
         :return: an Ontology model object.
         """
         if type(ontology) is str:
-            ontology = self.client.ontology(identifier=ontology)
+            reader = self.ontology_reader(ontology)
+            ontology = reader.ontology() if reader is not None else self.ontology_details(ontology)
         elif not isinstance(ontology, helpers.Ontology):
             raise RuntimeError('Wrong parameter')
 
         ontology_name = ontology.ontology_id.upper()
         self.current_ontology = ontology_name
         namespace = namespace if namespace != '' else ontology.ontology_id
-        m_ontology, created = get_one_or_create(Ontology,
-                                                session,
-                                                name=ontology_name,
-                                                namespace=namespace,
-                                                create_method_kwargs={'helper': ontology})
+        m_ontology, created = self.identities.get_one_or_create(Ontology,
+                                                                session,
+                                                                name=ontology_name,
+                                                                namespace=namespace,
+                                                                create_method_kwargs={'helper': ontology})
         self.report_log = self.get_ontology_logger(ontology_name)
         if created:
             self.report_log.info('----------------------------------')
@@ -177,26 +286,74 @@ class OlsLoader:
                           meta_key=ontology_name + '_load_date',
                           create_method_kwargs=dict(
                               meta_value=ontology_name + '/' + start.strftime('%c')))
-        try:
-            updated_at = datetime.datetime.strptime(ontology.updated, '%Y-%m-%dT%H:%M:%S.%f%z')
-        except ValueError:
-            # Default update to current date time
-            updated_at = datetime.datetime.now()
         get_one_or_create(Meta,
                           session,
                           meta_key=ontology_name + '_file_date',
                           create_method_kwargs=dict(
-                              meta_value=ontology_name + '/' + updated_at.strftime('%c')))
+                              meta_value=self.file_date(ontology)))
 
         return m_ontology
 
+    @staticmethod
+    def file_date(ontology):
+        """
+        :param ontology: helpers.Ontology
+        :return: ontology last update meta value
+        """
+        try:
+            updated_at = datetime.datetime.strptime(ontology.updated, '%Y-%m-%dT%H:%M:%S.%f%z')
+        except (ValueError, TypeError):
+            # Default update to current date time
+            updated_at = datetime.datetime.now()
+        return ontology.ontology_id.upper() + '/' + updated_at.strftime('%c')
+
+    def ontology_changed(self, ontology_name):
+        """
+        Whether an ontology changed since it was loaded, i.e its OLS (or file) last update or version do not match the
+        ones recorded in db ('incremental' option). Ontologies never loaded are changed.
+        :param ontology_name: ontology short name
+        :return: bool
+        """
+        reader = self.ontology_reader(ontology_name)
+        o_ontology = reader.ontology() if reader is not None else self.ontology_details(ontology_name)
+        name = ontology_name.upper()
+        with dal.session_scope() as session:
+            file_date = session.query(Meta.meta_value).filter_by(meta_key=name + '_file_date') \
+                .order_by(Meta.meta_id.desc()).limit(1).scalar()
+            versions = {version for version, in session.query(Ontology._version).filter_by(name=name)}
+        changed = file_date != self.file_date(o_ontology) or versions != {o_ontology.version}
+        self.get_ontology_logger(ontology_name).info('- Ontology %s %s since loaded (%s, versions %s)', name,
+                                                     'changed' if changed else 'unchanged', file_date, versions)
+        return changed
+
+    def update_version(self, ontology_name):
+        """
+        Record ontology current update date and version, once all its terms are loaded ('incremental' option)
+        :param ontology_name: ontology short name
+        """
+        reader = self.ontology_reader(ontology_name)
+        o_ontology = reader.ontology() if reader is not None else self.ontology_details(ontology_name)
+        name = ontology_name.upper()
+        with dal.session_scope() as session:
+            for meta_key, meta_value in ((name + '_file_date', self.file_date(o_ontology)),
+                                         (name + '_load_date', name + '/' + datetime.datetime.now().strftime('%c'))):
+                session.query(Meta).filter_by(meta_key=meta_key).delete(synchronize_session=False)
+                session.add(Meta(meta_key=meta_key, meta_value=meta_value))
+            session.query(Ontology).filter_by(name=name) \
+                .update({Ontology._version: o_ontology.version}, synchronize_session=False)
+        self.identities.evict(Ontology, name=name)
+
     def wipe_ontology(self, ontology_name):
         """
-        Completely remove all ontology related data from DBs
+        Completely remove all ontology related data from DBs.
+        Ontology terms ids are collected once, their rows are then deleted by ordered batches of ids
+        ('wipe_batch_size' option), each in its own transaction: tables are only locked for a batch at once, other
+        loaders are not stalled until the whole wipe is done.
         :param ontology_name: specified ontology short name
         :return: boolean whether or not Ontology has been successfully deleted
         """
         logger = self.get_ontology_logger(ontology_name)
+        self.identities.clear()
         with dal.session_scope() as session:
             logger.info('Wipe ontology %s', ontology_name)
             try:
@@ -207,54 +364,81 @@ class OlsLoader:
                 ontologies = session.query(Ontology).filter_by(name=ontology_name.upper()).all()
                 for ontology in ontologies:
                     logger.info('Deleting namespaced ontology %s - %s', ontology.name, ontology.namespace)
-                    res = session.query(Synonym).filter(Synonym.term_id == Term.term_id,
-                                                        Term.ontology_id == ontology.id).delete(
-                        synchronize_session=False)
-                    logger.info('Wiped %s synonyms', res)
-                    rel = session.query(Relation).filter(Relation.child_term_id == Term.term_id,
-                                                         Term.ontology_id == ontology.id).delete(
-                        synchronize_session=False)
-                    rel2 = session.query(Relation).filter(Relation.parent_term_id == Term.term_id,
-                                                          Term.ontology_id == ontology.id).delete(
-                        synchronize_session=False)
-                    logger.info('Wiped %s Relations', rel + rel2)
-
-                    clo = session.query(Closure).filter(Closure.child_term_id == Term.term_id,
-                                                        Term.ontology_id == ontology.id).delete(
-                        synchronize_session=False)
-                    clo1 = session.query(Closure).filter(Closure.parent_term_id == Term.term_id,
-                                                         Term.ontology_id == ontology.id).delete(
-                        synchronize_session=False)
-                    clo2 = session.query(Closure).filter(Closure.subparent_term_id == Term.term_id,
-                                                         Term.ontology_id == ontology.id).delete(
-                        synchronize_session=False)
-                    logger.info('Wiped %s Closure', clo + clo1 + clo2)
-
-                    res = session.query(AltId).filter(AltId.term_id == Term.term_id,
-                                                      Term.ontology_id == ontology.id).delete(synchronize_session=False)
-                    logger.info('Wiped %s AltIds', res)
-                    res = session.query(Term).filter(Term.ontology_id == ontology.id).delete(synchronize_session=False)
-                    logger.info('Wiped %s Terms', res)
-                    session.delete(ontology)
-                    logger.debug('...Done')
-                return True
+                ontology_ids = [ontology.id for ontology in ontologies]
+                term_ids = [term_id for term_id, in session.query(Term.term_id)
+                            .filter(Term.ontology_id.in_(ontology_ids))
+                            .order_by(Term.term_id)]
+                if term_hash_table.exists(session.connection()):
+                    # wiped terms are loaded again by next incremental load
+                    session.execute(term_hash_table.delete()
+                                    .where(term_hash_table.c.ontology == ontology_name.upper()))
             except NoResultFound:
                 logger.error('Ontology %s not found !', ontology_name)
-        return False
+                return False
+        if term_ids:
+            wiped = self.wipe_terms(term_ids)
+            logger.info('Wiped %s synonyms', wiped[Synonym])
+            logger.info('Wiped %s Relations', wiped[Relation])
+            logger.info('Wiped %s Closure', wiped[Closure])
+            logger.info('Wiped %s AltIds', wiped[AltId])
+            logger.info('Wiped %s Terms', wiped[Term])
+        if ontology_ids:
+            with dal.engine.begin() as connection:
+                connection.execute(Ontology.__table__.delete().where(Ontology.id.in_(ontology_ids)))
+        logger.debug('...Done')
+        return True
 
+    def wipe_terms(self, term_ids, closure=True):
+        """
+        Delete terms rows and all rows referencing them, by batches of ids
+        :param term_ids: sorted terms ids
+        :param closure: whether closure rows are deleted as well
+        :return: dict number of deleted rows per model
+        """
+        # models, with columns referencing terms
+        references = [
+            (Synonym, [Synonym.term_id]),
+            (AltId, [AltId.term_id]),
+            (Relation, [Relation.child_term_id, Relation.parent_term_id]),
+            (Closure, [Closure.child_term_id, Closure.parent_term_id, Closure.subparent_term_id]),
+            (Term, [Term.term_id])
+        ]
+        if not closure:
+            references = [(model, columns) for model, columns in references if model is not Closure]
+        size = self.options.get('wipe_batch_size') or 10000
+        if dal.engine.dialect.name == 'sqlite':
+            size = min(size, sqlite_max_variables)
+        wiped = collections.Counter()
+        for model, columns in references:
+            for column in columns:
+                for i in range(0, len(term_ids), size):
+                    with dal.engine.begin() as connection:
+                        statement = model.__table__.delete().where(column.in_(term_ids[i:i + size]))
+                        wiped[model] += connection.execute(statement).rowcount
+        return wiped
+
+    @ols_scoped
     def load_ontology_terms(self, ontology, start=None, end=None):
+        reader = self.ontology_reader(ontology)
+        if reader is not None:
+            return self.load_file_terms(reader, start, end)
         nb_terms = 0
         nb_terms_ignored = 0
-        o_ontology = self.client.ontology(identifier=ontology)
+        o_ontology = self.ontology_details(ontology)
         terms_log = self.get_term_logger(ontology, start, end)
         report = self.get_ontology_logger(ontology)
+        incremental = self.options.get('incremental')
+        self.hashes.clear()
+        self.unchanged.clear()
         if o_ontology:
             self.current_ontology = o_ontology.ontology_id.upper()
+            self.stage_for(self.current_ontology)
             if start is not None and end is not None:
                 terms_log.info('Loading terms slice [%s, %s]', start, end)
-                # TODO move this slice fix into ols-client when dealing with discrepancies between number of terms
-                # between ontology / terms api calls
-                max_terms = len(o_ontology.terms()) - 1
+                # terms api may return less terms than declared in ontology, actual total is read from the page
+                # holding the slice start, which is the first one needed anyway
+                o_terms = ontology_terms(o_ontology.ontology_id, start, self.client.page_size)
+                max_terms = len(o_terms) - 1
                 min_end = min(end, max_terms)
                 terms_log.debug('Which resolve to [%s, %s]', start, min_end)
                 terms_log.info('-----------------------------------------')
@@ -262,24 +446,35 @@ class OlsLoader:
                     terms_log.warning("Wrong slice order.min:%s max:%s ", start, min_end)
                     # skip this chunk
                     return None, None
-                terms = o_ontology.terms()[start:min_end]
+                terms = TermsPrefetcher(o_terms, start, min_end, prefetch=self.options.get('prefetch_pages'))
                 terms_log.info('Slice len %s', len(terms))
                 report.info('- Loading %s terms slice [%s:%s]', ontology, start, end)
             else:
-                terms = o_ontology.terms()
+                terms = TermsPrefetcher(ontology_terms(o_ontology.ontology_id, 0, self.client.page_size),
+                                        prefetch=self.options.get('prefetch_pages'))
                 terms_log.info('Loading %s terms for %s', len(terms), o_ontology.ontology_id.upper())
                 report.info('- Loading all terms (%s)', len(terms))
+            ontology_name = self.current_ontology
+            hashes = self.term_hashes(ontology_name) if incremental else {}
             with dal.session_scope() as session:
-                for o_term in terms:
+                self.identities.warm(session, self.current_ontology)
+                self.fresh = self.is_fresh(session, self.current_ontology)
+                for o_term in self.extract_terms(terms):
                     if o_term.is_defining_ontology and has_accession(o_term):
                         terms_log.debug('Term %s', o_term)
-                        m_ontology, created = get_one_or_create(Ontology,
-                                                                session,
-                                                                name=self.current_ontology,
-                                                                namespace=o_term.namespace,
-                                                                create_method_kwargs=dict(
-                                                                    version=o_ontology.version,
-                                                                    title=o_ontology.title))
+                        if incremental:
+                            # hashed before being loaded, which may fill in its missing fields
+                            term_hash = self.term_hash(o_term, self.term_relatives(o_term))
+                            if hashes.get(o_term.accession) == term_hash:
+                                self.unchanged.add(o_term.accession)
+                                continue
+                        m_ontology, created = self.identities.get_one_or_create(Ontology,
+                                                                                session,
+                                                                                name=self.current_ontology,
+                                                                                namespace=o_term.namespace,
+                                                                                create_method_kwargs=dict(
+                                                                                    version=o_ontology.version,
+                                                                                    title=o_ontology.title))
                         terms_log.debug('Loaded term (from OLS) %s', o_term)
                         terms_log.debug('Adding/Retrieving namespaced ontology %s', o_term.namespace)
                         terms_log.debug('Ontology namespace %s %s', m_ontology.name, m_ontology.namespace)
@@ -287,27 +482,292 @@ class OlsLoader:
                             terms_log.warning('discrepancy term/ontology namespace')
                             terms_log.warning('term:', o_term)
                             terms_log.warning('ontology:', o_ontology)
-                        term = self.load_term(o_term, m_ontology, session)
+                        term = self.load_term(o_term, m_ontology, session, fresh=self.fresh, reload=incremental)
                         if term:
-                            session.add(term)
+                            if self.writer is None:
+                                session.add(term)
+                            self.flush_writer(partial=True)
                             nb_terms += 1
+                            if incremental:
+                                self.hashes[o_term.accession] = term_hash
                     else:
                         terms_log.info('Ignored term [%s:%s]', o_term.is_defining_ontology, o_term.short_form)
                         nb_terms_ignored += 1
+                self.flush_writer()
+                if incremental:
+                    session.commit()
+                    self.store_term_hashes(ontology_name, self.ontology_release(o_ontology), self.hashes,
+                                           self.unchanged)
+                    terms_log.info('- Unchanged %s terms', len(self.unchanged))
                 terms_log.info('- Expected %s terms (defined in accepted ontology)', nb_terms)
                 terms_log.info('- Ignored %s terms (not defined in accepted ontology)', nb_terms_ignored)
+                terms_log.info('- OLS lookups cache: %s hits / %s misses', self.lookups.hits, self.lookups.misses)
+                terms_log.info('- DB identities cache: %s', self.identities)
+                terms_log.info('- Fresh load: %s', self.fresh)
+                terms_log.info('- OLS requests: %s', self.controller)
                 return nb_terms, nb_terms_ignored
         else:
             report.info('Ontology not found %s', ontology)
             terms_log.warning('Ontology not found %s', ontology)
             return 0, 0
 
-    def load_term(self, o_term, ontology, session, process_relation=True):
+    def ontology_reader(self, ontology_name):
+        """
+        Get ontology file reader, when ontology is set to be loaded from a local file instead of OLS
+        ('ontology_files' option, mapping ontology names to OBO or obographs files)
+        :param ontology_name: ontology short name
+        :return: files.OntologyReader or None, same reader for each call
+        """
+        path = (self.options.get('ontology_files') or {}).get(ontology_name.upper())
+        if not path:
+            return None
+        # kept along loader, files are not read again for their header and number of terms
+        if (ontology_name.upper(), path) not in self.readers:
+            self.readers[(ontology_name.upper(), path)] = ontology_reader(path, ontology_name)
+        return self.readers[(ontology_name.upper(), path)]
+
+    @ols_scoped
+    def load_file_terms(self, reader, start=None, end=None):
+        """
+        Load ontology terms from a local file, in two streaming passes: terms then relations.
+        :param reader: files.OntologyReader
+        :param start: first term index in file
+        :param end: last term index in file (excluded)
+        :return: tuple loaded terms, ignored terms
+        """
+        nb_terms = 0
+        nb_terms_ignored = 0
+        terms_log = self.get_term_logger(reader.ontology_name, start, end)
+        report = self.get_ontology_logger(reader.ontology_name)
+        self.current_ontology = reader.prefix
+        self.stage_for(reader.ontology_name)
+        in_slice = start is not None and end is not None
+        report.info('- Loading %s terms from %s [%s:%s]', reader.prefix, reader.path, start, end)
+        with dal.session_scope() as session:
+            self.identities.warm(session, reader.prefix)
+            self.fresh = self.is_fresh(session, reader.prefix)
+            if self.current_ontology not in self.subsets_ontologies:
+                self.load_subsets(reader.ontology_name, session)
+            # slice terms accessions, to only load their relations
+            accessions = set() if in_slice else None
+            for o_term in reader.terms(start or 0, end):
+                if o_term.is_defining_ontology and has_accession(o_term):
+                    m_ontology, created = self.identities.get_one_or_create(
+                        Ontology,
+                        session,
+                        name=self.current_ontology,
+                        namespace=o_term.namespace,
+                        create_method_kwargs=dict(version=reader.header.get('version'),
+                                                  title=reader.header.get('title', reader.prefix)))
+                    self.load_file_term(o_term, m_ontology, session)
+                    self.flush_writer(partial=True)
+                    if in_slice:
+                        accessions.add(o_term.accession)
+                    nb_terms += 1
+                else:
+                    terms_log.info('Ignored term [%s:%s]', o_term.is_defining_ontology, o_term.short_form)
+                    nb_terms_ignored += 1
+            n_relations = self.load_file_relations(reader, accessions, session)
+            self.flush_writer()
+            if self.options.get('process_parents', True) and not self.options.get('staging'):
+                # staged terms are not in db yet, roots are then updated once merged
+                n_roots = self.update_file_roots(reader.prefix, accessions, session)
+                terms_log.info('- Root terms %s', n_roots)
+            terms_log.info('- Expected %s terms (defined in accepted ontology)', nb_terms)
+            terms_log.info('- Ignored %s terms (not defined in accepted ontology)', nb_terms_ignored)
+            terms_log.info('- Loaded %s relations', n_relations)
+        return nb_terms, nb_terms_ignored
+
+    def load_file_term(self, o_term, m_ontology, session):
+        """
+        Load a term read from file, with its subsets, alt ids and synonyms.
+        :param o_term: helpers.Term
+        :param m_ontology: term Ontology
+        :param session: db session
+        :return: Term
+        """
+        o_term.label = o_term.label or o_term.accession
+        if not o_term.description:
+            o_term.description = [inflection.humanize(o_term.label)]
+        m_term, created = self.get_or_create_term(o_term.accession, m_ontology, session, fresh=self.fresh,
+                                                  helper=o_term)
+        if self.graph is not None:
+            self.graph.add_term(m_term.accession)
+        if not created:
+            # may have been created as a relation target, before its own entry is read
+            m_term.update_from_helper(o_term)
+            m_term.ontology_id = m_ontology.id
+            if self.writer is not None:
+                # synonyms and alt ids read from file replace existing ones
+                self.writer.sync_term(m_term.accession)
+            if self.writer is not None and m_term not in session:
+                # already written to staging tables, updated term is staged again
+                self.writer.add_term(m_term)
+        self.load_term_subsets(m_term, session)
+        self.load_alt_ids(m_term, o_term, session, created)
+        self.load_term_synonyms(m_term, o_term, session, created)
+        return m_term
+
+    def load_file_relations(self, reader, accessions, session):
+        """
+        Load relations read from file
+        :param reader: files.OntologyReader
+        :param accessions: only load relations of these terms, all if None
+        :param session: db session
+        :return: number of loaded relations
+        """
+        logger = self.get_term_logger(self.current_ontology)
+        n_relations = 0
+        m_term = None
+        for accession, rel_name, o_related in reader.edges(accessions):
+            option = 'process_parents' if rel_name == 'parents' else 'process_relations'
+            if not self.options.get(option, True) or not has_accession(o_related):
+                continue
+            if m_term is None or m_term.accession != accession:
+                m_term = self.get_term(accession, session, reference=True)
+                if m_term is None:
+                    logger.warning('Term %s not loaded, ignored relation %s', accession, rel_name)
+                    continue
+            relation_type, created = self.identities.get_one_or_create(RelationType,
+                                                                       session,
+                                                                       name=self.__relation_map.get(rel_name, rel_name))
+            if not o_related.is_defining_ontology and o_related.accession.split(':')[0] in self.allowed_ontologies:
+                # defined in another loaded ontology, retrieved from OLS as any related term
+                try:
+                    m_related, relation = self.load_term_relation(m_term, o_related, relation_type, session)
+                except (ebi.ols.api.exceptions.OlsException, RequestException) as e:
+                    logger.warning('Unable to load %s %s %s: %s', accession, rel_name, o_related.accession, e)
+                    continue
+            else:
+                m_related, created = self.get_or_create_term(o_related.accession, m_term.ontology_id, session,
+                                                             name=o_related.label or o_related.accession,
+                                                             iri=o_related.iri)
+                self.add_relation(m_term, m_related, relation_type, session)
+            if m_related:
+                n_relations += 1
+                self.flush_writer(partial=True)
+        return n_relations
+
+    def update_file_roots(self, prefix, accessions, session):
+        """
+        Flag terms without is_a parent as root, files do not declare them
+        :param prefix: ontology accessions prefix
+        :param accessions: only update these terms, all ontology terms if None
+        :param session: db session
+        :return: number of root terms
+        """
+        is_a = session.query(RelationType.relation_type_id).filter_by(name='is_a')
+        with_parents = session.query(Relation.child_term_id).filter(Relation.relation_type_id.in_(is_a.subquery()))
+        query = session.query(Term).filter(Term.accession.like(prefix + ':%'),
+                                           Term.is_obsolete == 0,
+                                           ~Term.term_id.in_(with_parents.subquery()))
+        if accessions is not None:
+            query = query.filter(Term.accession.in_(accessions))
+        return query.update({Term.is_root: 1}, synchronize_session=False)
+
+    def extract_terms(self, terms):
+        """
+        Iterate over terms to load, fetching their related OLS data ahead with 'async' extraction option, or their
+        relations from the ontology edges dump with 'bulk' extraction option
+        :param terms: TermsPrefetcher terms slice
+        :return: generator of terms
+        """
+        if self.options.get('extraction') == 'bulk':
+            self.edges = self.ontology_edges(self.current_ontology)
+            try:
+                yield from terms
+            finally:
+                self.edges = None
+            return
+        if self.options.get('extraction') != 'async':
+            yield from terms
+            return
+        extractor = AsyncTermsExtractor(self.client, self.allowed_ontologies,
+                                        ignored_relations=self.__ignored_relations,
+                                        max_in_flight=self.options.get('max_in_flight'),
+                                        prefetch=self.options.get('prefetch_pages'),
+                                        process_relations=self.options.get('process_relations', True),
+                                        process_parents=self.options.get('process_parents', True),
+                                        lookups=self.lookups)
+        try:
+            for extracted in extractor(terms):
+                self.extracted = extracted
+                yield extracted.term
+        finally:
+            self.extracted = None
+
+    def ontology_edges(self, ontology_name):
+        """
+        Get all relations of an ontology, read once from its OBO or obographs dump ('edges_files' option, mapping
+        ontology names to files) while its terms are still read from OLS
+        :param ontology_name: ontology short name
+        :return: relations.EdgeList, None without dump, relations are then fetched term by term
+        """
+        path = (self.options.get('edges_files') or {}).get(ontology_name.upper())
+        if not path:
+            self.get_ontology_logger(ontology_name).warning('No edges dump for %s, relations are fetched for each '
+                                                            'term', ontology_name)
+            return None
+        if (ontology_name.upper(), path) not in self.edge_lists:
+            extractor = RelationsExtractor(ontology_reader(path, ontology_name),
+                                           process_relations=self.options.get('process_relations', True),
+                                           process_parents=self.options.get('process_parents', True))
+            self.edge_lists[(ontology_name.upper(), path)] = extractor.extract()
+        return self.edge_lists[(ontology_name.upper(), path)]
+
+    @ols_scoped
+    def ols_call(self, key, fetch):
+        """
+        Get OLS api response, from data extracted ahead if any
+        :param key: api call identifier, see extract.Extracted
+        :param fetch: callable doing the actual api call
+        :return: api response
+        """
+        if self.extracted is not None:
+            return self.extracted.get(key, fetch)
+        return fetch()
+
+    def relatives(self, o_term, rel_name):
+        """
+        Get term related terms, from the ontology edges dump if any
+        :param o_term: helpers.Term
+        :param rel_name: OLS relation name
+        :return: list of helpers.Term
+        """
+        if self.edges is not None and has_accession(o_term):
+            o_relatives = self.edges.relatives(o_term.accession, rel_name)
+            if o_relatives is not None:
+                return o_relatives
+        return self.ols_call(('relation', o_term.iri, rel_name), lambda: load_relation(o_term, rel_name))
+
+    @ols_scoped
+    def ontology_details(self, identifier):
+        """
+        Retrieve ontology descriptor from OLS, memoized
+        :param identifier: ontology short name
+        :return: helpers.Ontology
+        """
+        return self.lookups.get(('ontology', identifier.lower()),
+                                lambda: self.client.ontology(identifier=identifier))
+
+    def term_details(self, iri):
+        """
+        Retrieve term details from OLS, memoized
+        :param iri: term iri
+        :return: helpers.Term
+        """
+        key = ('term', iri)
+        fetch = functools.partial(self.client.term, identifier=iri, silent=True, unique=True)
+        return self.lookups.get(key, lambda: self.ols_call(key, fetch))
+
+    def load_term(self, o_term, ontology, session, process_relation=True, fresh=False, reload=False):
         """
         :param o_term:
         :param ontology:
         :param session:
         :param process_relation:
+        :param fresh: whether term is expected not to be in db yet, see get_or_create_term
+        :param reload: whether an existing term is loaded again, see reload_term
         :return: Term
         """
         if type(ontology) is str:
@@ -315,10 +775,10 @@ class OlsLoader:
         elif isinstance(ontology, Ontology):
             m_ontology = ontology
         elif isinstance(ontology, helpers.Ontology):
-            m_ontology, created = get_one_or_create(Ontology,
-                                                    session,
-                                                    name=ontology.ontology_id.upper(),
-                                                    namespace=o_term.namespace)
+            m_ontology, created = self.identities.get_one_or_create(Ontology,
+                                                                    session,
+                                                                    name=ontology.ontology_id.upper(),
+                                                                    namespace=o_term.namespace)
         else:
             raise RuntimeError('Wrong parameter')
         session.merge(m_ontology)
@@ -328,17 +788,17 @@ class OlsLoader:
         if has_accession(o_term):
             if not o_term.description:
                 o_term.description = [inflection.humanize(o_term.label)]
-            m_term, created = get_one_or_create(Term,
-                                                session,
-                                                accession=o_term.accession,
-                                                create_method_kwargs=dict(helper=o_term,
-                                                                          ontology=m_ontology))
-
+            m_term, created = self.get_or_create_term(o_term.accession, m_ontology, session, fresh=fresh,
+                                                      helper=o_term)
             logger.info('Loaded Term [%s][%s][%s]', m_term.accession, o_term.namespace, m_term.iri)
-            if created:
+            if self.graph is not None:
+                self.graph.add_term(m_term.accession)
+            if reload and not created:
+                m_term = self.reload_term(m_term, o_term, m_ontology, session)
+            if created or reload:
                 self.load_term_subsets(m_term, session)
-                self.load_alt_ids(m_term, o_term, session)
-                self.load_term_synonyms(m_term, o_term, session)
+                self.load_alt_ids(m_term, o_term, session, created)
+                self.load_term_synonyms(m_term, o_term, session, created)
                 if o_term.ontology_name.upper() in self.allowed_ontologies \
                         and self.options.get('process_relations', True) \
                         and process_relation:
@@ -350,71 +810,399 @@ class OlsLoader:
             logger.info("O_term %s has no accession", o_term)
             return None
 
-    def load_alt_ids(self, m_term, o_term, session):
+    def reload_term(self, m_term, o_term, m_ontology, session):
+        """
+        Update an existing term from OLS ('incremental' option): its columns are overwritten, its synonyms and alt ids
+        are synced and its relations removed, to be loaded again.
+        :param m_term: existing Term
+        :param o_term: helpers.Term
+        :param m_ontology: term Ontology
+        :param session: db session
+        :return: Term
+        """
+        term_id = m_term.term_id
+        if self.writer is None:
+            m_term.update_from_helper(o_term)
+            m_term.ontology_id = m_ontology.id
+        else:
+            # written again along with next batch
+            m_term = self.writer.add_term(Term(accession=m_term.accession, ontology_id=m_ontology.id, helper=o_term))
+            self.writer.sync_term(m_term.accession)
+        if term_id is not None:
+            session.query(Relation).filter(Relation.child_term_id == term_id).delete(synchronize_session=False)
+            session.commit()
+            if self.writer is None:
+                session.expire(m_term, ['parent_terms'])
+        return m_term
+
+    def get_term(self, accession, session, reference=False):
+        """
+        Get a term by accession: pending in batch writer, known from identities cache, or from db
+        :param accession: term accession
+        :param session: db session
+        :param reference: whether a transient Term only holding term ids is enough, for terms known from identities
+        cache. Only relevant with batch writer, which only needs terms accessions to write their relations.
+        :return: Term or None
+        """
+        m_term = self.known_term(accession, session, reference)
+        if m_term is None:
+            m_term = session.query(Term).filter_by(accession=accession).one_or_none()
+            if m_term is not None:
+                self.identities.add_term(m_term.accession, m_term.term_id, m_term.ontology_id)
+        return m_term
+
+    def known_term(self, accession, session, reference=False):
+        """ Get a term pending in batch writer or known from identities cache, see get_term """
+        if self.writer is not None:
+            m_term = self.writer.term(accession)
+            if m_term is not None:
+                return m_term
+        if reference and self.writer is not None:
+            ids = self.identities.term(accession)
+            if ids is None:
+                return None
+            term_id, ontology_id = ids
+            return Term(term_id=term_id, accession=accession, ontology_id=ontology_id)
+        return self.identities.get_term(accession, session)
+
+    def get_or_create_term(self, accession, ontology, session, fresh=False, **kwargs):
+        """
+        Get a term by accession, or create it. Created term is committed at once, or left pending in batch writer
+        when 'batch_size' option is set.
+        :param accession: term accession
+        :param ontology: term Ontology, or its id
+        :param session: db session
+        :param fresh: whether term is expected not to be in db yet, i.e not looked up in db before being created
+        :param kwargs: Term constructor arguments
+        :return: tuple Term, created
+        """
+        m_term = self.known_term(accession, session)
+        if m_term is not None:
+            return m_term, False
+        if self.writer is None:
+            m_ontology = ontology if isinstance(ontology, Ontology) else session.query(Ontology).get(ontology)
+            create = create_or_get if fresh else get_one_or_create
+            m_term, created = create(Term, session, accession=accession,
+                                     create_method_kwargs=dict(kwargs, ontology=m_ontology))
+            self.identities.add_term(m_term.accession, m_term.term_id, m_term.ontology_id)
+            return m_term, created
+        # already written terms are ignored by batch writer anyway
+        m_term = None if fresh else self.get_term(accession, session)
+        if m_term is not None:
+            return m_term, False
+        # ontology relationship is not set, as it would cascade the term into session
+        ontology_id = ontology.id if isinstance(ontology, Ontology) else ontology
+        m_term = Term(accession=accession, ontology_id=ontology_id, **kwargs)
+        return self.writer.add_term(m_term), True
+
+    def stage_for(self, ontology_name):
+        """ Set ontology the staged rows are loaded for, when loading with 'staging' option """
+        if isinstance(self.writer, StagingWriter):
+            self.writer.source = ontology_name.upper()
+
+    def merge_staging(self, ontology_name):
+        """
+        Merge rows staged by all terms loaders of an ontology into ontology tables ('staging' option). Roots of terms
+        loaded from files are only updated then.
+        :param ontology_name: ontology short name
+        :return: dict number of merged rows per table
+        """
+        report = self.get_ontology_logger(ontology_name)
+        self.flush_writer()
+        writer = self.writer if isinstance(self.writer, StagingWriter) else StagingWriter(dal.engine)
+        merged = writer.merge(ontology_name)
+        report.info('- Merged staged rows: %s', dict(merged))
+        reader = self.ontology_reader(ontology_name)
+        if reader is not None and self.options.get('process_parents', True):
+            with dal.session_scope() as session:
+                report.info('- Root terms %s', self.update_file_roots(reader.prefix, None, session))
+        return merged
+
+    def is_fresh(self, session, prefix):
+        """
+        Whether an ontology is loaded from scratch, i.e its terms are not looked up in db before being created
+        ('fresh_load' option, detected from db when not set)
+        :param session: db session
+        :param prefix: ontology accessions prefix
+        :return: bool
+        """
+        fresh = self.options.get('fresh_load')
+        if fresh is None:
+            fresh = session.query(Term.term_id).filter(Term.accession.like(prefix + ':%')).first() is None
+        return bool(fresh)
+
+    def flush_writer(self, partial=False):
+        """
+        Write rows pending in batch writer, if any
+        :param partial: only write them when a whole batch is pending
+        """
+        if self.writer is None:
+            return
+        if partial:
+            self.writer.maybe_flush()
+        else:
+            self.writer.flush()
+            self.get_term_logger(self.current_ontology).info('- Written rows: %s', dict(self.writer.written))
+
+    @staticmethod
+    def term_hash(o_term, relatives=None):
+        """
+        Hash of a term OLS document, relations links only count as relation types, and of its related terms if known
+        :param o_term: helpers.Term
+        :param relatives: dict relation name: related terms accessions, see term_relatives
+        :return: hex digest
+        """
+        def jsonable(value):
+            if isinstance(value, collections.abc.Mapping):
+                return dict(value)
+            if isinstance(value, collections.abc.Sequence):
+                return list(value)
+            return str(value)
+
+        content = {name: True if isinstance(value, Link) else value for name, value in vars(o_term).items()
+                   if name not in ('_relations_types', 'links')}
+        # links urls depend on api site
+        content['links'] = sorted(getattr(o_term, 'links', None) or ())
+        content['annotation'] = vars(o_term.annotation)
+        content['relatives'] = relatives or {}
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=jsonable).encode('utf-8')).hexdigest()
+
+    def term_relatives(self, o_term):
+        """
+        Related terms loaded along with a term by load_term, as read from the ontology edges dump ('incremental' option
+        with 'bulk' extraction). No OLS request is made: without dump, only the term relations links are hashed.
+        :param o_term: helpers.Term
+        :return: dict relation name: sorted related terms accessions (iri if none), None if dump has no such relation
+        """
+        if self.edges is None or not has_accession(o_term):
+            return {}
+        rel_names = []
+        if o_term.ontology_name.upper() in self.allowed_ontologies and self.options.get('process_relations', True):
+            rel_names = [rel for rel in relations_types(o_term) if rel not in self.__ignored_relations]
+        if not o_term.is_root and self.options.get('process_parents', True):
+            rel_names.append('parents')
+        relatives = {}
+        for rel_name in rel_names:
+            o_relatives = self.edges.relatives(o_term.accession, rel_name)
+            relatives[rel_name] = None if o_relatives is None else sorted(o_related.accession or o_related.iri
+                                                                          for o_related in o_relatives)
+        return relatives
+
+    @staticmethod
+    def ontology_release(ontology):
+        """
+        :param ontology: helpers.Ontology
+        :return: ontology release identifier, the same for all terms loaders of a load
+        """
+        return '{}/{}'.format(ontology.updated, ontology.version)
+
+    def term_hashes(self, ontology_name):
+        """
+        :param ontology_name: ontology short name
+        :return: dict accession: stored content hash of ontology terms
+        """
+        table = term_hash_table
+        with dal.engine.connect() as connection:
+            statement = select([table.c.accession, table.c.hash]).where(table.c.ontology == ontology_name.upper())
+            return dict(connection.execute(statement).fetchall())
+
+    def store_term_hashes(self, ontology_name, release, hashes, unchanged=()):
+        """
+        Record loaded terms content hashes, and the release unchanged terms were found in
+        :param ontology_name: ontology short name
+        :param release: ontology release, see ontology_release
+        :param hashes: dict accession: content hash of loaded terms
+        :param unchanged: accessions of terms not loaded, as unchanged
+        """
+        table = term_hash_table
+        accessions = sorted(hashes.keys())
+        with dal.engine.begin() as connection:
+            for chunk in BatchWriter.chunks(accessions, sqlite_max_variables):
+                connection.execute(table.delete().where(table.c.accession.in_(chunk)))
+            if accessions:
+                connection.execute(table.insert(), [dict(accession=accession, ontology=ontology_name.upper(),
+                                                         hash=hashes[accession], release=release)
+                                                    for accession in accessions])
+            for chunk in BatchWriter.chunks(sorted(unchanged), sqlite_max_variables):
+                connection.execute(table.update().where(table.c.accession.in_(chunk)).values(release=release))
+
+    def remove_absent_terms(self, ontology_name):
+        """
+        Delete terms no longer in ontology, i.e found by a former load but not by the one of its current release,
+        once all its terms are loaded ('incremental' option). Their closure rows are left for update_closure to find
+        removed relations from.
+        :param ontology_name: ontology short name
+        :return: number of deleted terms
+        """
+        table = term_hash_table
+        report = self.get_ontology_logger(ontology_name)
+        if not table.exists(dal.engine):
+            return 0
+        reader = self.ontology_reader(ontology_name)
+        o_ontology = reader.ontology() if reader is not None else self.ontology_details(ontology_name)
+        release = self.ontology_release(o_ontology)
+        with dal.engine.connect() as connection:
+            statement = select([table.c.accession]).where(and_(table.c.ontology == ontology_name.upper(),
+                                                               table.c.release != release))
+            accessions = sorted(accession for accession, in connection.execute(statement))
+        term_ids = []
+        with dal.session_scope() as session:
+            for chunk in BatchWriter.chunks(accessions, sqlite_max_variables):
+                term_ids.extend(term_id for term_id, in session.query(Term.term_id)
+                                .filter(Term.accession.in_(chunk),
+                                        Term.ontology_id.in_(self.ontology_ids(ontology_name))))
+        if term_ids:
+            wiped = self.wipe_terms(sorted(term_ids), closure=False)
+            report.info('- Removed %s terms, %s relations', wiped[Term], wiped[Relation])
+        with dal.engine.begin() as connection:
+            for chunk in BatchWriter.chunks(accessions, sqlite_max_variables):
+                connection.execute(table.delete().where(table.c.accession.in_(chunk)))
+        return len(term_ids)
+
+    def load_alt_ids(self, m_term, o_term, session, created=False):
         logger = self.get_term_logger(self.current_ontology)
-        session.query(AltId).filter(AltId.term == m_term).delete()
+        # existing term alt ids, only changes are written
+        existing = {}
+        if self.writer is None and not created:
+            existing = {m_alt_id.accession: m_alt_id
+                        for m_alt_id in session.query(AltId).filter(AltId.term == m_term)}
         if o_term.annotation.has_alternative_id:
             logger.info('Loaded AltId %s', o_term.annotation.has_alternative_id)
-            for alt_accession in o_term.annotation.has_alternative_id:
+            for alt_accession in collections.OrderedDict.fromkeys(o_term.annotation.has_alternative_id):
                 logger.debug('Adding AltId %s', alt_accession)
-                m_term.alt_ids.append(AltId(accession=alt_accession, term=m_term))
+                if self.writer is not None:
+                    self.writer.add_alt_id(m_term.accession, alt_accession)
+                elif existing.pop(alt_accession, None) is None:
+                    m_term.alt_ids.append(AltId(accession=alt_accession, term=m_term))
             logger.debug('...Done')
         else:
             logger.info('...No AltIds')
+        for m_alt_id in existing.values():
+            session.delete(m_alt_id)
         return m_term
 
+    def subsets_catalogue(self, session):
+        """
+        Known subsets names (lower case), warmed from subset table
+        :param session: db session
+        :return: set
+        """
+        if self.subsets is None:
+            self.subsets = {name.lower() for name, in session.query(Subset.name)}
+        return self.subsets
+
+    @ols_scoped
+    def ontology_subsets(self, ontology_name):
+        """
+        Retrieve ontology subsets declarations from OLS, i.e children of oboInOwl SubsetProperty
+        :param ontology_name: ontology short name
+        :return: list of helpers.Property
+        """
+        uri = '/'.join([OlsClient.site, 'ontologies', ontology_name.lower(), 'properties',
+                        ScopedListClient.make_uri(self.__subset_property)])
+        try:
+            subset_property = ScopedListClient(uri, helpers.Property, page_size=OlsClient.page_size)
+            if 'children' not in subset_property.document.links:
+                return []
+            return list(subset_property(action='children'))
+        except ebi.ols.api.exceptions.OlsException as e:
+            self.get_ontology_logger(ontology_name).info('No subsets declared for %s: %s', ontology_name, e)
+            return []
+
+    def load_subsets(self, ontology_name, session):
+        """
+        Load ontology subsets catalogue in subset table, so that loading terms does not need to look for them.
+        Subsets are read from ontology file header when loaded from a file.
+        :param ontology_name: ontology short name
+        :param session: db session
+        :return: number of subsets in catalogue
+        """
+        catalogue = self.subsets_catalogue(session)
+        reader = self.ontology_reader(ontology_name)
+        o_subsets = reader.subsets() if reader is not None else self.ontology_subsets(ontology_name)
+        o_subsets = [o_subset for o_subset in o_subsets if o_subset.label]
+        for o_subset in o_subsets:
+            m_subset, created = self.identities.get_one_or_create(
+                Subset, session,
+                name=inflection.underscore(o_subset.label),
+                create_method_kwargs=dict(definition=o_subset.definition))
+            catalogue.add(m_subset.name.lower())
+            if o_subset.short_form:
+                catalogue.add(o_subset.short_form.lower())
+        self.subsets_ontologies.add(ontology_name.upper())
+        self.get_ontology_logger(ontology_name).info('- Loaded %s subsets', len(o_subsets))
+        return len(o_subsets)
+
     def load_term_subsets(self, term, session):
         logger = self.get_term_logger(self.current_ontology)
         subsets = []
         if term.subsets:
-            s_subsets = self.client.search(query=term.subsets, filters={'type': 'property', 'exact': 'false'})
-            seen = set()
-            unique_subsets = [x for x in s_subsets if
-                              x.short_form.lower() not in seen and not seen.add(x.short_form.lower())]
-            logger.debug("Loading unique subsets %s", unique_subsets)
-
-            for subset in unique_subsets:
-                subset_def = inflection.humanize(subset.label)
-                m_subset, created = get_one_or_create(Subset, session,
-                                                      name=inflection.underscore(subset.label),
-                                                      create_method_kwargs=dict(
-                                                          definition=subset_def))
-                if created:
-                    # avoid call to API if already exists
-                    logger.info("Created new subset %s", m_subset.name)
-                    try:
-                        details = self.client.property(identifier=subset.iri)
-                        if not details:
-                            logger.warning('Unable to retrieve subset details %s for ontology %s', subset.label,
-                                           term.ontology.name)
-                        else:
-                            m_subset.definition = details.definition
-                            session.merge(m_subset)
-                            session.commit()
-                    except ebi.ols.api.exceptions.ObjectNotRetrievedError:
-                        logger.error('Too Many errors from API %s %s', subset.label, term.ontology.name)
+            subsets = term.subsets.split(',')
+            catalogue = self.subsets_catalogue(session)
+            missing = [subset for subset in subsets if subset.lower() not in catalogue]
+            if missing and self.current_ontology.upper() not in self.subsets_ontologies:
+                self.load_subsets(self.current_ontology, session)
+                missing = [subset for subset in missing if subset.lower() not in catalogue]
+            if missing:
+                # not declared as SubsetProperty in ontology, search for them once
+                self.search_subsets(','.join(missing), self.current_ontology, session)
+                catalogue.update([subset.lower() for subset in missing])
             logger.info('Loaded subsets: %s ', subsets)
         else:
             logger.info('...No Subset')
         return subsets
 
+    @ols_scoped
+    def search_subsets(self, query, ontology_name, session):
+        logger = self.get_term_logger(self.current_ontology)
+        s_subsets = self.client.search(query=query, filters={'type': 'property', 'exact': 'false'})
+        seen = set()
+        unique_subsets = [x for x in s_subsets if
+                          x.short_form.lower() not in seen and not seen.add(x.short_form.lower())]
+        logger.debug("Loading unique subsets %s", unique_subsets)
+
+        for subset in unique_subsets:
+            subset_def = inflection.humanize(subset.label)
+            m_subset, created = self.identities.get_one_or_create(Subset, session,
+                                                                  name=inflection.underscore(subset.label),
+                                                                  create_method_kwargs=dict(
+                                                                      definition=subset_def))
+            self.subsets_catalogue(session).add(m_subset.name.lower())
+            if created:
+                # avoid call to API if already exists
+                logger.info("Created new subset %s", m_subset.name)
+                try:
+                    details = self.client.property(identifier=subset.iri)
+                    if not details:
+                        logger.warning('Unable to retrieve subset details %s for ontology %s', subset.label,
+                                       ontology_name)
+                    else:
+                        m_subset.definition = details.definition
+                        session.merge(m_subset)
+                        session.commit()
+                        self.identities.add(m_subset)
+                except ebi.ols.api.exceptions.ObjectNotRetrievedError:
+                    logger.error('Too Many errors from API %s %s', subset.label, ontology_name)
+        return unique_subsets
+
     def load_term_relations(self, m_term, o_term, session):
-        relation_types = [rel for rel in o_term.relations_types if rel not in self.__ignored_relations]
+        relation_types = [rel for rel in relations_types(o_term) if rel not in self.__ignored_relations]
         logger = self.get_term_logger(self.current_ontology)
         logger.info('Terms relations %s', relation_types)
         n_relations = 0
         for rel_name in relation_types:
             # updates relation types
-            o_relatives = o_term.load_relation(rel_name)
+            o_relatives = self.relatives(o_term, rel_name)
 
             logger.info('Loading %s relation %s (%s)...', m_term.accession, rel_name, rel_name)
             logger.info('%s related terms ', len(o_relatives))
             for o_related in o_relatives:
                 if has_accession(o_related):
                     # o_related.ontology_name in self.allowed_ontologies
-                    relation_type, created = get_one_or_create(RelationType,
-                                                               session,
-                                                               name=self.__relation_map.get(rel_name, rel_name))
+                    relation_type, created = self.identities.get_one_or_create(
+                        RelationType,
+                        session,
+                        name=self.__relation_map.get(rel_name, rel_name))
 
                     m_related, relation = self.load_term_relation(m_term, o_related, relation_type, session)
                     n_relations += 1
@@ -426,7 +1214,8 @@ class OlsLoader:
         logger = self.get_term_logger(self.current_ontology)
         if o_term.is_defining_ontology:
             logger.debug('Related term is defined in SAME ontology')
-            o_term_details = o_term
+            # related terms read from an edges dump only hold their accession and label, their details are looked up
+            o_term_details = o_term if getattr(o_term, 'links', None) else self.term_details(o_term.iri) or o_term
             r_ontology = m_term.ontology
             return o_term_details, r_ontology
         else:
@@ -440,19 +1229,19 @@ class OlsLoader:
                     return o_term_details, r_ontology
                 else:
                     logger.debug('Related term is defined in EXPECTED ontology')
-                    o_term_details = self.client.term(identifier=o_term.iri, silent=True, unique=True)
+                    o_term_details = self.term_details(o_term.iri)
                     if o_term_details:
                         logger.debug('Retrieved term %s[%s]', o_term_details, o_term_details.ontology_name)
-                        o_onto_details = self.client.ontology(identifier=o_term_details.ontology_name)
+                        o_onto_details = self.ontology_details(o_term_details.ontology_name)
                         if o_onto_details:
                             namespace = o_term_details.namespace if o_term_details.namespace else o_term_details.ontology_name
-                            r_ontology, created = get_one_or_create(Ontology,
-                                                                    session,
-                                                                    name=o_onto_details.ontology_id.upper(),
-                                                                    namespace=namespace,
-                                                                    create_method_kwargs=dict(
-                                                                        version=o_onto_details.version,
-                                                                        title=o_onto_details.title))
+                            r_ontology, created = self.identities.get_one_or_create(
+                                Ontology,
+                                session,
+                                name=o_onto_details.ontology_id.upper(),
+                                namespace=namespace,
+                                create_method_kwargs=dict(version=o_onto_details.version,
+                                                          title=o_onto_details.title))
                             return o_term_details, r_ontology
                     else:
                         logger.debug('Term %s Not Retrieved', o_term.iri)
@@ -461,10 +1250,10 @@ class OlsLoader:
     def load_term_relation(self, m_term, o_term, relation_type, session):
         logger = self.get_term_logger(self.current_ontology)
         if has_accession(o_term):
-            try:
-                m_related = session.query(Term).filter_by(accession=o_term.accession).one()
+            m_related = self.get_term(o_term.accession, session, reference=True)
+            if m_related is not None:
                 logger.info('Exists %s', m_related)
-            except NoResultFound:
+            else:
                 o_term_details, r_ontology = self.rel_dest_ontology(m_term, o_term, session)
                 if o_term_details and has_accession(o_term_details):
                     m_related = self.load_term(o_term=o_term_details, ontology=o_term_details.ontology_name,
@@ -472,27 +1261,40 @@ class OlsLoader:
                 else:
                     logger.warning('Term %s (%s) relation %s with %s not found in %s ',
                                    m_term.accession,
-                                   m_term.ontology.name,
+                                   self.current_ontology,
                                    relation_type.name,
                                    o_term.iri, o_term.ontology_name)
                     return None, None
             if m_related:
                 logger.info('Adding relation %s %s %s', m_term.accession, relation_type.name, m_related.accession)
-                m_relation = m_term.add_parent_relation(m_related, relation_type, session)
+                m_relation = self.add_relation(m_term, m_related, relation_type, session)
                 logger.debug('Loaded relation %s %s %s', m_term.accession, relation_type.name, m_related.accession)
                 return m_related, m_relation
             else:
                 return None, None
 
+    def add_relation(self, m_term, m_related, relation_type, session):
+        """
+        Add a term parent relation, recorded in loaded ontology graph as well with 'graph' option
+        :param m_term: child Term
+        :param m_related: parent Term
+        :param relation_type: RelationType
+        :param session: db session
+        :return: Relation, None if left to batch writer
+        """
+        if self.graph is not None:
+            self.graph.add_relation(m_term.accession, m_related.accession, relation_type.name)
+        return m_term.add_parent_relation(m_related, relation_type, session, writer=self.writer)
+
     def load_term_ancestors(self, m_term, o_term, session):
         # delete old ancestors
         logger = self.get_term_logger(self.current_ontology)
         try:
-            ancestors = o_term.load_relation('parents')
+            ancestors = self.relatives(o_term, 'parents')
             r_ancestors = 0
-            relation_type, created = get_one_or_create(RelationType,
-                                                       session,
-                                                       name='is_a')
+            relation_type, created = self.identities.get_one_or_create(RelationType,
+                                                                       session,
+                                                                       name='is_a')
             for ancestor in ancestors:
                 logger.debug('Parent %s ', ancestor.accession)
                 if has_accession(ancestor):
@@ -504,13 +1306,12 @@ class OlsLoader:
             logger.info('...No parent %s ')
             return 0
 
-    def load_term_synonyms(self, m_term, o_term, session):
+    def load_term_synonyms(self, m_term, o_term, session, created=False):
         logger = self.get_term_logger(self.current_ontology)
         logger.debug('Loading term synonyms...')
 
-        session.query(Synonym).filter(Synonym.term == m_term).delete()
-        n_synonyms = []
-
+        # synonym name: type, db xref
+        synonyms = collections.OrderedDict()
         obo_synonyms = o_term.obo_synonym or []
         for synonym in obo_synonyms:
             if isinstance(synonym, itypes.Dict):
@@ -519,50 +1320,137 @@ class OlsLoader:
                         'id'] if 'xrefs' in synonym and len(synonym['xrefs']) > 0 else ''
                     logger.info('Term synonym [%s - %s (%s)]', synonym['name'], self.__synonym_map[synonym['scope']],
                                 db_xref)
-                    m_syno, created = get_one_or_create(Synonym,
-                                                        session,
-                                                        term=m_term,
-                                                        name=synonym['name'],
-                                                        create_method_kwargs=dict(
-                                                            db_xref=db_xref,
-                                                            type=self.__synonym_map[synonym['scope']]))
-                    if created:
-                        n_synonyms.append(synonym)
+                    synonyms.setdefault(synonym['name'], (self.__synonym_map[synonym['scope']], db_xref))
                 except KeyError as e:
                     logging.error('Parse Synonym error %s: %s', synonym, str(e))
             else:
                 logging.error('obo_synonym type error: %s', synonym)
         # OBO Xref are winning against standard synonymz
-        synonyms = o_term.synonyms or []
-        for synonym in synonyms:
+        for synonym in o_term.synonyms or []:
             logger.info('Term synonym [%s - EXACT (No dbXref)]', synonym)
-            m_syno, created = get_one_or_create(Synonym,
-                                                session,
-                                                term=m_term,
-                                                name=synonym,
-                                                create_method_kwargs=dict(
-                                                    type='EXACT')
-                                                )
-            if created:
-                n_synonyms.append(synonym)
+            synonyms.setdefault(synonym, ('EXACT', None))
         if hasattr(o_term.annotation, 'has_related_synonym'):
             other_synonyms = o_term.annotation.has_related_synonym or []
             for synonym in other_synonyms:
                 logger.info('Term synonym [%s - EXACT (No dbXref)]', synonym)
-                m_syno, created = get_one_or_create(Synonym,
-                                                    session,
-                                                    term=m_term,
-                                                    name=synonym,
-                                                    create_method_kwargs=dict(
-                                                        type='RELATED')
-                                                    )
-                if created:
-                    n_synonyms.append(synonym)
+                synonyms.setdefault(synonym, ('RELATED', None))
+        n_synonyms = self.sync_synonyms(m_term, synonyms, session, created)
         if len(n_synonyms) == 0:
             logger.info('...No Synonym')
         logger.debug('...Done')
         return n_synonyms
 
+    def sync_synonyms(self, m_term, synonyms, session, created=False):
+        """
+        Set a term synonyms: only missing ones are added, stale ones removed and changed ones updated.
+        Left to batch writer if any, which diffs whole batches of terms at once.
+        :param m_term: Term
+        :param synonyms: dict synonym name: tuple SynonymTypeEnum name, db xref
+        :param session: db session
+        :param created: whether term has just been created, i.e has no synonyms in db yet
+        :return: list of added synonyms names
+        """
+        if self.writer is not None:
+            return [name for name, (synonym_type, db_xref) in synonyms.items()
+                    if self.writer.add_synonym(m_term.accession, name, synonym_type, db_xref)]
+        existing = {} if created else {m_syno.name: m_syno
+                                       for m_syno in session.query(Synonym).filter(Synonym.term == m_term)}
+        added = []
+        for name, (synonym_type, db_xref) in synonyms.items():
+            m_syno = existing.pop(name, None)
+            if m_syno is None:
+                session.add(Synonym(term=m_term, name=name, type=synonym_type, db_xref=db_xref))
+                added.append(name)
+            else:
+                if m_syno.type != SynonymTypeEnum[synonym_type]:
+                    m_syno.type = synonym_type
+                if m_syno.db_xref != db_xref:
+                    m_syno.db_xref = db_xref
+        for m_syno in existing.values():
+            session.delete(m_syno)
+        session.commit()
+        return added
+
+    def load_closure(self, ontology_name):
+        """
+        Compute ontology transitive closure over its relations ('closure_relation_types' option), replacing existing
+        closure rows
+        :param ontology_name: ontology short name
+        :return: number of closure rows
+        """
+        report = self.get_ontology_logger(ontology_name)
+        n_rows = compute_closure(dal.engine, self.ontology_ids(ontology_name),
+                                 self.options.get('closure_relation_types'), self.options.get('batch_size') or 10000)
+        report.info('- Computed %s closure rows', n_rows)
+        return n_rows
+
+    def load_closures(self, ontology_names=None):
+        """
+        Compute closures of several ontologies in parallel, over a pool of 'closure_workers' processes (one per cpu
+        by default), replacing existing closure rows
+        :param ontology_names: ontologies short names, all loaded ones if None
+        :return: dict ontology name: number of closure rows
+        """
+        with dal.engine.connect() as connection:
+            ontologies = ontologies_ids(connection, ontology_names)
+        return compute_closures(dal.engine, ontologies, self.options.get('closure_relation_types'),
+                                self.options.get('closure_workers'), self.options.get('output_dir'),
+                                self.options.get('batch_size') or 10000, self.options.get('fast_load'))
+
+    def update_closure(self, ontology_name, inserted=None, deleted=None):
+        """
+        Update ontology closure with its relations changes only, e.g once reloaded with 'incremental' option
+        :param ontology_name: ontology short name
+        :param inserted: (child_term_id, parent_term_id) relations added, found from closure rows if None
+        :param deleted: (child_term_id, parent_term_id) relations removed, found from closure rows if None
+        :return: dict number of inserted and deleted closure rows, and of terms they were computed for
+        """
+        report = self.get_ontology_logger(ontology_name)
+        changes = update_closure(dal.engine, self.ontology_ids(ontology_name), inserted, deleted,
+                                 self.options.get('closure_relation_types'))
+        report.info('- Updated closure rows: %s', dict(changes))
+        return changes
+
+    def ontology_graph(self, ontology_names=None, relation_types=None):
+        """
+        Get ontologies terms and relations as an in memory graph: the one recorded while loading with 'graph' option,
+        holding terms loaded by this loader and their relations, or read from db
+        :param ontology_names: ontologies short names read from db, all if None
+        :param relation_types: relation types names read from db, all if None
+        :return: OntologyGraph
+        """
+        if self.graph is not None:
+            return self.graph.build()
+        with dal.engine.connect() as connection:
+            return OntologyGraph.from_db(connection, ontology_names, relation_types)
+
+    def ancestor_index(self, rebuild=False):
+        """
+        Get ancestors index of all loaded terms, over 'closure_relation_types' relations. Index is saved in output
+        directory, and only computed again once db has been loaded since.
+        :param rebuild: whether to compute index again anyway
+        :return: AncestorIndex
+        """
+        path = index_path(self.db_url, self.options.get('output_dir'))
+        relation_types = tuple(self.options.get('closure_relation_types'))
+        with dal.engine.connect() as connection:
+            signature = db_signature(connection)
+            index = None if rebuild else AncestorIndex.load(path, signature)
+            if index is None or index.relation_types != relation_types:
+                graph = OntologyGraph.from_db(connection, relation_types=relation_types)
+                index = AncestorIndex.from_graph(graph, relation_types, signature)
+                index.save(path)
+        return index
+
+    @staticmethod
+    def ontology_ids(ontology_name):
+        """
+        :param ontology_name: ontology short name
+        :return: ids of ontology rows, one per namespace
+        """
+        with dal.session_scope() as session:
+            return [ontology_id for ontology_id, in session.query(Ontology.id).filter_by(name=ontology_name.upper())]
+
     def final_report(self, ontology_name):
         """ Create a report from actual inserted data for ontology """
         session = dal.get_session()
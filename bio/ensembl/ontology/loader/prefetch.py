@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import coreapi
+
+import ebi.ols.api.helpers as helpers
+from ebi.ols.api.client import OlsClient
+
+from .transport import scoped, ScopedListClient
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['TermsPrefetcher', 'TermsList', 'ontology_terms']
+
+
+class TermsList(ScopedListClient):
+    """ Ontology terms list keeping track of each term links, as embedded in terms pages
+
+    Terms relation types are read from these links instead of requesting each term document.
+    """
+
+    def elem_class_instance(self, **data):
+        o_term = super().elem_class_instance(**data)
+        o_term.links = {name: link.url for name, link in data.items() if isinstance(link, coreapi.Link)}
+        o_term._relations_types = [name for name in o_term.links.keys() if name not in ('graph', 'jstree')]
+        return o_term
+
+
+def ontology_terms(ontology_id, start=0, page_size=None):
+    """
+    Get an ontology terms list initialised from the page holding the start index, instead of the first one.
+    Only pages needed for a slice starting at start are therefore requested to OLS.
+    :param ontology_id: OLS ontology id
+    :param start: index of the first expected term
+    :param page_size: list page size, default to OlsClient one
+    :return: TermsList
+    """
+    page_size = page_size or OlsClient.page_size
+    base_uri = '/'.join([OlsClient.site, 'ontologies', ontology_id])
+    uri = '/'.join([base_uri, helpers.Term.path]) + '?page={}&size={}'.format(start // page_size, page_size)
+    terms = TermsList(uri, helpers.Term, page_size=page_size)
+    # following pages uri are built from the ontology base uri
+    terms.uri = base_uri
+    return terms
+
+
+class TermsPrefetcher(object):
+    """ Iterate over a slice of an OLS terms list, fetching next pages in background while current one is consumed
+
+    Each fetched chunk is aligned on the list page size, so that every chunk costs at most one call to OLS api.
+    Terms are yielded in the exact same order as slicing the list directly would do.
+    """
+
+    def __init__(self, terms, start=0, end=None, prefetch=2):
+        """
+        :param terms: ebi.ols.api ListClientMixin (as returned by helpers.Ontology.terms())
+        :param start: first term index (included)
+        :param end: last term index (excluded), default to list length
+        :param prefetch: number of pages fetched ahead of the current one, 0 disable background fetching
+        """
+        self.terms = terms
+        self.page_size = terms.page_size
+        self.start = start or 0
+        self.end = end if end is not None else len(terms)
+        self.prefetch = max(int(prefetch or 0), 0)
+
+    def __len__(self):
+        return max(self.end - self.start, 0)
+
+    def chunks(self):
+        """
+        Split [start, end[ into page aligned boundaries
+        :return: generator of (begin, stop) tuples
+        """
+        begin = self.start
+        while begin < self.end:
+            stop = min((begin // self.page_size + 1) * self.page_size, self.end)
+            yield begin, stop
+            begin = stop
+
+    def fetch(self, chunk):
+        begin, stop = chunk
+        logger.debug('Fetching terms [%s:%s]', begin, stop)
+        return self.terms[begin:stop]
+
+    def __iter__(self):
+        if self.prefetch == 0:
+            for chunk in self.chunks():
+                yield from self.fetch(chunk)
+            return
+        chunks = self.chunks()
+        fetch = scoped(self.fetch)
+        pending = collections.deque()
+        executor = ThreadPoolExecutor(max_workers=self.prefetch)
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(fetch, chunk))
+                if len(pending) > self.prefetch:
+                    break
+            while pending:
+                # while current page is consumed, next `prefetch` pages are fetched
+                yield from pending.popleft().result()
+                next_chunk = next(chunks, None)
+                if next_chunk is not None:
+                    pending.append(executor.submit(fetch, next_chunk))
+        finally:
+            # consumer may stop before slice end, do not fetch remaining pages
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
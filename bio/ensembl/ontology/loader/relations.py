@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['EdgeList', 'RelationsExtractor']
+
+
+class EdgeList(object):
+    """ In memory relations of a set of terms, keyed by term accession """
+
+    def __init__(self):
+        self._edges = collections.defaultdict(lambda: collections.defaultdict(list))
+
+    def __len__(self):
+        return sum(len(o_relatives) for relations in self._edges.values() for o_relatives in relations.values())
+
+    def __contains__(self, accession):
+        return accession in self._edges
+
+    def add(self, accession, rel_name, o_related):
+        self._edges[accession][rel_name].append(o_related)
+
+    def relatives(self, accession, rel_name):
+        """
+        Get related terms for a term relation
+        :param accession: term accession
+        :param rel_name: OLS relation name
+        :return: list of helpers.Term, None if the relation has not been extracted
+        """
+        relations = self._edges.get(accession)
+        if relations is None:
+            return None
+        return relations.get(rel_name)
+
+    def clear(self):
+        self._edges.clear()
+
+
+class RelationsExtractor(object):
+    """ Extract relations of all terms of an ontology in bulk, from its OBO or obographs dump
+
+    The dump is read once, in a single streaming pass over its edges (see files.OntologyReader.edges), into one edge
+    list for the whole ontology. Related terms only hold their accession, label and iri.
+    """
+
+    def __init__(self, reader, process_relations=True, process_parents=True):
+        self.reader = reader
+        self.process_relations = process_relations
+        self.process_parents = process_parents
+        self.edges = EdgeList()
+
+    def extract(self):
+        """
+        Read ontology dump edges into edge list, previously extracted ones are discarded
+        :return: EdgeList
+        """
+        self.edges.clear()
+        for accession, rel_name, o_related in self.reader.edges():
+            if self.process_parents if rel_name == 'parents' else self.process_relations:
+                self.edges.add(accession, rel_name, o_related)
+        logger.info('Extracted %s edges from %s', len(self.edges), self.reader.path)
+        return self.edges
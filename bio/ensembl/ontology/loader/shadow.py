@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import copy
+import logging
+import os
+
+import sqlalchemy
+import sqlalchemy.exc
+from sqlalchemy import func
+from sqlalchemy.engine.url import make_url
+
+from .models import Ontology, Term
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['shadow_url', 'create_shadow', 'ontologies_terms', 'validate_shadow', 'swap_shadow']
+
+# Release db is built as a shadow db (MySQL schema, or SQLite file) next to the live one, which readers keep using
+# until the shadow is validated and swapped in place of it at once.
+
+
+def shadow_url(db_url, suffix='_shadow'):
+    """
+    :param db_url: release db url
+    :param suffix: shadow db name suffix
+    :return: shadow db url
+    """
+    url = make_url(db_url)
+    if not url.database or url.database == ':memory:':
+        raise RuntimeError('No shadow for in memory db %s' % db_url)
+    url.database += suffix
+    return str(url)
+
+
+def server_engine(url):
+    """ Engine connected to MySQL server, not to any schema """
+    url = copy.copy(make_url(url))
+    url.database = None
+    return sqlalchemy.create_engine(url)
+
+
+def create_shadow(db_url):
+    """
+    Create an empty shadow db, removing any left by a previous failed build
+    :param db_url: release db url
+    :return: shadow db url
+    """
+    shadow = shadow_url(db_url)
+    url = make_url(shadow)
+    logger.info('Create shadow db %s', url.database)
+    if url.drivername.startswith('sqlite'):
+        if os.path.exists(url.database):
+            os.remove(url.database)
+        return shadow
+    engine = server_engine(url)
+    engine.execute('DROP DATABASE IF EXISTS `{}`'.format(url.database))
+    engine.execute('CREATE DATABASE `{}`'.format(url.database))
+    engine.dispose()
+    return shadow
+
+
+def ontologies_terms(db_url):
+    """
+    :param db_url: db url
+    :return: dict ontology name: number of terms, empty if db does not exist yet
+    """
+    url = make_url(db_url)
+    if url.drivername.startswith('sqlite') and not os.path.exists(url.database or ''):
+        return {}
+    engine = sqlalchemy.create_engine(url)
+    try:
+        if not engine.has_table(Term.__tablename__):
+            return {}
+        statement = sqlalchemy.select([Ontology.__table__.c.name, func.count(Term.__table__.c.term_id)]) \
+            .select_from(Term.__table__.join(Ontology.__table__)) \
+            .group_by(Ontology.__table__.c.name)
+        return {name: count for name, count in engine.execute(statement)}
+    except sqlalchemy.exc.OperationalError:
+        # unknown database
+        return {}
+    finally:
+        engine.dispose()
+
+
+def validate_shadow(shadow, db_url, ontologies=None, min_ratio=0.9):
+    """
+    Check shadow db is complete enough to replace release db: every ontology has terms, and not much less than in
+    release db if it was loaded there already.
+    :param shadow: shadow db url
+    :param db_url: release db url
+    :param ontologies: names of expected ontologies, all the ones in release db if None
+    :param min_ratio: minimum ratio of release db terms loaded in shadow db, per ontology
+    :return: dict ontology name: number of terms in shadow db
+    """
+    loaded = ontologies_terms(shadow)
+    live = ontologies_terms(db_url)
+    expected = {name.upper() for name in ontologies} if ontologies else set(live.keys())
+    errors = ['%s: no terms' % name for name in sorted(expected) if not loaded.get(name)]
+    errors += ['%s: %s terms, %s in release db' % (name, count, live[name]) for name, count in sorted(loaded.items())
+               if name in live and count < live[name] * min_ratio]
+    if errors:
+        raise RuntimeError('Invalid shadow db: %s' % ', '.join(errors))
+    logger.info('Validated shadow db terms %s', loaded)
+    return loaded
+
+
+def swap_shadow(db_url, shadow):
+    """
+    Replace release db with shadow db, atomically: a single RENAME TABLE moving all tables on MySQL, a file rename
+    with SQLite. Former release tables are dropped.
+    :param db_url: release db url
+    :param shadow: shadow db url
+    """
+    url = make_url(db_url)
+    shadow = make_url(shadow)
+    if url.drivername.startswith('sqlite'):
+        os.replace(shadow.database, url.database)
+        logger.info('Swapped %s in place of %s', shadow.database, url.database)
+        return
+    engine = server_engine(url)
+    try:
+        inspector = sqlalchemy.inspect(engine)
+        former = url.database + '_old'
+        engine.execute('CREATE DATABASE IF NOT EXISTS `{}`'.format(url.database))
+        engine.execute('DROP DATABASE IF EXISTS `{}`'.format(former))
+        engine.execute('CREATE DATABASE `{}`'.format(former))
+        renames = ['`{0}`.`{2}` TO `{1}`.`{2}`'.format(url.database, former, table)
+                   for table in inspector.get_table_names(schema=url.database)]
+        renames += ['`{0}`.`{2}` TO `{1}`.`{2}`'.format(shadow.database, url.database, table)
+                    for table in inspector.get_table_names(schema=shadow.database)]
+        engine.execute('RENAME TABLE ' + ', '.join(renames))
+        logger.info('Swapped %s in place of %s', shadow.database, url.database)
+        engine.execute('DROP DATABASE `{}`'.format(former))
+        engine.execute('DROP DATABASE `{}`'.format(shadow.database))
+    finally:
+        engine.dispose()
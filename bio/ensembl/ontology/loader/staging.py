@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import logging
+
+from sqlalchemy import MetaData, Table, Column, Index, String, Integer, Text, select, exists, and_, func, \
+    literal_column
+
+from .models import Term, Synonym, AltId, Relation, BigStringUtf8, TextUtf8, UnsignedInt
+from .writer import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['StagingWriter', 'staging_metadata']
+
+# Staging tables, not part of ontology schema: raw rows keyed by accessions, appended by terms loaders and merged
+# into final tables by a set of INSERT ... SELECT statements. Created once with the schema (see ols.init_schema) and
+# dropped once every ontology is merged (see ols.drop_staging), writers never run any DDL.
+staging_metadata = MetaData()
+
+stage_term = Table('stage_term', staging_metadata,
+                   Column('stage_id', Integer, primary_key=True),
+                   Column('source', String(64), nullable=False),
+                   Column('accession', String(64), nullable=False),
+                   Column('ontology_id', UnsignedInt, nullable=False),
+                   Column('name', BigStringUtf8, nullable=False),
+                   Column('definition', TextUtf8),
+                   Column('subsets', Text),
+                   Column('is_root', Integer, nullable=False, default=0),
+                   Column('is_obsolete', Integer, nullable=False, default=0),
+                   Column('iri', Text),
+                   Column('placeholder', Integer, nullable=False, default=0),
+                   Index('stage_term_source_idx', 'source', 'accession'),
+                   mysql_engine='MyISAM')
+
+stage_synonym = Table('stage_synonym', staging_metadata,
+                      Column('stage_id', Integer, primary_key=True),
+                      Column('source', String(64), nullable=False),
+                      Column('accession', String(64), nullable=False),
+                      Column('name', TextUtf8, nullable=False),
+                      Column('type', String(16)),
+                      Column('dbxref', String(500)),
+                      Index('stage_synonym_source_idx', 'source', 'accession'),
+                      mysql_engine='MyISAM')
+
+stage_alt_id = Table('stage_alt_id', staging_metadata,
+                     Column('stage_id', Integer, primary_key=True),
+                     Column('source', String(64), nullable=False),
+                     Column('accession', String(64), nullable=False),
+                     Column('alt_accession', String(64), nullable=False),
+                     Index('stage_alt_id_source_idx', 'source', 'accession'),
+                     mysql_engine='MyISAM')
+
+stage_relation = Table('stage_relation', staging_metadata,
+                       Column('stage_id', Integer, primary_key=True),
+                       Column('source', String(64), nullable=False),
+                       Column('child_accession', String(64), nullable=False),
+                       Column('parent_accession', String(64), nullable=False),
+                       Column('relation_type_id', UnsignedInt, nullable=False),
+                       Index('stage_relation_source_idx', 'source', 'child_accession'),
+                       mysql_engine='MyISAM')
+
+
+class StagingWriter(BatchWriter):
+    """ Batch writer appending raw rows to staging tables, without resolving any term id
+
+    Terms loaders only append rows, in any order. Rows staged for an ontology (source) are merged into final tables
+    once all its terms are loaded, joining staged accessions with term table to get ids. Terms staged several times
+    (e.g relation targets, placeholders) are merged once, complete rows first. Existing rows are left untouched.
+    """
+
+    def __init__(self, engine, batch_size=10000, source=None):
+        super().__init__(engine, batch_size)
+        self.source = source
+        # accessions already staged by this writer, with their ontology id
+        self.staged = {}
+
+    def term(self, accession):
+        m_term = super().term(accession)
+        if m_term is None and accession in self.staged:
+            # staged, not in db yet: a transient Term is enough to reference it
+            m_term = Term(accession=accession, ontology_id=self.staged[accession])
+        return m_term
+
+    def flush(self):
+        """ Append pending rows to staging tables """
+        if len(self) == 0:
+            return
+        source = self.source.upper()
+        rows = {
+            stage_term: [dict(self.term_row(m_term), source=source, placeholder=int(m_term.description is None))
+                         for m_term in self.terms.values()],
+            stage_synonym: [dict(source=source, accession=accession, name=row['name'], type=row['type'],
+                                 dbxref=row['dbxref']) for (accession, _), row in self.synonyms.items()],
+            stage_alt_id: [dict(source=source, accession=accession, alt_accession=alt_accession)
+                           for accession, alt_accession in self.alt_ids.keys()],
+            stage_relation: [dict(source=source, child_accession=child, parent_accession=parent,
+                                  relation_type_id=relation_type_id)
+                             for child, parent, relation_type_id, _ in self.relations.keys()]
+        }
+        with self.engine.begin() as connection:
+            for table, table_rows in rows.items():
+                if table_rows:
+                    connection.execute(table.insert(), table_rows)
+        self.staged.update({accession: m_term.ontology_id for accession, m_term in self.terms.items()})
+        logger.debug('Staged %s terms, %s synonyms, %s alt ids, %s relations', len(self.terms), len(self.synonyms),
+                     len(self.alt_ids), len(self.relations))
+        self.written.update(terms=len(self.terms), synonyms=len(self.synonyms), alt_ids=len(self.alt_ids),
+                            relations=len(self.relations))
+        self.terms.clear()
+        self.synonyms.clear()
+        self.alt_ids.clear()
+        self.relations.clear()
+        # merge never replaces existing rows
+        self.synced.clear()
+
+    @staticmethod
+    def ignore(statement, connection):
+        dialect = connection.dialect.name
+        if dialect == 'mysql':
+            return statement.prefix_with('IGNORE')
+        if dialect == 'sqlite':
+            return statement.prefix_with('OR IGNORE')
+        return statement
+
+    def merge(self, source):
+        """
+        Merge rows staged for an ontology into term, synonym, alt_id and relation tables, then remove them
+        :param source: ontology name rows have been staged for
+        :return: dict number of merged rows per table
+        """
+        source = source.upper()
+        term = Term.__table__
+        synonym = Synonym.__table__
+        alt_id = AltId.__table__
+        relation = Relation.__table__
+        merged = collections.OrderedDict()
+        with self.engine.begin() as connection:
+            # complete rows first, duplicated accessions are then ignored
+            columns = ['ontology_id', 'accession', 'name', 'definition', 'subsets', 'is_root', 'is_obsolete', 'iri']
+            query = select([stage_term.c[column] for column in columns]) \
+                .where(stage_term.c.source == source) \
+                .order_by(stage_term.c.placeholder, stage_term.c.stage_id)
+            merged['term'] = connection.execute(self.ignore(term.insert().from_select(columns, query),
+                                                            connection)).rowcount
+
+            first = select([func.min(stage_synonym.c.stage_id)]) \
+                .where(stage_synonym.c.source == source) \
+                .group_by(stage_synonym.c.accession, stage_synonym.c.name)
+            query = select([term.c.term_id, stage_synonym.c.name, stage_synonym.c.type, stage_synonym.c.dbxref]) \
+                .select_from(stage_synonym.join(term, term.c.accession == stage_synonym.c.accession)) \
+                .where(and_(stage_synonym.c.source == source,
+                            stage_synonym.c.stage_id.in_(first),
+                            ~exists().where(and_(synonym.c.term_id == term.c.term_id,
+                                                 synonym.c.name == stage_synonym.c.name))))
+            merged['synonym'] = connection.execute(
+                synonym.insert().from_select(['term_id', 'name', 'type', 'dbxref'], query)).rowcount
+
+            query = select([term.c.term_id, stage_alt_id.c.alt_accession]).distinct() \
+                .select_from(stage_alt_id.join(term, term.c.accession == stage_alt_id.c.accession)) \
+                .where(and_(stage_alt_id.c.source == source,
+                            ~exists().where(and_(alt_id.c.term_id == term.c.term_id,
+                                                 alt_id.c.accession == stage_alt_id.c.alt_accession))))
+            merged['alt_id'] = connection.execute(
+                alt_id.insert().from_select(['term_id', 'accession'], query)).rowcount
+
+            # relation belongs to child term ontology
+            child = term.alias('child')
+            parent = term.alias('parent')
+            query = select([child.c.term_id, parent.c.term_id, stage_relation.c.relation_type_id,
+                            literal_column('0'), child.c.ontology_id]).distinct() \
+                .select_from(stage_relation.join(child, child.c.accession == stage_relation.c.child_accession)
+                             .join(parent, parent.c.accession == stage_relation.c.parent_accession)) \
+                .where(stage_relation.c.source == source)
+            columns = ['child_term_id', 'parent_term_id', 'relation_type_id', 'intersection_of', 'ontology_id']
+            merged['relation'] = connection.execute(self.ignore(relation.insert().from_select(columns, query),
+                                                                connection)).rowcount
+
+            for table in (stage_term, stage_synonym, stage_alt_id, stage_relation):
+                connection.execute(table.delete().where(table.c.source == source))
+        self.staged.clear()
+        logger.info('Merged %s staged rows: %s', source, dict(merged))
+        return merged
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import contextlib
+import functools
+import logging
+import random
+import threading
+import time
+
+import coreapi
+import requests
+from coreapi.transports import HTTPTransport
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException, Timeout
+
+import ebi.ols.api.client
+import ebi.ols.api.helpers as helpers
+from ebi.ols.api.base import BaseClient, DetailClientMixin, HALCodec, ListClientMixin, SearchClientMixin
+from ebi.ols.api.client import OlsClient
+from .cache import ResponseCache, CachingAdapter
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['AdaptiveController', 'ThrottledAdapter', 'OlsUnavailableError', 'ScopedSession', 'ols_session',
+           'session_scope', 'current_session', 'scoped', 'ScopedListClient', 'ScopedDetailClient',
+           'ScopedSearchClient', 'ScopedOlsClient', 'load_relation', 'relations_types']
+
+
+class OlsUnavailableError(RequestException):
+    """ OLS request still failing once ThrottledAdapter retries are exhausted
+
+    Not a ConnectionError nor an api error, so that ebi.ols.api retry_requests decorator does not retry it again.
+    """
+
+
+class AdaptiveController(object):
+    """ AIMD limit of concurrent requests to OLS, shared by every thread of a loader
+
+    Limit grows by one for each limit-wide window of successful requests, and is halved upon throttling (429, 5xx,
+    connection errors), at most once per window so that a burst of failures only counts once. Latencies of the last
+    successful requests are kept to report percentiles.
+    """
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=100, decrease=0.5, backoff_factor=0.5,
+                 backoff_max=60, window=1000):
+        self.min_limit = max(int(min_limit), 1)
+        self.max_limit = max(int(max_limit), self.min_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease = decrease
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.in_flight = 0
+        self.throttled = 0
+        self.latencies = collections.deque(maxlen=window)
+        self._last_decrease = 0
+        self.min_window = 0.05
+        self._condition = threading.Condition()
+        self._random = random.Random()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def success(self, latency):
+        with self._condition:
+            self.latencies.append(latency)
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            self._condition.notify()
+
+    def throttle(self):
+        with self._condition:
+            self.throttled += 1
+            now = time.monotonic()
+            # requests in flight during one round trip are throttled together
+            if now - self._last_decrease > max(self.percentile(50), self.min_window):
+                self.limit = max(self.limit * self.decrease, self.min_limit)
+                self._last_decrease = now
+                logger.info('OLS requests throttled, concurrency limit down to %s', int(self.limit))
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Delay before retrying a throttled request: exponential with full jitter, at least server Retry-After
+        :param attempt: number of attempts already made
+        :param retry_after: Retry-After header value (seconds)
+        :return: seconds
+        """
+        delay = self._random.uniform(0, min(self.backoff_max, self.backoff_factor * 2 ** attempt))
+        try:
+            return max(delay, float(retry_after)) if retry_after else delay
+        except ValueError:
+            return delay
+
+    def percentile(self, percent):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return 0
+        return latencies[min(int(len(latencies) * percent / 100), len(latencies) - 1)]
+
+    def percentiles(self):
+        return {'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99)}
+
+    def __repr__(self):
+        percentiles = self.percentiles()
+        return '<AdaptiveController(limit={}, in_flight={}, throttled={}, p50={:.3f}s, p90={:.3f}s, p99={:.3f}s)>' \
+            .format(int(self.limit), self.in_flight, self.throttled, percentiles['p50'], percentiles['p90'],
+                    percentiles['p99'])
+
+
+class ThrottledAdapter(HTTPAdapter):
+    """ Requests transport adapter applying AdaptiveController limit, retrying throttled requests after backoff """
+
+    def __init__(self, controller, max_retry=5, timeout=None, **kwargs):
+        self.controller = controller
+        self.max_retry = max_retry
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        kwargs['timeout'] = kwargs.get('timeout') or self.timeout
+        attempt = 0
+        while True:
+            retry_after = None
+            self.controller.acquire()
+            start = time.monotonic()
+            try:
+                response = super().send(request, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                response = None
+                if attempt >= self.max_retry:
+                    raise OlsUnavailableError('{} failed after {} retries: {}'.format(request.url, attempt, e),
+                                              request=request) from e
+                logger.warning('OLS request %s failed: %s', request.url, e)
+            finally:
+                self.controller.release()
+            if response is not None:
+                if response.status_code != 429 and response.status_code < 500:
+                    self.controller.success(time.monotonic() - start)
+                    return response
+                if attempt >= self.max_retry:
+                    raise OlsUnavailableError('{} failed after {} retries: HTTP {}'.format(
+                        request.url, attempt, response.status_code), request=request, response=response)
+                retry_after = response.headers.get('Retry-After')
+                response.close()
+            self.controller.throttle()
+            delay = self.controller.backoff(attempt, retry_after)
+            logger.info('Retry %s in %.2fs (%s/%s)', request.url, delay, attempt + 1, self.max_retry)
+            time.sleep(delay)
+            attempt += 1
+
+
+def ols_session(**options):
+    """
+    Create the requests session used for every call to OLS api, according to loader options
+    :param options: loader options (cache_dir, cache_ttl, cache_max_size, offline, max_retry, timeout, max_in_flight,
+    initial_in_flight, backoff_factor, backoff_max)
+    :return: requests.Session, with its AdaptiveController as controller attribute
+    """
+    session = requests.Session()
+    max_in_flight = options.get('max_in_flight') or 100
+    session.controller = AdaptiveController(initial_limit=options.get('initial_in_flight') or 8,
+                                            max_limit=max_in_flight,
+                                            backoff_factor=options.get('backoff_factor', 0.5),
+                                            backoff_max=options.get('backoff_max', 60))
+    adapter = ThrottledAdapter(session.controller,
+                               max_retry=options.get('max_retry', 5),
+                               timeout=options.get('timeout'),
+                               pool_maxsize=max_in_flight)
+    if options.get('cache_dir'):
+        cache = ResponseCache(options.get('cache_dir'),
+                              ttl=options.get('cache_ttl'),
+                              max_size=options.get('cache_max_size'))
+        # cached responses are not subject to concurrency limit
+        adapter = CachingAdapter(cache, offline=options.get('offline', False), transport=adapter)
+        logger.info('OLS responses cached in %s (offline: %s)', cache.cache_dir, adapter.offline)
+    elif options.get('offline', False):
+        raise RuntimeError('Offline mode requires a cache_dir')
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_scope = threading.local()
+_default_session = requests.Session()
+
+
+class ScopedSession(requests.Session):
+    """ Session sending requests through the session in scope of the calling thread, see session_scope """
+
+    def send(self, request, **kwargs):
+        return (current_session() or _default_session).send(request, **kwargs)
+
+
+_scoped_transport = HTTPTransport(session=ScopedSession())
+
+
+class ScopedClientMixin(BaseClient):
+    """ ebi.ols.api client sending its requests through the session in scope, see session_scope
+
+    ebi.ols.api clients build a default coreapi Client, which does not allow to pass a session. Only the loader own
+    clients are built with the scoped transport, library clients are left untouched.
+    """
+
+    def __init__(self, uri, elem_class):
+        self.client = coreapi.Client(decoders=self.decoders, transports=[_scoped_transport])
+        self.uri = uri
+        self.elem_class = elem_class
+
+
+class ScopedListClient(ListClientMixin, ScopedClientMixin):
+    """ ListClientMixin through the session in scope, lists returned by actions are scoped as well """
+
+
+class ScopedDetailClient(DetailClientMixin, ScopedClientMixin):
+    """ DetailClientMixin through the session in scope """
+
+
+class ScopedSearchClient(SearchClientMixin, ScopedClientMixin):
+    """ SearchClientMixin through the session in scope """
+
+
+class ScopedOlsClient(OlsClient):
+    """ OlsClient whose lists, details and search clients send their requests through the session in scope """
+
+    def __init__(self, page_size=None, base_site=None):
+        # site and page size are class attributes, read by ebi.ols.api helpers as well
+        OlsClient.page_size = page_size or ebi.ols.api.client.def_page_size
+        if base_site:
+            OlsClient.site = base_site
+        document = coreapi.Client(decoders=[HALCodec()], transports=[_scoped_transport]).get(self.site)
+        self.ontologies = ScopedListClient('/'.join([self.site, 'ontologies']), helpers.Ontology, document,
+                                           self.page_size)
+        self.terms = ScopedListClient('/'.join([self.site, 'terms']), helpers.Term, document, self.page_size)
+        self.properties = ScopedListClient('/'.join([self.site, 'properties']), helpers.Property, document,
+                                           self.page_size)
+        self.individuals = ScopedListClient('/'.join([self.site, 'individuals']), helpers.Individual, document,
+                                            self.page_size)
+        self.ontology = ScopedDetailClient('/'.join([self.site, 'ontologies']), helpers.Ontology)
+        self.term = ScopedDetailClient('/'.join([self.site, 'terms']), helpers.Term)
+        self.property = ScopedDetailClient('/'.join([self.site, 'properties']), helpers.Property)
+        self.individual = ScopedDetailClient('/'.join([self.site, 'individuals']), helpers.Individual)
+        self.search = ScopedSearchClient('/'.join([self.site, 'search']), helpers.OLSHelper, document,
+                                         self.page_size)
+        self.detail = self.ItemClient(self.site)
+
+
+def term_client(o_term):
+    uri = '/'.join([OlsClient.site, 'ontologies', o_term.ontology_name, 'terms', ListClientMixin.make_uri(o_term.iri)])
+    return ScopedListClient(uri, helpers.Term, page_size=OlsClient.page_size)
+
+
+def load_relation(o_term, relation):
+    """
+    helpers.Term.load_relation counterpart, through the session in scope
+    :param o_term: helpers.Term
+    :param relation: OLS relation name
+    :return: ScopedListClient of related helpers.Term
+    """
+    return term_client(o_term)(action=relation)
+
+
+def relations_types(o_term):
+    """
+    helpers.Term.relations_types counterpart, through the session in scope, kept on term once fetched
+    :param o_term: helpers.Term
+    :return: list of OLS relation names
+    """
+    if o_term._relations_types is None:
+        o_term._relations_types = [name for name in term_client(o_term).document.links.keys()
+                                   if name not in ('graph', 'jstree')]
+    return o_term._relations_types
+
+
+@contextlib.contextmanager
+def session_scope(session):
+    """
+    Send OLS api requests of the current thread through session
+    :param session: requests.Session, as returned by ols_session
+    :return: context manager
+    """
+    previous = getattr(_scope, 'session', None)
+    _scope.session = session
+    try:
+        yield session
+    finally:
+        _scope.session = previous
+
+
+def current_session():
+    """
+    :return: requests.Session in scope of the calling thread, None out of any scope
+    """
+    return getattr(_scope, 'session', None)
+
+
+def scoped(fn, session=None):
+    """
+    Bind a callable to a session scope, to call it from another thread (executors)
+    :param fn: callable
+    :param session: requests.Session, default to the one in scope of the calling thread
+    :return: callable
+    """
+    session = session or current_session()
+    if session is None:
+        return fn
+
+    @functools.wraps(fn)
+    def call(*args, **kwargs):
+        with session_scope(session):
+            return fn(*args, **kwargs)
+
+    return call
@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+"""
+import collections
+import enum
+import logging
+import os
+import tempfile
+
+from sqlalchemy import select, bindparam, text
+from sqlalchemy.dialects import mysql
+
+from .models import Term, Synonym, AltId, Relation
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['BatchWriter', 'InfileWriter']
+
+# SQLite maximum number of host parameters in a single statement (before 3.32)
+sqlite_max_variables = 999
+
+
+class BatchWriter(object):
+    """ Collect rows produced while loading terms, and write them with multi-row inserts through SQLAlchemy Core
+
+    Terms are kept as transient Term objects until written. Synonyms, alt ids and relations reference terms by
+    accession, resolved to term ids once terms are written. Existing terms are left untouched with 'ignore' upsert,
+    their columns are overwritten with 'update' upsert. Duplicated synonyms, alt ids and relations are ignored.
+    Synonyms and alt ids of synced terms replace existing ones instead: existing sets are read for the whole batch
+    at once, and only differences are written.
+    Written terms ids are recorded in identities cache if any, known ones are not resolved again.
+    """
+
+    term_columns = ['accession', 'name', 'definition', 'subsets', 'is_root', 'is_obsolete', 'iri', 'ontology_id']
+
+    def __init__(self, engine, batch_size=1000, upsert='ignore', identities=None):
+        if upsert not in ('ignore', 'update'):
+            raise RuntimeError('Unknown upsert mode %s' % upsert)
+        self.engine = engine
+        self.batch_size = max(int(batch_size or 1), 1)
+        self.upsert = upsert
+        self.identities = identities
+        self.terms = collections.OrderedDict()
+        self.synonyms = collections.OrderedDict()
+        self.alt_ids = collections.OrderedDict()
+        self.relations = collections.OrderedDict()
+        # accessions of terms whose synonyms and alt ids replace existing ones
+        self.synced = set()
+        self.written = collections.Counter()
+
+    def __len__(self):
+        return len(self.terms) + len(self.synonyms) + len(self.alt_ids) + len(self.relations)
+
+    def add_term(self, m_term):
+        """
+        Add a transient term to be written, not attached to any session.
+        :param m_term: Term
+        :return: m_term
+        """
+        self.terms[m_term.accession] = m_term
+        return m_term
+
+    def term(self, accession):
+        """
+        Get a term pending for write
+        :param accession: term accession
+        :return: Term or None
+        """
+        return self.terms.get(accession)
+
+    def sync_term(self, accession):
+        """
+        Replace a term synonyms and alt ids in db with the ones added for it, rather than only adding missing ones.
+        Term columns are updated as well if term is added.
+        :param accession: term accession
+        """
+        self.synced.add(accession)
+
+    def add_synonym(self, accession, name, synonym_type, db_xref=None):
+        """
+        :return: whether synonym has been added, i.e was not already pending for term
+        """
+        key = (accession, name)
+        if key in self.synonyms:
+            return False
+        self.synonyms[key] = dict(name=name, type=synonym_type, dbxref=db_xref)
+        return True
+
+    def add_alt_id(self, accession, alt_accession):
+        self.alt_ids[(accession, alt_accession)] = dict(accession=alt_accession)
+
+    def add_relation(self, child_accession, parent_accession, relation_type_id, ontology_id):
+        key = (child_accession, parent_accession, relation_type_id, ontology_id)
+        self.relations[key] = dict(relation_type_id=relation_type_id, ontology_id=ontology_id, intersection_of=0)
+
+    def maybe_flush(self):
+        if len(self) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """ Write all pending rows, terms first """
+        if len(self) == 0:
+            return
+        with self.engine.begin() as connection:
+            self.write_terms(connection)
+            accessions = set(self.terms.keys()) | {key[0] for key in self.synonyms} | \
+                         {key[0] for key in self.alt_ids} | {key[0] for key in self.relations} | \
+                         {key[1] for key in self.relations}
+            term_ids = self.term_ids(connection, accessions | self.synced)
+            synced_ids = {term_ids[accession] for accession in self.synced if accession in term_ids}
+            for table, rows, unique in ((Synonym.__table__, self.synonyms, ('term_id', 'name')),
+                                        (AltId.__table__, self.alt_ids, ('term_id', 'accession'))):
+                rows = [dict(row, term_id=term_ids[accession]) for (accession, _), row in rows.items()
+                        if accession in term_ids]
+                self.sync(connection, table, [row for row in rows if row['term_id'] in synced_ids], synced_ids, unique)
+                self.insert(connection, table, [row for row in rows if row['term_id'] not in synced_ids],
+                            unique=unique)
+            self.insert(connection, Relation.__table__,
+                        [dict(row, child_term_id=term_ids[child], parent_term_id=term_ids[parent])
+                         for (child, parent, _, _), row in self.relations.items()
+                         if child in term_ids and parent in term_ids])
+        logger.debug('Flushed %s terms, %s synonyms, %s alt ids, %s relations', len(self.terms), len(self.synonyms),
+                     len(self.alt_ids), len(self.relations))
+        self.written.update(terms=len(self.terms), synonyms=len(self.synonyms), alt_ids=len(self.alt_ids),
+                            relations=len(self.relations))
+        self.terms.clear()
+        self.synonyms.clear()
+        self.alt_ids.clear()
+        self.relations.clear()
+        self.synced.clear()
+
+    def term_row(self, m_term):
+        return dict(accession=m_term.accession,
+                    name=m_term.name,
+                    definition=m_term.description,
+                    subsets=m_term.subsets,
+                    is_root=int(bool(m_term.is_root)),
+                    is_obsolete=int(bool(m_term.is_obsolete)),
+                    iri=m_term.iri,
+                    ontology_id=m_term.ontology_id)
+
+    def write_terms(self, connection):
+        table = Term.__table__
+        rows = [self.term_row(m_term) for m_term in self.terms.values()]
+        # synced terms columns are overwritten whatever the upsert mode
+        replaced = [self.upsert == 'update' or row['accession'] in self.synced for row in rows]
+        updated = [row for row, replace in zip(rows, replaced) if replace]
+        update = self.term_columns[1:]
+        self.insert(connection, table, [row for row, replace in zip(rows, replaced) if not replace])
+        self.insert(connection, table, updated, update=update)
+        if updated and connection.dialect.name != 'mysql':
+            statement = table.update().where(table.c.accession == bindparam('_accession')) \
+                .values({column: bindparam(column) for column in update})
+            connection.execute(statement, [dict(row, _accession=row['accession']) for row in updated])
+
+    def term_ids(self, connection, accessions):
+        """
+        Resolve terms ids
+        :param connection: db connection
+        :param accessions: terms accessions
+        :return: dict accession: term_id
+        """
+        table = Term.__table__
+        term_ids = {}
+        if self.identities is not None:
+            for accession in accessions:
+                ids = self.identities.term(accession) if accession not in self.terms else None
+                if ids is not None:
+                    term_ids[accession] = ids[0]
+        unknown = sorted(accession for accession in accessions if accession not in term_ids)
+        for chunk in self.chunks(unknown, sqlite_max_variables):
+            statement = select([table.c.accession, table.c.term_id, table.c.ontology_id]) \
+                .where(table.c.accession.in_(chunk))
+            for accession, term_id, ontology_id in connection.execute(statement):
+                term_ids[accession] = term_id
+                if self.identities is not None:
+                    self.identities.add_term(accession, term_id, ontology_id)
+        return term_ids
+
+    def insert(self, connection, table, rows, update=None, unique=None):
+        """
+        Multi-row insert, ignoring rows already in table
+        :param connection: db connection
+        :param table: sqlalchemy Table
+        :param rows: list of dict
+        :param update: columns to update for existing rows (MySQL only), ignored if None
+        :param unique: columns identifying existing rows, when not enforced by a unique index
+        """
+        if unique:
+            rows = self.missing(connection, table, rows, unique)
+        if not rows:
+            return
+        dialect = connection.dialect.name
+        size = self.batch_size
+        if dialect == 'sqlite':
+            size = min(size, max(sqlite_max_variables // len(rows[0]), 1))
+        for chunk in self.chunks(rows, size):
+            if dialect == 'mysql':
+                statement = mysql.insert(table).values(chunk)
+                if update:
+                    statement = statement.on_duplicate_key_update({column: statement.inserted[column]
+                                                                   for column in update})
+                else:
+                    statement = statement.prefix_with('IGNORE')
+            elif dialect == 'sqlite':
+                statement = table.insert().values(chunk).prefix_with('OR IGNORE')
+            else:
+                statement = table.insert().values(chunk)
+            connection.execute(statement)
+
+    def sync(self, connection, table, rows, term_ids, unique):
+        """
+        Make terms rows in table match rows: missing ones are inserted, others deleted. Changed rows are replaced.
+        :param connection: db connection
+        :param table: sqlalchemy Table, synonym or alt_id
+        :param rows: list of dict, all rows of terms
+        :param term_ids: terms ids
+        :param unique: columns identifying a row of a term
+        """
+        if not term_ids:
+            return
+        primary_key = table.primary_key.columns.values()[0]
+        columns = list(rows[0].keys()) if rows else list(unique)
+        existing = {}
+        deleted = []
+        for chunk in self.chunks(sorted(term_ids), sqlite_max_variables):
+            statement = select([primary_key] + [table.c[column] for column in columns]) \
+                .where(table.c.term_id.in_(chunk))
+            for row in connection.execute(statement):
+                values = {column: self.value(row[column]) for column in columns}
+                key = tuple(values[column] for column in unique)
+                if key in existing:
+                    # duplicated row
+                    deleted.append(row[primary_key])
+                else:
+                    existing[key] = (row[primary_key], values)
+        inserted = []
+        for row in rows:
+            key = tuple(row[column] for column in unique)
+            if key in existing:
+                row_id, values = existing[key]
+                if values == {column: self.value(row[column]) for column in columns}:
+                    del existing[key]
+                    continue
+            inserted.append(row)
+        deleted = sorted(deleted + [row_id for row_id, _ in existing.values()])
+        for chunk in self.chunks(deleted, sqlite_max_variables):
+            connection.execute(table.delete().where(primary_key.in_(chunk)))
+        self.insert(connection, table, inserted)
+        self.written.update({table.name + '_deleted': len(deleted)})
+        logger.debug('Synced %s: %s inserted, %s deleted', table.name, len(inserted), len(deleted))
+
+    @staticmethod
+    def value(value):
+        return value.name if isinstance(value, enum.Enum) else value
+
+    def missing(self, connection, table, rows, unique):
+        """ Filter out rows already in table, matching on unique columns """
+        first, second = unique
+        existing = set()
+        for chunk in self.chunks(sorted({row[first] for row in rows}), sqlite_max_variables):
+            statement = select([table.c[first], table.c[second]]).where(table.c[first].in_(chunk))
+            existing.update((a, b) for a, b in connection.execute(statement))
+        return [row for row in rows if (row[first], row[second]) not in existing]
+
+    @staticmethod
+    def chunks(items, size):
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+
+class InfileWriter(BatchWriter):
+    """ Batch writer ingesting rows from TSV files with MySQL LOAD DATA LOCAL INFILE
+
+    Terms rows are dumped to a file in output directory and loaded first, their ids are then resolved to dump and
+    load synonyms, alt ids and relations rows. Files are removed once loaded. Other backends (i.e SQLite) insert
+    rows with a single executemany per table instead, still within one transaction per flush.
+    Rows are only inserted when missing, 'update' upsert falls back to BatchWriter multi-row inserts.
+    MySQL connection and server must allow local infile (see db.DataAccessLayer 'fast_load' option).
+    """
+    escapes = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+    def __init__(self, engine, output_dir=None, batch_size=100000, upsert='ignore', identities=None):
+        super().__init__(engine, batch_size, upsert, identities)
+        self.output_dir = output_dir or tempfile.gettempdir()
+
+    @classmethod
+    def tsv_value(cls, value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return str(int(value))
+        if isinstance(value, enum.Enum):
+            return value.name
+        return str(value).translate(cls.escapes)
+
+    def dump(self, table, columns, rows):
+        """
+        Write rows in a TSV file, as expected by LOAD DATA default format
+        :return: file path
+        """
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=self.output_dir, prefix=table.name + '.',
+                                         suffix='.tsv', delete=False) as f:
+            for row in rows:
+                f.write('\t'.join(self.tsv_value(row[column]) for column in columns) + '\n')
+        return f.name
+
+    def insert(self, connection, table, rows, update=None, unique=None):
+        dialect = connection.dialect.name
+        if update or dialect not in ('mysql', 'sqlite'):
+            return super().insert(connection, table, rows, update, unique)
+        if unique:
+            rows = self.missing(connection, table, rows, unique)
+        if not rows:
+            return
+        if dialect == 'sqlite':
+            connection.execute(table.insert().prefix_with('OR IGNORE'), rows)
+            return
+        columns = list(rows[0].keys())
+        path = self.dump(table, columns, rows)
+        try:
+            connection.execute(text("LOAD DATA LOCAL INFILE :path IGNORE INTO TABLE {} CHARACTER SET utf8 "
+                                    "FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n' ({})"
+                                    .format(table.name, ', '.join(columns))), path=path)
+        finally:
+            os.remove(path)
+        logger.debug('Loaded %s rows in %s', len(rows), table.name)
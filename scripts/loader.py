@@ -20,7 +20,7 @@ import sys
 from os.path import expanduser
 
 from bio.ensembl.ontology.loader.db import dal
-from bio.ensembl.ontology.loader.ols import OlsLoader
+from bio.ensembl.ontology.loader.ols import OlsLoader, init_schema, drop_staging
 
 # allow ols.py to be run from any path
 os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
@@ -52,6 +52,19 @@ if __name__ == "__main__":
     parser.add_argument('-u', '--host_url', type=str, required=True,
                         help='Db Host Url format engine:///user:pass@host:port')
     parser.add_argument('-s', '--slice', help='Only load a slice of data format START-STOP', required=False)
+    parser.add_argument('-f', '--file', help='Load ontology from a local OBO / obographs file instead of OLS',
+                        required=False)
+    parser.add_argument('-b', '--batch', type=int, help='Write terms by batches of BATCH rows', required=False)
+    parser.add_argument('-l', '--fast', help='Ingest rows with LOAD DATA LOCAL INFILE', required=False, default=False,
+                        action='store_true')
+    parser.add_argument('-g', '--staging', help='Append rows to staging tables, merged once loaded', required=False,
+                        default=False, action='store_true')
+    parser.add_argument('-i', '--incremental', help='Only load ontology terms changed since last load',
+                        required=False, default=False, action='store_true')
+    parser.add_argument('-c', '--closure', help='Compute ontology closure once loaded', required=False,
+                        default=False, action='store_true')
+    parser.add_argument('-a', '--ancestors', required=False, default=False, action='store_true',
+                        help='Build ancestors index of loaded terms in loader output directory, HOME by default')
 
     arguments = parser.parse_args(sys.argv[1:])
     logger.setLevel(logging.INFO)
@@ -60,6 +73,16 @@ if __name__ == "__main__":
     args = vars(parser.parse_args())
     db_name = 'ensembl_ontology_{}'.format(arguments.release)
     options = {'drop': not arguments.keep, 'echo': arguments.verbose, 'db_version': arguments.release}
+    if arguments.file is not None:
+        options['ontology_files'] = {arguments.ontology.upper(): arguments.file}
+    if arguments.batch is not None:
+        options['batch_size'] = arguments.batch
+    if arguments.fast:
+        options['fast_load'] = True
+    if arguments.staging:
+        options['staging'] = True
+    if arguments.incremental:
+        options['incremental'] = True
     if arguments.host_url is None:
         db_url = 'sqlite:///' + expanduser("~") + '/' + db_name + '.sqlite'
         options.update({'pool_size': None})
@@ -79,9 +102,14 @@ if __name__ == "__main__":
         logger.info('Process cancelled')
         exit(0)
 
+    if arguments.staging:
+        init_schema(db_url, **options)
     loader = OlsLoader(db_url, **options)
 
-    if not arguments.keep:
+    if arguments.incremental and not loader.ontology_changed(arguments.ontology):
+        logger.info('Ontology %s unchanged since last load', arguments.ontology)
+        exit(0)
+    if not arguments.keep and not arguments.incremental:
         logger.info('Wiping %s ontology', arguments.ontology)
         loader.wipe_ontology(ontology_name=arguments.ontology)
         logger.info('Ontology %s reset', arguments.ontology)
@@ -91,4 +119,17 @@ if __name__ == "__main__":
             n_terms, n_ignored = loader.load_ontology_terms(arguments.ontology, int(slices[0]), int(slices[1]))
         else:
             n_terms, n_ignored = loader.load_ontology_terms(arguments.ontology)
+    if arguments.staging:
+        loader.merge_staging(arguments.ontology)
+    if arguments.incremental and slices is None:
+        # other slices terms would be found absent, and ontology is only up to date once they are all loaded
+        loader.remove_absent_terms(arguments.ontology)
+        loader.update_version(arguments.ontology)
+    if arguments.closure:
+        loader.load_closure(arguments.ontology)
+    if arguments.ancestors:
+        loader.ancestor_index()
+    if arguments.staging and slices is None:
+        # other slices loaders may still append rows
+        drop_staging(db_url)
     logger.info('...Done')
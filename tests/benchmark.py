@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+End to end load_ontology_terms benchmark against the local OLS stand-in
+
+    python -m tests.benchmark --terms 2000 --latency 0.05 --extraction sync async bulk
+"""
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from bio.ensembl.ontology.loader.db import dal
+from bio.ensembl.ontology.loader.models import Term, Relation, Synonym
+from bio.ensembl.ontology.loader.ols import OlsLoader
+from tests import read_env
+from tests.ols_server import OLSStandIn, SyntheticOntology
+
+logger = logging.getLogger(__name__)
+
+
+def benchmark(db_url, server, ontology, extraction, **options):
+    """
+    Load ontology terms from stand-in server into a wiped database
+    :return: dict of measures
+    """
+    dal.wipe_schema(db_url)
+    if extraction == 'bulk':
+        # relations read from the ontology dump
+        options['edges_files'] = {ontology.prefix: ontology.write_obo(os.path.join(options['output_dir'], 'edges.obo'))}
+    loader = OlsLoader(db_url, ols_api_url=server.url, allowed_ontologies=[ontology.prefix], extraction=extraction,
+                       **options)
+    server.requests.clear()
+    server.errors = 0
+    start = time.time()
+    with dal.session_scope() as session:
+        loader.load_ontology(ontology.ontology_id, session)
+        loader.load_subsets(ontology.ontology_id, session)
+    n_terms, n_ignored = loader.load_ontology_terms(ontology.ontology_id, 0, ontology.n_terms)
+    elapsed = time.time() - start
+    with dal.session_scope() as session:
+        return dict(extraction=extraction,
+                    seconds=round(elapsed, 2),
+                    terms_per_second=round(n_terms / elapsed, 1),
+                    requests=sum(server.requests.values()),
+                    errors=server.errors,
+                    concurrency_limit=int(loader.controller.limit),
+                    latency_p90=round(loader.controller.percentile(90), 3),
+                    terms=session.query(Term).count(),
+                    relations=session.query(Relation).count(),
+                    synonyms=session.query(Synonym).count())
+
+
+if __name__ == "__main__":
+    read_env()
+    parser = argparse.ArgumentParser(description='Benchmark terms loading against a local OLS stand-in')
+    parser.add_argument('-u', '--db_url', default=os.getenv('DB_TEST_URL'), help='Benchmark database url')
+    parser.add_argument('-n', '--terms', type=int, default=1000, help='Synthetic ontology number of terms')
+    parser.add_argument('-b', '--branching', type=int, default=4, help='Synthetic ontology tree branching')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Seconds added to each response')
+    parser.add_argument('-j', '--jitter', type=float, default=0.0, help='Maximum random seconds added to latency')
+    parser.add_argument('-e', '--error-rate', type=float, default=0.0, help='Injected errors rate')
+    parser.add_argument('-s', '--error-status', type=int, default=503, help='Injected errors HTTP status')
+    parser.add_argument('-x', '--extraction', nargs='+', default=['sync', 'async', 'bulk'],
+                        help='Extraction modes to compare')
+    parser.add_argument('-p', '--page_size', type=int, default=100, help='Loader page size')
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    synthetic = SyntheticOntology('syn', arguments.terms, arguments.branching)
+    with OLSStandIn([synthetic], latency=arguments.latency, jitter=arguments.jitter, error_rate=arguments.error_rate,
+                    error_status=arguments.error_status, seed=0) as stand_in:
+        for mode in arguments.extraction:
+            results = benchmark(arguments.db_url, stand_in, synthetic, mode, page_size=arguments.page_size,
+                                output_dir=tempfile.mkdtemp())
+            print(' '.join('{}={}'.format(key, value) for key, value in results.items()))
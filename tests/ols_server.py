@@ -0,0 +1,494 @@
+# -*- coding: utf-8 -*-
+"""
+.. See the NOTICE file distributed with this work for additional information
+   regarding copyright ownership.
+   Licensed under the Apache License, Version 2.0 (the "License");
+   you may not use this file except in compliance with the License.
+   You may obtain a copy of the License at
+       http://www.apache.org/licenses/LICENSE-2.0
+   Unless required by applicable law or agreed to in writing, software
+   distributed under the License is distributed on an "AS IS" BASIS,
+   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+   See the License for the specific language governing permissions and
+   limitations under the License.
+
+Local OLS api stand-in, serving synthetic ontologies and / or responses recorded with the loader 'cache_dir' option,
+with configurable latency and error rate.
+
+    python -m tests.ols_server --terms 5000 --latency 0.05 --error-rate 0.01 --port 8080
+"""
+import argparse
+import collections
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import parse
+
+from bio.ensembl.ontology.loader.cache import ResponseCache
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['SyntheticOntology', 'OLSStandIn']
+
+obo_purl = 'http://purl.obolibrary.org/obo/'
+subset_property = 'http://www.geneontology.org/formats/oboInOwl#SubsetProperty'
+hierarchical = ['parents', 'ancestors', 'hierarchicalParents', 'hierarchicalAncestors', 'children', 'descendants',
+                'hierarchicalChildren', 'hierarchicalDescendants']
+
+
+def make_uri(identifier):
+    return parse.quote_plus(parse.quote_plus(str(identifier)))
+
+
+class SyntheticOntology(object):
+    """ Generated ontology: terms form a tree, with additional part_of relations, synonyms, alt ids and subsets
+
+    Terms are built on request from their index, whatever the number of terms.
+    """
+
+    def __init__(self, ontology_id='syn', n_terms=1000, branching=4, subsets=('syn_slim', 'syn_core')):
+        self.ontology_id = ontology_id.lower()
+        self.prefix = ontology_id.upper()
+        self.n_terms = n_terms
+        self.branching = branching
+        self.subsets = subsets
+
+    def iri(self, index):
+        return '{}{}_{:07d}'.format(obo_purl, self.prefix, index)
+
+    def index(self, iri):
+        match = re.match(r'^{}{}_(\d+)$'.format(re.escape(obo_purl), self.prefix), iri)
+        if match and int(match.group(1)) < self.n_terms:
+            return int(match.group(1))
+        return None
+
+    def parents(self, index):
+        return [(index - 1) // self.branching] if index > 0 else []
+
+    def ancestors(self, index):
+        ancestors = []
+        while index > 0:
+            index = (index - 1) // self.branching
+            ancestors.append(index)
+        return ancestors
+
+    def children(self, index):
+        first = index * self.branching + 1
+        return list(range(first, min(first + self.branching, self.n_terms)))
+
+    def descendants(self, index):
+        descendants = []
+        pending = collections.deque(self.children(index))
+        while pending:
+            child = pending.popleft()
+            descendants.append(child)
+            pending.extend(self.children(child))
+        return descendants
+
+    def part_of(self, index):
+        return [index // (self.branching ** 2)] if index >= self.branching ** 2 else []
+
+    def relations(self, index):
+        """
+        :return: term relations names
+        """
+        relations = []
+        if index > 0:
+            relations += [name for name in hierarchical if name.lower().endswith(('parents', 'ancestors'))]
+        if self.children(index):
+            relations += [name for name in hierarchical if name.lower().endswith(('children', 'descendants'))]
+        if self.part_of(index):
+            relations.append('part_of')
+        return relations
+
+    def related(self, index, relation):
+        """
+        :return: related terms indexes, None if term has no such relation
+        """
+        if relation not in self.relations(index):
+            return None
+        return getattr(self, relation.replace('hierarchical', '').lower())(index)
+
+    def write_obo(self, path):
+        """ Write terms and their is_a / part_of relations as an OBO dump """
+        with open(path, 'w') as f:
+            f.write('format-version: 1.2\n')
+            for index in range(self.n_terms):
+                f.write('\n[Term]\nid: {}:{:07d}\n'.format(self.prefix, index))
+                f.writelines('is_a: {}:{:07d}\n'.format(self.prefix, parent) for parent in self.parents(index))
+                f.writelines('relationship: part_of {}:{:07d}\n'.format(self.prefix, whole)
+                             for whole in self.part_of(index))
+        return path
+
+    def ontology(self, site):
+        base = '/'.join([site, 'ontologies', self.ontology_id])
+        return {
+            'ontologyId': self.ontology_id,
+            'loaded': '2020-01-01T00:00:00.000+0000',
+            'updated': '2020-01-01T00:00:00.000+0000',
+            'status': 'LOADED',
+            'version': None,
+            'numberOfTerms': self.n_terms,
+            'numberOfProperties': len(self.subsets) + 1,
+            'numberOfIndividuals': 0,
+            'config': {
+                'id': self.ontology_id,
+                'versionIri': '{}{}/releases/2020-01-01/{}.owl'.format(obo_purl, self.ontology_id, self.ontology_id),
+                'title': 'Synthetic {} ontology'.format(self.prefix),
+                'namespace': self.ontology_id,
+                'preferredPrefix': self.prefix,
+                'description': 'Generated ontology for tests and benchmarks',
+                'version': '2020-01-01',
+                'fileLocation': '{}{}.owl'.format(obo_purl, self.ontology_id),
+                'annotations': {}
+            },
+            '_links': {
+                'self': {'href': base},
+                'terms': {'href': base + '/terms'},
+                'properties': {'href': base + '/properties'},
+                'individuals': {'href': base + '/individuals'}
+            }
+        }
+
+    def term(self, index, site):
+        iri = self.iri(index)
+        base = '/'.join([site, 'ontologies', self.ontology_id, 'terms', make_uri(iri)])
+        links = collections.OrderedDict([('self', {'href': base})])
+        for name in self.relations(index):
+            links[name] = {'href': base + '/' + name}
+        links['jstree'] = {'href': base + '/jstree'}
+        links['graph'] = {'href': base + '/graph'}
+        return {
+            'iri': iri,
+            'label': '{} term {}'.format(self.prefix.lower(), index),
+            'description': ['Synthetic term {}.'.format(index)],
+            'annotation': {
+                'has_obo_namespace': [self.ontology_id],
+                'has_alternative_id': ['{}:{:07d}'.format(self.prefix, self.n_terms + index)] if index % 10 == 1 else []
+            },
+            'synonyms': ['{} synonym {}'.format(self.prefix.lower(), index)],
+            'ontology_name': self.ontology_id,
+            'ontology_prefix': self.prefix,
+            'ontology_iri': '{}{}.owl'.format(obo_purl, self.ontology_id),
+            'is_obsolete': False,
+            'term_replaced_by': None,
+            'is_defining_ontology': True,
+            'has_children': bool(self.children(index)),
+            'is_root': index == 0,
+            'short_form': '{}_{:07d}'.format(self.prefix, index),
+            'obo_id': '{}:{:07d}'.format(self.prefix, index),
+            'in_subset': [self.subsets[index % len(self.subsets)]] if self.subsets and index % 5 == 0 else None,
+            'obo_definition_citation': None,
+            'obo_xref': None,
+            'obo_synonym': [{'name': '{} exact synonym {}'.format(self.prefix.lower(), index),
+                             'scope': 'hasExactSynonym', 'type': None, 'xrefs': []}],
+            '_links': links
+        }
+
+    def properties(self, site):
+        """
+        Subsets declarations, as children of SubsetProperty
+        :return: list of property documents
+        """
+        return [self.property(name, site) for name in self.subsets]
+
+    def property(self, name, site):
+        iri = '{}{}#{}'.format(obo_purl, self.ontology_id, name)
+        base = '/'.join([site, 'ontologies', self.ontology_id, 'properties', make_uri(iri)])
+        return {
+            'iri': iri,
+            'label': name,
+            'annotation': {'comment': ['{} subset'.format(name)]},
+            'synonyms': None,
+            'ontology_name': self.ontology_id,
+            'ontology_prefix': self.prefix,
+            'is_obsolete': False,
+            'is_defining_ontology': True,
+            'has_children': False,
+            'is_root': False,
+            'short_form': name,
+            'obo_id': name,
+            '_links': {'self': {'href': base}}
+        }
+
+
+class OLSStandIn(object):
+    """ Threaded local HTTP server mimicking OLS api endpoints used by the loader
+
+    :param ontologies: list of SyntheticOntology
+    :param recorded: ResponseCache directory, as filled with loader 'cache_dir' option
+    :param recorded_site: OLS api url the responses were recorded from
+    :param latency: seconds added to every response
+    :param jitter: maximum random seconds added to latency
+    :param error_rate: probability for a request to fail with error_status
+    :param error_status: HTTP status of injected errors (e.g 503, 429)
+    :param seed: random seed, for reproducible injected errors / jitter
+    """
+
+    def __init__(self, ontologies=(), recorded=None, recorded_site=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=503, seed=None, host='127.0.0.1', port=0):
+        self.ontologies = {ontology.ontology_id: ontology for ontology in ontologies}
+        self.recorded = ResponseCache(recorded) if recorded else None
+        self.recorded_site = recorded_site
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+        self.requests = collections.Counter()
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.server.handle_error = self.handle_error
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/api'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info('OLS stand-in listening on %s', self.url)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @staticmethod
+    def handle_error(request, client_address):
+        # clients closing kept alive connections
+        logger.debug('Connection error with %s', client_address, exc_info=True)
+
+    def handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.serve(self)
+
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+        return Handler
+
+    def delay(self):
+        with self._lock:
+            jitter = self.random.uniform(0, self.jitter) if self.jitter else 0
+            failed = self.error_rate and self.random.random() < self.error_rate
+        if self.latency or jitter:
+            time.sleep(self.latency + jitter)
+        return failed
+
+    def serve(self, request):
+        path, _, query = request.path.partition('?')
+        params = dict(parse.parse_qsl(query))
+        with self._lock:
+            self.requests[self.endpoint(path)] += 1
+        if self.delay():
+            with self._lock:
+                self.errors += 1
+            return self.send(request, self.error_status, self.error(self.error_status, 'Injected error', path))
+        if self.recorded is not None:
+            entry = self.recorded_entry(request)
+            if entry is not None:
+                return self.send(request, entry['status_code'], entry['content'],
+                                 entry['headers'].get('Content-Type', 'application/hal+json'))
+        try:
+            document = self.route(path, params)
+        except (KeyError, ValueError, IndexError):
+            document = None
+        if document is None:
+            return self.send(request, 404, self.error(404, 'Not Found', path))
+        return self.send(request, 200, document)
+
+    @staticmethod
+    def endpoint(path):
+        """ Requested endpoint name, requests are counted by endpoint """
+        parts = [part for part in path.split('/') if part][1:]
+        if not parts:
+            return 'root'
+        if parts[0] == 'ontologies' and len(parts) > 2:
+            # terms / term / relation name, properties / property / children
+            return {3: parts[2], 4: parts[2][:-1]}.get(len(parts), parts[-1])
+        return parts[0]
+
+    def recorded_entry(self, request):
+        site = parse.urlsplit(self.recorded_site or self.url)
+        url = parse.urlunsplit((site.scheme, site.netloc, site.path.rstrip('/') + request.path[len('/api'):], '', ''))
+        key = self.recorded.key('GET', url, request.headers.get('Accept'))
+        return self.recorded.get(key, expired=True)
+
+    @staticmethod
+    def error(status, message, path):
+        return {'timestamp': int(time.time() * 1000), 'status': status, 'error': message, 'message': message,
+                'path': path}
+
+    @staticmethod
+    def send(request, status, content, content_type='application/hal+json'):
+        body = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            request.send_header('Retry-After', '1')
+        request.end_headers()
+        request.wfile.write(body)
+
+    def route(self, path, params):
+        site = self.url
+        parts = [part for part in path.split('/') if part][1:]
+        if not parts:
+            return {'_links': {name: {'href': '/'.join([site, name])}
+                               for name in ('ontologies', 'terms', 'properties', 'individuals', 'search')}}
+        page, size = int(params.get('page', 0)), int(params.get('size', 20))
+        if parts[0] == 'ontologies':
+            if len(parts) == 1:
+                ontologies = list(self.ontologies.values())
+                return self.page(site + '/ontologies', 'ontologies', len(ontologies),
+                                 lambda i: ontologies[i].ontology(site), page, size)
+            ontology = self.ontologies[parts[1].lower()]
+            if len(parts) == 2:
+                return ontology.ontology(site)
+            if parts[2] == 'terms':
+                return self.route_terms(ontology, parts[3:], page, size)
+            if parts[2] == 'properties':
+                return self.route_properties(ontology, parts[3:], page, size)
+            return None
+        if parts[0] in ('terms', 'properties') and len(parts) == 2:
+            # detail lookup through all ontologies
+            iri = parse.unquote_plus(parse.unquote_plus(parts[1]))
+            for ontology in self.ontologies.values():
+                if parts[0] == 'terms' and ontology.index(iri) is not None:
+                    documents = [ontology.term(ontology.index(iri), site)]
+                    return self.page('/'.join([site, 'terms', parts[1]]), 'terms', 1, lambda i: documents[i], 0, 20)
+                documents = [document for document in ontology.properties(site) if document['iri'] == iri]
+                if parts[0] == 'properties' and documents:
+                    return self.page('/'.join([site, 'properties', parts[1]]), 'properties', 1,
+                                     lambda i: documents[i], 0, 20)
+            return None
+        if parts[0] == 'search':
+            return self.search(params)
+        return None
+
+    def route_terms(self, ontology, parts, page, size):
+        site = self.url
+        base = '/'.join([site, 'ontologies', ontology.ontology_id, 'terms'])
+        if not parts:
+            return self.page(base, 'terms', ontology.n_terms, lambda i: ontology.term(i, site), page, size)
+        index = ontology.index(parse.unquote_plus(parse.unquote_plus(parts[0])))
+        if index is None:
+            return None
+        if len(parts) == 1:
+            return ontology.term(index, site)
+        related = ontology.related(index, parts[1])
+        if related is None:
+            return None
+        return self.page('/'.join([base, parts[0], parts[1]]), 'terms', len(related),
+                         lambda i: ontology.term(related[i], site), page, size)
+
+    def route_properties(self, ontology, parts, page, size):
+        site = self.url
+        base = '/'.join([site, 'ontologies', ontology.ontology_id, 'properties'])
+        properties = ontology.properties(site)
+        if not parts:
+            return self.page(base, 'properties', len(properties), lambda i: properties[i], page, size)
+        iri = parse.unquote_plus(parse.unquote_plus(parts[0]))
+        if iri == subset_property:
+            if len(parts) == 1:
+                return {'iri': iri, 'label': 'subset_property', 'short_form': 'SubsetProperty',
+                        'annotation': {}, 'ontology_name': ontology.ontology_id, 'is_defining_ontology': False,
+                        '_links': {'self': {'href': '/'.join([base, parts[0]])},
+                                   'children': {'href': '/'.join([base, parts[0], 'children'])}}}
+            if parts[1] == 'children':
+                return self.page('/'.join([base, parts[0], 'children']), 'properties', len(properties),
+                                 lambda i: properties[i], page, size)
+            return None
+        documents = [document for document in properties if document['iri'] == iri]
+        return documents[0] if documents and len(parts) == 1 else None
+
+    def search(self, params):
+        site = self.url
+        query = params.get('q', '').lower()
+        start, rows = int(params.get('start', 0)), int(params.get('rows', 10))
+        docs = []
+        for ontology in self.ontologies.values():
+            for document in ontology.properties(site):
+                if any(term in document['label'].lower() for term in query.split(',') if term):
+                    doc = {key: document[key] for key in ('iri', 'label', 'short_form', 'obo_id', 'ontology_name',
+                                                          'ontology_prefix', 'is_defining_ontology')}
+                    doc['type'] = 'property'
+                    docs.append(doc)
+        return {'responseHeader': {'status': 0, 'params': params},
+                'response': {'numFound': len(docs), 'start': start, 'docs': docs[start:start + rows]}}
+
+    @staticmethod
+    def page(base, key, total, item, page, size):
+        """
+        Build a HAL paginated list document
+        :param base: list url
+        :param key: embedded list name
+        :param total: total number of items
+        :param item: callable building item document from its index
+        :param page: requested page
+        :param size: page size
+        :return: dict
+        """
+        pages = int(math.ceil(total / size)) if size else 0
+
+        def href(number):
+            return {'href': '{}?page={}&size={}'.format(base, number, size)}
+
+        links = collections.OrderedDict([('first', href(0)), ('self', href(page))])
+        if page + 1 < pages:
+            links['next'] = href(page + 1)
+        if page > 0:
+            links['prev'] = href(page - 1)
+        links['last'] = href(max(pages - 1, 0))
+        document = {'_links': links, 'page': {'size': size, 'totalElements': total, 'totalPages': pages,
+                                              'number': page}}
+        items = [item(i) for i in range(page * size, min((page + 1) * size, total))]
+        if items:
+            document['_embedded'] = {key: items}
+        return document
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a local OLS api stand-in')
+    parser.add_argument('-o', '--ontology', default='syn', help='Synthetic ontology short name')
+    parser.add_argument('-n', '--terms', type=int, default=1000, help='Synthetic ontology number of terms')
+    parser.add_argument('-r', '--recorded', help='Recorded responses cache directory')
+    parser.add_argument('--recorded-site', help='OLS api url responses were recorded from')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Seconds added to each response')
+    parser.add_argument('-j', '--jitter', type=float, default=0.0, help='Maximum random seconds added to latency')
+    parser.add_argument('-e', '--error-rate', type=float, default=0.0, help='Injected errors rate')
+    parser.add_argument('-s', '--error-status', type=int, default=503, help='Injected errors HTTP status')
+    parser.add_argument('-p', '--port', type=int, default=8080, help='Listening port')
+    arguments = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    stand_in = OLSStandIn([SyntheticOntology(arguments.ontology, arguments.terms)],
+                          recorded=arguments.recorded, recorded_site=arguments.recorded_site,
+                          latency=arguments.latency, jitter=arguments.jitter, error_rate=arguments.error_rate,
+                          error_status=arguments.error_status, port=arguments.port)
+    try:
+        stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        stand_in.stop()
@@ -12,8 +12,12 @@
    limitations under the License.
 """
 import datetime
+import json
 import logging.config
 import os
+import shutil
+import tempfile
+import time
 import unittest
 import warnings
 from os.path import join
@@ -27,12 +31,22 @@ from bio.ensembl.ontology.hive.OLSHiveLoader import OLSHiveLoader
 from bio.ensembl.ontology.hive.OLSOntologyLoader import OLSOntologyLoader
 from bio.ensembl.ontology.hive.OLSTermsLoader import OLSTermsLoader
 from bio.ensembl.ontology.hive.OLSLoadPhiBaseIdentifier import OLSLoadPhiBaseIdentifier
+from bio.ensembl.ontology.loader.ancestors import AncestorIndex, index_path
+from bio.ensembl.ontology.loader.cache import CacheMissError, ResponseCache
 from bio.ensembl.ontology.loader.db import *
+from bio.ensembl.ontology.loader.files import ontology_reader
+from bio.ensembl.ontology.loader.graph import OntologyGraph
 from bio.ensembl.ontology.loader.models import *
-from bio.ensembl.ontology.loader.ols import OlsLoader, init_schema, log_format
+from bio.ensembl.ontology.loader.ols import OlsLoader, init_schema, drop_staging, log_format
+from bio.ensembl.ontology.loader.prefetch import TermsPrefetcher, ontology_terms
+from bio.ensembl.ontology.loader.shadow import create_shadow, validate_shadow, swap_shadow, ontologies_terms
+from bio.ensembl.ontology.loader.staging import StagingWriter
+from bio.ensembl.ontology.loader.transport import OlsUnavailableError, session_scope
+from bio.ensembl.ontology.loader.writer import InfileWriter
 from ebi.ols.api.client import OlsClient
 from ebi.ols.api.exceptions import NotFoundException
 from tests import read_env
+from tests.ols_server import OLSStandIn, SyntheticOntology
 
 read_env()
 
@@ -76,6 +90,44 @@ class TestOLSLoaderBasic(unittest.TestCase):
                                 allowed_ontologies=self.test_ontologies,
                                 ols_api_url=self.ols_api_url)
         self.client = OlsClient(base_site=self.ols_api_url)
+        # files written by tests, other than logs
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def syn_loader(self, stand_in, **options):
+        """ Loader of synthetic ontology served by stand in server """
+        return OlsLoader(self.db_url, output_dir=log_dir, allowed_ontologies=['SYN'], ols_api_url=stand_in.url,
+                         **dict({'page_size': 20}, **options))
+
+    @staticmethod
+    def table_counts(models=(Term, Relation, Synonym, AltId)):
+        with dal.session_scope() as session:
+            return [session.query(model).count() for model in models]
+
+    def assertSameRows(self, load=None, baseline=None, **options):
+        """
+        Load 30 synthetic ontology terms with baseline options, then again into a wiped db with options, and check
+        the same number of rows are loaded
+        :param load: callable(loader) loading terms with options, instead of loading all 30 terms at once
+        :param baseline: baseline loader options, default ones if None
+        :param options: tested loader options
+        :return: tested loader
+        """
+        with OLSStandIn([SyntheticOntology('syn', 60)]) as stand_in:
+            self.assertEqual((30, 0), self.syn_loader(stand_in, **(baseline or {})).load_ontology_terms('syn', 0, 30))
+            expected = self.table_counts()
+            dal.wipe_schema(self.db_url)
+            if options.get('staging'):
+                init_schema(self.db_url, staging=True)
+            loader = self.syn_loader(stand_in, **options)
+            if load is None:
+                self.assertEqual((30, 0), loader.load_ontology_terms('syn', 0, 30))
+            else:
+                load(loader)
+        self.assertEqual(expected, self.table_counts())
+        return loader
 
     def testCascadeDelete(self):
         if 'mysql' not in self.db_url:
@@ -235,6 +287,546 @@ class TestOLSLoaderBasic(unittest.TestCase):
         except ValueError:
             self.fail('Wrong date format')
 
+    def testTermsPrefetcher(self):
+        o_ontology = self.client.ontology('bfo')
+        expected = [o_term.accession for o_term in o_ontology.terms()[3:27]]
+        for prefetch in (0, 1, 3):
+            prefetched = TermsPrefetcher(OlsClient(page_size=10, base_site=self.ols_api_url).ontology('bfo').terms(),
+                                         3, 27, prefetch=prefetch)
+            self.assertEqual(24, len(prefetched))
+            self.assertEqual(expected, [o_term.accession for o_term in prefetched])
+
+    def testPageAlignedTerms(self):
+        o_ontology = self.client.ontology('bfo')
+        expected = [o_term.accession for o_term in o_ontology.terms()[13:27]]
+        o_terms = ontology_terms('bfo', 13, 10)
+        self.assertEqual(1, o_terms.page)
+        self.assertEqual(len(o_ontology.terms()), len(o_terms))
+        self.assertEqual(expected, [o_term.accession for o_term in TermsPrefetcher(o_terms, 13, 27)])
+
+    def testAsyncExtraction(self):
+        self.loader.options['extraction'] = 'async'
+        self.loader.options['max_in_flight'] = 20
+        expected, ignored = self.loader.load_ontology_terms('bfo', 0, 19)
+        self.loader.options['extraction'] = 'sync'
+        with dal.session_scope() as session:
+            self.assertGreaterEqual(session.query(Term).count(), expected)
+            self.assertGreaterEqual(session.query(Relation).count(), 17)
+            self.assertIsNone(self.loader.extracted)
+
+    def testBulkRelations(self):
+        self.loader.options['extraction'] = 'bulk'
+        expected, ignored = self.loader.load_ontology_terms('bfo', 0, 19)
+        self.loader.options['extraction'] = 'sync'
+        with dal.session_scope() as session:
+            self.assertGreaterEqual(session.query(Term).count(), expected)
+            self.assertGreaterEqual(session.query(Relation).count(), 17)
+            self.assertIsNone(self.loader.edges)
+
+    def testBulkEdges(self):
+        synthetic = SyntheticOntology('syn', 60)
+        edges_file = synthetic.write_obo(join(self.tmp_dir, 'syn.obo'))
+        with OLSStandIn([synthetic]) as stand_in:
+            self.assertEqual((30, 0), self.syn_loader(stand_in).load_ontology_terms('syn', 0, 30))
+            expected = self.table_counts()
+            dal.wipe_schema(self.db_url)
+            stand_in.requests.clear()
+            loader = self.syn_loader(stand_in, extraction='bulk', edges_files={'SYN': edges_file})
+            self.assertEqual((30, 0), loader.load_ontology_terms('syn', 0, 30))
+            # relations read from the dump, none fetched from terms relation endpoints
+            self.assertEqual(0, stand_in.requests['parents'] + stand_in.requests['part_of'])
+            self.assertIsNone(loader.edges)
+            self.assertEqual(1, len(loader.edge_lists))
+        self.assertEqual(expected, self.table_counts())
+
+    def testOntologyFile(self):
+        obo_file = join(self.tmp_dir, 'eco.obo')
+        with open(obo_file, 'w') as f:
+            f.write('format-version: 1.2\ndata-version: eco/releases/2020-01-01\n'
+                    'subsetdef: eco_slim "ECO slim"\ndefault-namespace: eco\n\n'
+                    '[Term]\nid: ECO:0000000\nname: evidence\ndef: "A type of evidence." [ECO:RCT]\n\n'
+                    '[Term]\nid: ECO:0000001\nname: inference from background scientific knowledge\n'
+                    'alt_id: ECO:0000099\nsubset: eco_slim\nsynonym: "background knowledge" EXACT []\n'
+                    'is_a: ECO:0000000 ! evidence\nrelationship: used_in ECO:0000002 ! assertion method\n\n'
+                    '[Term]\nid: ECO:0000002\nname: assertion method\nis_a: ECO:0000000 ! evidence\n')
+        loader = OlsLoader(self.db_url, output_dir=log_dir, allowed_ontologies=self.test_ontologies,
+                           ols_api_url=self.ols_api_url, ontology_files={'ECO': obo_file})
+        with dal.session_scope() as session:
+            m_ontology = loader.load_ontology('eco', session)
+            self.assertEqual('eco/releases/2020-01-01', m_ontology.version)
+        self.assertEqual((1, 0), loader.load_ontology_terms('eco', 1, 2))
+        self.assertEqual((3, 0), loader.load_ontology_terms('eco', 0, 3))
+        with dal.session_scope() as session:
+            self.assertEqual(3, session.query(Term).count())
+            self.assertEqual(3, session.query(Relation).count())
+            m_term = session.query(Term).filter_by(accession='ECO:0000001').one()
+            self.assertEqual('eco_slim', m_term.subsets)
+            self.assertEqual(['ECO:0000099'], [alt_id.accession for alt_id in m_term.alt_ids])
+            self.assertEqual(1, len(m_term.synonyms))
+            self.assertEqual(1, session.query(Term).filter_by(is_root=1).count())
+            self.assertEqual('A type of evidence.',
+                             session.query(Term).filter_by(accession='ECO:0000000').one().description)
+
+    def testFileReaderPasses(self):
+        json_file = join(self.tmp_dir, 'eco.json')
+        node = '{"id": "http://purl.obolibrary.org/obo/ECO_000000%s", "type": "CLASS", "lbl": "term %s"%s}'
+        with open(json_file, 'w') as f:
+            f.write('{"graphs": [{"id": "http://purl.obolibrary.org/obo/eco.json", "meta": {"version": '
+                    '"http://purl.obolibrary.org/obo/eco/releases/2020-01-01/eco.json"}, "nodes": [%s, %s], '
+                    '"edges": []}]}' % (node % (0, 0, ''), node % (1, 1, ', "meta": {"subsets": ["eco#eco_slim"]}')))
+        reader = ontology_reader(json_file, 'eco')
+        passes = []
+        items = reader.items
+        reader.items = lambda key: passes.append(key) or items(key)
+        self.assertEqual(2, reader.ontology().number_of_terms)
+        self.assertEqual(['eco_slim'], [subset.short_form for subset in reader.subsets()])
+        self.assertEqual('2020-01-01', reader.ontology().version)
+        self.assertEqual(2, len(reader))
+        # header, subsets and terms count in a single pass over file nodes
+        self.assertEqual(['nodes'], passes)
+        self.loader.options.update(ontology_files={'ECO': json_file})
+        self.assertIs(self.loader.ontology_reader('eco'), self.loader.ontology_reader('ECO'))
+
+    def testOfflineCache(self):
+        cache_dir = join(self.tmp_dir, 'cache')
+        loader = OlsLoader(self.db_url, output_dir=log_dir, allowed_ontologies=self.test_ontologies,
+                           ols_api_url=self.ols_api_url, cache_dir=cache_dir)
+        expected, ignored = loader.load_ontology_terms('bfo', 0, 19)
+        dal.wipe_schema(self.db_url)
+        loader = OlsLoader(self.db_url, output_dir=log_dir, allowed_ontologies=self.test_ontologies,
+                           ols_api_url=self.ols_api_url, cache_dir=cache_dir, offline=True)
+        self.assertEqual((expected, ignored), loader.load_ontology_terms('bfo', 0, 19))
+        with self.assertRaises(CacheMissError):
+            loader.load_ontology_terms('duo', 0, 19)
+
+    def testCacheSize(self):
+        cache = ResponseCache(self.tmp_dir, max_size=10 ** 6)
+        key = cache.key('GET', 'http://localhost/api/ontologies/bfo')
+        for content in (b'x' * 1000, b'y' * 10):
+            cache.set(key, {'url': 'http://localhost/api/ontologies/bfo', 'content': content})
+        # overwritten entry is not accounted for anymore
+        self.assertEqual(os.path.getsize(cache.path(key)), cache._size)
+        self.assertEqual(cache._size, ResponseCache(self.tmp_dir, max_size=10 ** 6)._size)
+        # stored as a JSON header and raw body, entries in any other format are misses
+        self.assertEqual(b'y' * 10, cache.get(key)['content'])
+        with open(cache.path(key), 'wb') as f:
+            f.write(b'\x80\x04garbage')
+        self.assertIsNone(cache.get(key))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+
+    def testSubsetsCatalogue(self):
+        with dal.session_scope() as session:
+            nb_subsets = self.loader.load_subsets('ECO', session)
+            self.assertIn('ECO', self.loader.subsets_ontologies)
+            names = {subset.name.lower() for subset in session.query(Subset).all()}
+            self.assertEqual(nb_subsets, len(names))
+            self.assertTrue(names.issubset(self.loader.subsets_catalogue(session)))
+
+    def testLoaderOptions(self):
+        with OLSStandIn([SyntheticOntology('syn', 5)]) as stand_in:
+            loader = OlsLoader(self.db_url, output_dir=log_dir, ols_api_url=stand_in.url, staging=True,
+                               extraction='async')
+            other = OlsLoader(self.db_url, output_dir=log_dir, ols_api_url=stand_in.url)
+        self.assertIsInstance(loader.writer, StagingWriter)
+        # options are not shared between loaders
+        self.assertIsNone(other.writer)
+        self.assertEqual('sync', other.options['extraction'])
+        self.assertFalse(OlsLoader._default_options['staging'])
+
+    def testStandInServer(self):
+        synthetic = SyntheticOntology('syn', 60)
+        with OLSStandIn([synthetic], latency=0.01) as stand_in:
+            loader = self.syn_loader(stand_in)
+            with dal.session_scope() as session:
+                m_ontology = loader.load_ontology('syn', session)
+                self.assertEqual('2020-01-01', m_ontology.version)
+                self.assertEqual(2, loader.load_subsets('syn', session))
+            expected, ignored = loader.load_ontology_terms('syn', 0, 40)
+            self.assertEqual(40, expected)
+            self.assertGreater(stand_in.requests['terms'], 0)
+        with dal.session_scope() as session:
+            self.assertGreaterEqual(session.query(Term).count(), 40)
+            self.assertGreaterEqual(session.query(Relation).count(), 39)
+            self.assertEqual(1, session.query(Term).filter_by(accession='SYN:0000000', is_root=1).count())
+
+    def testThrottledRequests(self):
+        with OLSStandIn([SyntheticOntology('syn', 30)], error_rate=0.2, error_status=429, seed=1) as stand_in:
+            loader = self.syn_loader(stand_in, page_size=10, extraction='async', max_in_flight=10, max_retry=10,
+                                     backoff_factor=0.01)
+            expected, ignored = loader.load_ontology_terms('syn', 0, 20)
+            self.assertEqual(20, expected)
+            self.assertGreater(stand_in.errors, 0)
+            self.assertEqual(stand_in.errors, loader.controller.throttled)
+            self.assertLessEqual(loader.controller.limit, 10)
+            self.assertGreater(loader.controller.percentiles()['p90'], 0)
+
+    def testRetryLayers(self):
+        with OLSStandIn([SyntheticOntology('syn', 5)]) as stand_in:
+            loader = self.syn_loader(stand_in, max_retry=2, backoff_factor=0.01)
+            other = self.syn_loader(stand_in)
+            stand_in.error_rate = 1
+            start = time.monotonic()
+            with self.assertRaises(OlsUnavailableError):
+                loader.ontology_details('syn')
+            # retried by the loader transport adapter only, not again by ebi.ols.api clients
+            self.assertEqual(3, stand_in.errors)
+            self.assertLess(time.monotonic() - start, 5)
+            stand_in.error_rate = 0
+            # each loader keeps its own session, the last created one does not serve every loader
+            self.assertEqual('syn', other.ontology_details('syn').ontology_id)
+            self.assertEqual(2, loader.controller.throttled)
+            self.assertEqual(0, other.controller.throttled)
+            # root document fetched by each loader client, then ontology details by the other loader only
+            self.assertEqual(1, len(loader.controller.latencies))
+            self.assertEqual(2, len(other.controller.latencies))
+            # library clients are left untouched, only the loaders own clients go through their session
+            with session_scope(other.session):
+                OlsClient(page_size=20, base_site=stand_in.url)
+            self.assertEqual(2, len(other.controller.latencies))
+
+    def testBatchWriter(self):
+        loader = self.assertSameRows(batch_size=50)
+        self.assertEqual(0, len(loader.writer))
+        self.assertIsNone(self.assertSameRows(batch_size=0).writer)
+
+    def testIdentityCache(self):
+        with OLSStandIn([SyntheticOntology('syn', 60)]) as stand_in:
+            loader = self.syn_loader(stand_in, batch_size=50, identity_cache_size=10)
+            self.assertEqual((20, 0), loader.load_ontology_terms('syn', 0, 20))
+            self.assertGreater(loader.identities.hits, 0)
+            self.assertLessEqual(len(loader.identities.terms), 10)
+            # another loader creates overlapping terms meanwhile, found in db on cache miss
+            other = self.syn_loader(stand_in, batch_size=50)
+            self.assertEqual((20, 0), other.load_ontology_terms('syn', 10, 30))
+            self.assertEqual((20, 0), loader.load_ontology_terms('syn', 20, 40))
+            # updated ontology row is looked up again
+            misses = loader.identities.misses
+            loader.update_version('syn')
+            with dal.session_scope() as session:
+                loader.identities.get_one_or_create(Ontology, session, name='SYN', namespace='syn')
+            self.assertEqual(misses + 1, loader.identities.misses)
+        with dal.session_scope() as session:
+            n_terms = session.query(Term).count()
+            self.assertEqual(n_terms, session.query(Term.accession).distinct().count())
+            self.assertEqual(session.query(Relation).count(),
+                             session.query(Relation.child_term_id, Relation.parent_term_id,
+                                           Relation.relation_type_id).distinct().count())
+
+    def testFastLoad(self):
+        self.assertEqual('a\\tb\\\\c', InfileWriter.tsv_value('a\tb\\c'))
+        self.assertEqual('\\N', InfileWriter.tsv_value(None))
+        loader = self.assertSameRows(fast_load=True)
+        self.assertIsInstance(loader.writer, InfileWriter)
+        self.assertEqual([], [name for name in os.listdir(log_dir) if name.endswith('.tsv')])
+
+    def testStagingMerge(self):
+        merged = {}
+
+        def load(loader):
+            self.assertIsInstance(loader.writer, StagingWriter)
+            # slices appended in any order
+            self.assertEqual((15, 0), loader.load_ontology_terms('syn', 15, 30))
+            self.assertEqual((15, 0), loader.load_ontology_terms('syn', 0, 15))
+            self.assertEqual(0, self.table_counts([Term])[0])
+            merged.update(loader.merge_staging('syn'))
+
+        loader = self.assertSameRows(load, staging=True)
+        self.assertEqual(self.table_counts([Term])[0], merged['term'])
+        self.assertEqual(0, loader.merge_staging('syn')['term'])
+        # staging tables are only dropped once, when every ontology is merged
+        self.assertTrue(dal.engine.has_table('stage_term'))
+        drop_staging(self.db_url)
+        self.assertFalse(dal.engine.has_table('stage_term'))
+
+    def testSyncSynonyms(self):
+        obo_file = join(self.tmp_dir, 'eco.obo')
+        header = 'format-version: 1.2\ndata-version: eco/releases/2020-01-01\ndefault-namespace: eco\n\n'
+        for batch_size in (0, 10):
+            dal.wipe_schema(self.db_url)
+            for stanza in ('alt_id: ECO:0000098\nsynonym: "bk" EXACT []\nsynonym: "old" RELATED []\n',
+                           'alt_id: ECO:0000099\nsynonym: "bk" NARROW []\nsynonym: "new" RELATED []\n'):
+                with open(obo_file, 'w') as f:
+                    f.write(header + '[Term]\nid: ECO:0000001\nname: background knowledge\n' + stanza)
+                loader = OlsLoader(self.db_url, output_dir=log_dir, allowed_ontologies=self.test_ontologies,
+                                   ols_api_url=self.ols_api_url, ontology_files={'ECO': obo_file},
+                                   batch_size=batch_size)
+                self.assertEqual((1, 0), loader.load_ontology_terms('eco'))
+            with dal.session_scope() as session:
+                m_term = session.query(Term).filter_by(accession='ECO:0000001').one()
+                self.assertEqual(['ECO:0000099'], [alt_id.accession for alt_id in m_term.alt_ids])
+                self.assertEqual([('bk', SynonymTypeEnum.NARROW), ('new', SynonymTypeEnum.RELATED)],
+                                 sorted((synonym.name, synonym.type) for synonym in m_term.synonyms))
+
+    def testFreshLoad(self):
+        def load(loader):
+            self.assertEqual((15, 0), loader.load_ontology_terms('syn', 0, 15))
+            # detected from db
+            self.assertTrue(loader.fresh)
+            self.assertEqual((15, 0), loader.load_ontology_terms('syn', 15, 30))
+            self.assertFalse(loader.fresh)
+
+        self.assertSameRows(load, baseline={'fresh_load': False}, fresh_load=None)
+
+    def testWipeBatches(self):
+        with OLSStandIn([SyntheticOntology('syn', 40)]) as stand_in:
+            loader = self.syn_loader(stand_in, wipe_batch_size=7)
+            self.assertEqual((40, 0), loader.load_ontology_terms('syn'))
+            self.assertTrue(loader.wipe_ontology('syn'))
+        with dal.session_scope() as session:
+            self.assertEqual([0, 0, 0, 0, 0],
+                             [session.query(model).count() for model in (Ontology, Term, Relation, Synonym, AltId)])
+
+    def testShadowSwap(self):
+        db_url = 'sqlite:///' + join(self.tmp_dir, 'shadow_release.sqlite')
+        shadow = create_shadow(db_url)
+        self.assertEqual(db_url + '_shadow', shadow)
+        init_schema(shadow, full_load=True)
+        with dal.session_scope() as session:
+            m_ontology = Ontology(name='GO', namespace='biological_process')
+            session.add(Term(accession='GO:0000001', name='term', ontology=m_ontology))
+        with self.assertRaises(RuntimeError):
+            validate_shadow(shadow, db_url, ['GO', 'SO'])
+        self.assertEqual({'GO': 1}, validate_shadow(shadow, db_url, ['GO']))
+        dal.create_secondary_indexes()
+        dal.engine.dispose()
+        swap_shadow(db_url, shadow)
+        self.assertEqual({'GO': 1}, ontologies_terms(db_url))
+        self.assertEqual({}, ontologies_terms(shadow))
+        # release db is not replaced with a much smaller one
+        create_shadow(db_url)
+        init_schema(shadow)
+        with self.assertRaises(RuntimeError):
+            validate_shadow(shadow, db_url)
+        dal.engine.dispose()
+
+    def testIncrementalLoad(self):
+        synthetic = SyntheticOntology('syn', 40)
+        edges_file = join(self.tmp_dir, 'syn.obo')
+        # relation changes are detected from the edges dump, terms relations are not fetched to be hashed
+        options = dict(incremental=True, extraction='bulk', edges_files={'SYN': edges_file})
+        with OLSStandIn([synthetic]) as stand_in:
+            synthetic.write_obo(edges_file)
+            self.assertFalse(term_hash_table.exists(dal.engine))
+            loader = self.syn_loader(stand_in, **options)
+            self.assertTrue(term_hash_table.exists(dal.engine))
+            with dal.session_scope() as session:
+                loader.load_ontology('syn', session)
+            self.assertEqual((40, 0), loader.load_ontology_terms('syn'))
+            loader.update_version('syn')
+            self.assertFalse(loader.ontology_changed('syn'))
+            with dal.session_scope() as session:
+                expected = [session.query(model).count() for model in (Term, Relation, Synonym, AltId)]
+                self.assertEqual(40, session.query(term_hash_table).count())
+            # nothing changed
+            self.assertEqual((0, 0), loader.load_ontology_terms('syn'))
+            self.assertEqual(40, len(loader.unchanged))
+            self.assertEqual(0, stand_in.requests['parents'] + stand_in.requests['part_of'])
+            term = synthetic.term
+            synthetic.term = lambda index, site: dict(term(index, site), label='changed term', synonyms=[]) \
+                if index == 3 else term(index, site)
+            self.assertEqual((1, 0), loader.load_ontology_terms('syn'))
+        with dal.session_scope() as session:
+            self.assertEqual(expected[:2], [session.query(model).count() for model in (Term, Relation)])
+            self.assertEqual(expected[2] - 1, session.query(Synonym).count())
+            m_term = session.query(Term).filter_by(accession='SYN:0000003').one()
+            self.assertEqual('changed term', m_term.name)
+            self.assertEqual(1, len(m_term.parent_terms))
+        # next release: SYN:0000038 parent changed from SYN:0000009 to SYN:0000005, SYN:0000039 removed
+        ontology, parents = synthetic.ontology, synthetic.parents
+        synthetic.ontology = lambda site: dict(ontology(site), updated='2020-02-01T00:00:00.000+0000')
+        synthetic.parents = lambda index: [5] if index == 38 else parents(index)
+        synthetic.n_terms = 39
+        with OLSStandIn([synthetic]) as stand_in:
+            synthetic.write_obo(edges_file)
+            loader = self.syn_loader(stand_in, **options)
+            self.assertTrue(loader.ontology_changed('syn'))
+            self.assertEqual((5, 0), loader.load_ontology_terms('syn'))
+            # synthetic alt ids of every tenth term depend on the number of terms
+            self.assertEqual(['SYN:00000%s' % i for i in ('01', '11', '21', '31', '38')], sorted(loader.hashes))
+            self.assertEqual(34, len(loader.unchanged))
+            self.assertEqual(1, loader.remove_absent_terms('syn'))
+            self.assertEqual(0, loader.remove_absent_terms('syn'))
+        with dal.session_scope() as session:
+            self.assertEqual(expected[0] - 1, session.query(Term).count())
+            self.assertEqual(39, session.query(term_hash_table).count())
+            self.assertIsNone(session.query(Term).filter_by(accession='SYN:0000039').one_or_none())
+            m_term = session.query(Term).filter_by(accession='SYN:0000038').one()
+            # part_of SYN:0000002 loaded again, is_a SYN:0000009 replaced
+            self.assertEqual(['SYN:0000002', 'SYN:0000005'],
+                             sorted(relation.parent_term.accession for relation in m_term.parent_terms))
+
+    def testClosure(self):
+        with dal.session_scope() as session:
+            m_ontology = Ontology(name='GO', namespace='biological_process')
+            is_a = RelationType(name='is_a')
+            regulates = RelationType(name='regulates')
+            terms = [Term(accession='GO:000000%s' % i, name='term %s' % i, ontology=m_ontology) for i in range(5)]
+            # obsolete term relations are ignored
+            terms.append(Term(accession='GO:0000005', name='term 5', ontology=m_ontology, is_obsolete=1))
+            session.add_all(terms)
+            # diamond 3 -> (1, 2) -> 0, cycle 0 -> 4 -> 0, ignored relation type
+            for child, parent, relation_type in ((1, 0, is_a), (2, 0, is_a), (3, 1, is_a), (3, 2, is_a),
+                                                 (3, 1, regulates), (0, 4, is_a), (4, 0, is_a), (2, 1, regulates),
+                                                 (5, 0, is_a)):
+                session.add(Relation(child_term=terms[child], parent_term=terms[parent], relation_type=relation_type,
+                                     ontology=m_ontology, intersection_of=0))
+        self.assertEqual(21, self.loader.load_closure('GO'))
+        with dal.session_scope() as session:
+            ids = {m_term.term_id: int(m_term.accession[-1]) for m_term in session.query(Term)}
+            rows = {(ids[closure.child_term_id], ids[closure.parent_term_id],
+                     ids.get(closure.subparent_term_id), closure.distance) for closure in session.query(Closure)}
+        self.assertEqual(21, len(rows))
+        self.assertIn((3, 3, None, 0), rows)
+        self.assertIn((3, 0, 1, 2), rows)
+        self.assertIn((3, 0, 2, 2), rows)
+        self.assertIn((3, 4, 0, 3), rows)
+        self.assertIn((0, 0, 4, 2), rows)
+        self.assertNotIn((2, 1, 2, 1), rows)
+        self.assertNotIn(5, {child for child, _, _, _ in rows})
+
+    def testClosureUpdate(self):
+        with dal.session_scope() as session:
+            m_ontology = Ontology(name='GO', namespace='biological_process')
+            is_a = RelationType(name='is_a')
+            terms = [Term(accession='GO:000000%s' % i, name='term %s' % i, ontology=m_ontology) for i in range(6)]
+            session.add_all(terms)
+            for child, parent in ((1, 0), (2, 0), (3, 1), (4, 3), (5, 2)):
+                session.add(Relation(child_term=terms[child], parent_term=terms[parent], relation_type=is_a,
+                                     ontology=m_ontology, intersection_of=0))
+        self.loader.load_closure('GO')
+        with dal.session_scope() as session:
+            # 3 moved from 1 to 2
+            session.query(Relation).filter(Relation.child_term.has(accession='GO:0000003')).delete(
+                synchronize_session=False)
+            session.add(Relation(child_term=session.query(Term).filter_by(accession='GO:0000003').one(),
+                                 parent_term=session.query(Term).filter_by(accession='GO:0000002').one(),
+                                 relation_type=session.query(RelationType).one(),
+                                 ontology=session.query(Ontology).one(), intersection_of=0))
+        changes = self.loader.update_closure('GO')
+        # only 3 and its descendant 4 computed again
+        self.assertEqual(2, changes['terms'])
+        self.assertEqual(4, changes['deleted'])
+        self.assertEqual(4, changes['inserted'])
+        with dal.session_scope() as session:
+            updated = {(closure.child_term_id, closure.parent_term_id, closure.subparent_term_id, closure.distance)
+                       for closure in session.query(Closure)}
+        self.loader.load_closure('GO')
+        with dal.session_scope() as session:
+            self.assertEqual({(closure.child_term_id, closure.parent_term_id, closure.subparent_term_id,
+                               closure.distance) for closure in session.query(Closure)}, updated)
+        self.assertEqual(0, self.loader.update_closure('GO')['terms'])
+
+    def testParallelClosures(self):
+        if ':memory:' in self.db_url:
+            self.skipTest('Workers processes need a db file')
+        with dal.session_scope() as session:
+            is_a = RelationType(name='is_a')
+            part_of = RelationType(name='part_of')
+            ontologies = [Ontology(name='GO', namespace='biological_process'),
+                          Ontology(name='GO', namespace='cellular_component'),
+                          Ontology(name='SO', namespace='sequence')]
+            terms = [Term(accession='%s:000000%s' % (ontologies[i % 3].name, i), name='term %s' % i,
+                          ontology=ontologies[i % 3]) for i in range(9)]
+            session.add_all(terms)
+            # 8 (SO) part of 4 (GO) is only walked up to 4 by SO closure
+            for child, parent, relation_type in ((3, 0, is_a), (6, 3, is_a), (4, 3, part_of), (7, 1, is_a),
+                                                 (8, 4, part_of), (5, 2, is_a), (8, 5, is_a)):
+                session.add(Relation(child_term=terms[child], parent_term=terms[parent], relation_type=relation_type,
+                                     ontology=terms[child].ontology, intersection_of=0))
+
+        def closure_rows():
+            with dal.session_scope() as session:
+                return sorted((closure.child_term_id, closure.parent_term_id, closure.subparent_term_id,
+                               closure.distance, closure.ontology_id) for closure in session.query(Closure))
+
+        expected = self.loader.load_closure('GO') + self.loader.load_closure('SO')
+        rows = closure_rows()
+        self.loader.options.update(closure_workers=2)
+        counts = self.loader.load_closures()
+        self.assertEqual({'GO': 12, 'SO': 7}, dict(counts))
+        self.assertEqual(expected, sum(counts.values()))
+        self.assertEqual(rows, closure_rows())
+        self.assertEqual([], [name for name in os.listdir(log_dir) if name.startswith('closure.')])
+
+    def testOntologyGraph(self):
+        synthetic = SyntheticOntology('syn', 60)
+        with OLSStandIn([synthetic]) as stand_in:
+            loader = self.syn_loader(stand_in, graph=True)
+            loader.load_ontology_terms('syn', 0, 40)
+            loaded = loader.ontology_graph()
+        with dal.engine.connect() as connection:
+            graph = OntologyGraph.from_db(connection, ['SYN'])
+        accession = 'SYN:{:07d}'.format
+        for index in range(40):
+            ancestors = {accession(ancestor) for ancestor in synthetic.ancestors(index)}
+            self.assertEqual(ancestors, graph.ancestors(accession(index), ['is_a']))
+            self.assertEqual(ancestors, loaded.ancestors(accession(index), ['is_a']))
+            self.assertEqual(len(ancestors), graph.depth(accession(index), ['is_a']))
+        self.assertEqual(sorted(loaded.accessions), sorted(graph.accessions))
+        self.assertEqual(['SYN:0000000'], graph.roots(['is_a']))
+        self.assertEqual({accession(index) for index in synthetic.descendants(1) if index < 40},
+                         graph.descendants(accession(1), ['is_a']))
+        self.assertEqual([accession(index) for index in synthetic.children(2)], graph.children(accession(2), ['is_a']))
+        self.assertEqual([accession(1)], graph.parents(accession(5)))
+        self.assertNotIn(accession(0), graph.leaves())
+        self.assertIn(accession(39), graph.leaves())
+        with self.assertRaises(KeyError):
+            graph.ancestors('SYN:9999999')
+
+    def testAncestorIndex(self):
+        with dal.session_scope() as session:
+            m_ontology = Ontology(name='GO', namespace='biological_process')
+            is_a = RelationType(name='is_a')
+            part_of = RelationType(name='part_of')
+            regulates = RelationType(name='regulates')
+            terms = [Term(accession='GO:000000%s' % i, name='term %s' % i, ontology=m_ontology) for i in range(7)]
+            session.add_all(terms)
+            # 3 -> (1, 2) -> 0, 4 part of 3, 5 -> 1, cycle 6 -> 0 -> 6 ignored relation type
+            for child, parent, relation_type in ((1, 0, is_a), (2, 0, is_a), (3, 1, is_a), (3, 2, is_a),
+                                                 (4, 3, part_of), (5, 1, is_a), (6, 0, regulates), (0, 6, regulates)):
+                session.add(Relation(child_term=terms[child], parent_term=terms[parent], relation_type=relation_type,
+                                     ontology=m_ontology, intersection_of=0))
+        index = self.loader.ancestor_index()
+        accession = 'GO:000000{}'.format
+        self.assertTrue(index.is_a(accession(4), accession(0)))
+        self.assertTrue(index.is_a(accession(3), accession(3)))
+        self.assertFalse(index.is_a(accession(0), accession(4)))
+        self.assertFalse(index.is_a(accession(6), accession(0)))
+        self.assertEqual({accession(0), accession(1)}, index.common_ancestors(accession(4), accession(5)))
+        self.assertEqual([accession(1)], index.lowest_common_ancestors(accession(4), accession(5)))
+        self.assertEqual([accession(3)], index.lowest_common_ancestors(accession(4), accession(3)))
+        self.assertEqual([accession(0)], index.lowest_common_ancestors(accession(2), accession(5)))
+        self.assertEqual([], index.lowest_common_ancestors(accession(6), accession(5)))
+        # reloaded as long as db is unchanged
+        path = index_path(self.loader.db_url, log_dir)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(list(index.ancestors), list(self.loader.ancestor_index().ancestors))
+        with open(path, 'rb') as f:
+            self.assertEqual(index.signature, json.loads(f.readline().decode('utf-8'))['signature'])
+        self.assertIsNone(AncestorIndex.load(path, 'other db'))
+        with self.assertRaises(ValueError):
+            index_path(self.loader.db_url, None)
+        with dal.session_scope() as session:
+            session.add(Relation(child_term=session.query(Term).filter_by(accession=accession(6)).one(),
+                                 parent_term=session.query(Term).filter_by(accession=accession(5)).one(),
+                                 relation_type=session.query(RelationType).filter_by(name='is_a').one(),
+                                 ontology=session.query(Ontology).one(), intersection_of=0))
+        self.assertTrue(self.loader.ancestor_index().is_a(accession(6), accession(0)))
+        os.remove(path)
+
+    def testDeferredIndexes(self):
+        init_schema(self.db_url, full_load=True)
+        self.assertNotIn('term_name_idx', dal.existing_indexes(Term.__table__))
+        self.assertIn('term_ontology_acc_idx', dal.existing_indexes(Term.__table__))
+        # needed to wipe terms and compute closures while loading
+        self.assertIn('ix_relation_parent_term_id', dal.existing_indexes(Relation.__table__))
+        self.assertIn('parent_subparent_idx', dal.existing_indexes(Closure.__table__))
+        built = dal.create_secondary_indexes()
+        self.assertIn('term_name_idx', built)
+        self.assertIn('synonym_name_idx', built)
+        self.assertIn('term_name_idx', dal.existing_indexes(Term.__table__))
+        self.assertEqual([], dal.create_secondary_indexes())
+
     def testLogger(self):
         self.loader = OlsLoader(self.db_url, echo=False, output_dir=log_dir, verbosity='DEBUG')
 